@@ -15,6 +15,8 @@ class Settings(BaseSettings):
     # OpenAI (opcional)
     OPENAI_API_KEY: str = ""
 
+    TRANSCRIPTION_WORKERS: int = 2
+
     # Claude (opcional)
     CLAUDE_API_KEY: str = ""
 
@@ -22,6 +24,9 @@ class Settings(BaseSettings):
     EVOLUTION_API_URL: str = "http://localhost:8080"
     EVOLUTION_API_KEY: str = ""
     WHATSAPP_INSTANCE_NAME: str = "clinica-estetica"
+    WHATSAPP_RATE_LIMIT_PER_SECOND: float = 5
+    WEBHOOK_QUEUE_PATH: str = "webhook_queue.db"
+    WEBHOOK_WORKERS: int = 4
 
     # Payment Gateways
     MERCADOPAGO_ACCESS_TOKEN: str = ""
@@ -35,6 +40,20 @@ class Settings(BaseSettings):
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
 
+    # Agenda
+    CLINIC_TIMEZONE: str = "America/Sao_Paulo"
+
+    # Dados da clínica (respostas automáticas do WhatsApp)
+    CLINIC_NAME: str = "Clínica Estética"
+    CLINIC_ADDRESS: str = ""
+    CLINIC_PHONE: str = ""
+    CLINIC_OPENING_HOURS: str = ""  # Usado quando não há availability_settings
+    CLINIC_PAYMENT_METHODS: str = ""
+
+    # Paginação das listagens
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 200
+
     # Environment
     ENVIRONMENT: str = "development"
     DEBUG: bool = True
@@ -0,0 +1,285 @@
+"""
+Camada de acesso a dados assíncrona (PostgREST do Supabase)
+
+Substitui o cliente síncrono `supabase_admin` nos routers: um único
+httpx.AsyncClient com HTTP/2 e keep-alive é compartilhado por todo o
+worker, e o query builder é aguardável (`await db.table(...).execute()`),
+então uma consulta lenta não bloqueia o event loop.
+"""
+import httpx
+import os
+from typing import Any, Dict, List, Optional
+
+# Mesmo padrão de app/core/supabase.py: os.getenv direto para não
+# depender do Settings na inicialização da Vercel
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DB_MAX_KEEPALIVE_CONNECTIONS", "20"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+
+
+class APIError(Exception):
+    """
+    Erro retornado pelo PostgREST (mesmos campos do postgrest-py)
+    """
+
+    def __init__(self, error: Dict[str, Any], status_code: int = 500):
+        self.message = error.get("message")
+        self.code = error.get("code")
+        self.details = error.get("details")
+        self.hint = error.get("hint")
+        self.status_code = status_code
+        super().__init__(self.message or str(error))
+
+
+class APIResponse:
+    """
+    Resultado de uma consulta: `data` e, quando pedido, `count`
+    """
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class QueryBuilder:
+    """
+    Query builder aguardável com a mesma interface do cliente supabase-py
+    """
+
+    def __init__(self, database: "Database", path: str, method: str = "GET", json: Any = None):
+        self._database = database
+        self._path = path
+        self._method = method
+        self._json = json
+        self._params: List[tuple] = []
+        self._headers: Dict[str, str] = {}
+        self._prefer: List[str] = []
+        self._orders: List[str] = []
+        self._maybe_single = False
+
+    # Operações
+
+    def select(self, columns: str = "*", count: Optional[str] = None, head: bool = False) -> "QueryBuilder":
+        self._params.append(("select", columns))
+        if count:
+            self._prefer.append(f"count={count}")
+        if head:
+            self._method = "HEAD"
+        return self
+
+    def insert(self, data: Any, returning: str = "representation") -> "QueryBuilder":
+        """
+        returning="minimal" evita devolver as linhas inseridas (lotes grandes)
+        """
+        self._method = "POST"
+        self._json = data
+        self._prefer.append(f"return={returning}")
+        return self
+
+    def upsert(
+        self,
+        data: Any,
+        on_conflict: Optional[str] = None,
+        returning: str = "representation",
+        ignore_duplicates: bool = False
+    ) -> "QueryBuilder":
+        """
+        ignore_duplicates=True mantém a linha existente em vez de atualizá-la
+        """
+        self.insert(data, returning)
+        self._prefer.append("resolution=ignore-duplicates" if ignore_duplicates else "resolution=merge-duplicates")
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def update(self, data: Dict[str, Any]) -> "QueryBuilder":
+        self._method = "PATCH"
+        self._json = data
+        self._prefer.append("return=representation")
+        return self
+
+    def delete(self) -> "QueryBuilder":
+        self._method = "DELETE"
+        self._prefer.append("return=representation")
+        return self
+
+    # Filtros
+
+    def filter(self, column: str, operator: str, value: Any) -> "QueryBuilder":
+        self._params.append((column, f"{operator}.{value}"))
+        return self
+
+    def eq(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "neq", value)
+
+    def gt(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "gte", value)
+
+    def lt(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "lte", value)
+
+    def like(self, column: str, pattern: str) -> "QueryBuilder":
+        return self.filter(column, "like", pattern)
+
+    def ilike(self, column: str, pattern: str) -> "QueryBuilder":
+        return self.filter(column, "ilike", pattern)
+
+    def is_(self, column: str, value: Any) -> "QueryBuilder":
+        return self.filter(column, "is", "null" if value is None else value)
+
+    def in_(self, column: str, values: List[Any]) -> "QueryBuilder":
+        return self.filter(column, "in", f"({','.join(str(v) for v in values)})")
+
+    def or_(self, filters: str) -> "QueryBuilder":
+        self._params.append(("or", f"({filters})"))
+        return self
+
+    def and_(self, filters: str) -> "QueryBuilder":
+        self._params.append(("and", f"({filters})"))
+        return self
+
+    # Modificadores
+
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None) -> "QueryBuilder":
+        order = f"{column}.{'desc' if desc else 'asc'}"
+        if nullsfirst is not None:
+            order += ".nullsfirst" if nullsfirst else ".nullslast"
+        self._orders.append(order)
+        return self
+
+    def limit(self, size: int) -> "QueryBuilder":
+        self._params.append(("limit", str(size)))
+        return self
+
+    def range(self, start: int, end: int) -> "QueryBuilder":
+        self._params.append(("offset", str(start)))
+        self._params.append(("limit", str(end - start + 1)))
+        return self
+
+    def single(self) -> "QueryBuilder":
+        """
+        Exige exatamente uma linha (erro PGRST116 caso contrário)
+        """
+        self._headers["Accept"] = "application/vnd.pgrst.object+json"
+        return self
+
+    def maybe_single(self) -> "QueryBuilder":
+        """
+        Como single(), mas retorna data=None quando nada é encontrado
+        """
+        self._maybe_single = True
+        return self.single()
+
+    async def execute(self) -> APIResponse:
+        params = list(self._params)
+        if self._orders:
+            params.append(("order", ",".join(self._orders)))
+
+        headers = dict(self._headers)
+        if self._prefer:
+            headers["Prefer"] = ",".join(self._prefer)
+
+        response = await self._database.client.request(
+            self._method,
+            self._path,
+            params=params,
+            headers=headers,
+            json=self._json
+        )
+
+        if response.status_code >= 400:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {"message": response.text}
+            if self._maybe_single and error.get("code") == "PGRST116":
+                return APIResponse(data=None)
+            raise APIError(error, response.status_code)
+
+        data = response.json() if response.content else None
+        return APIResponse(data=data, count=_parse_count(response.headers.get("content-range")))
+
+
+def quote(value: Any) -> str:
+    """
+    Valor entre aspas para filtros compostos (or=/and=): vírgulas, pontos,
+    dois-pontos e parênteses vindos do usuário não quebram a expressão
+    """
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def escape_like(value: str) -> str:
+    """
+    Escapa os curingas de LIKE/ILIKE (% e _) de um texto digitado pelo usuário.
+    O PostgREST converte todo `*` do padrão em `%`, mesmo escapado; ele vira
+    `_` (um caractere qualquer), que ainda casa com o `*` literal
+    """
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "_")
+
+
+def _parse_count(content_range: Optional[str]) -> Optional[int]:
+    """
+    Extrai o total de "0-24/3573" (Content-Range do PostgREST)
+    """
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.split("/")[-1]
+    return int(total) if total.isdigit() else None
+
+
+class Database:
+    """
+    Cliente PostgREST com um pool de conexões HTTP/2 compartilhado
+    """
+
+    def __init__(self, url: str, key: str):
+        self.rest_url = f"{url}/rest/v1"
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}"
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Criado sob demanda: na Vercel não há evento de startup garantido
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.rest_url,
+                headers=self.headers,
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=DB_MAX_CONNECTIONS,
+                    max_keepalive_connections=DB_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=30
+                ),
+                timeout=httpx.Timeout(DB_TIMEOUT_SECONDS, connect=5.0)
+            )
+        return self._client
+
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, f"/{name}")
+
+    def rpc(self, function: str, params: Optional[Dict[str, Any]] = None) -> QueryBuilder:
+        return QueryBuilder(self, f"/rpc/{function}", method="POST", json=params or {})
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+db = Database(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
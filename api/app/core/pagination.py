@@ -0,0 +1,147 @@
+"""
+Paginação por keyset e projeção de campos para os endpoints de listagem
+
+O cursor é opaco (base64 do valor da coluna de ordenação e do id da última
+linha entregue); a página seguinte começa logo depois dele, então o custo
+não cresce com a profundidade como no OFFSET. `fields=` escolhe as colunas
+(e relações) devolvidas, dentro de uma lista permitida por endpoint.
+`fetch_all` usa o mesmo keyset para leituras internas que precisam de todas
+as linhas (uma consulta única seria cortada pelo max-rows do PostgREST).
+"""
+import base64
+import binascii
+import json
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import HTTPException, Query
+from app.core.config import settings
+from app.core.database import QueryBuilder, quote
+
+
+class PageParams:
+    """
+    Dependência FastAPI: `page: PageParams = Depends()`
+    """
+
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+        limit: Optional[int] = Query(None, ge=1, description="Itens por página"),
+        fields: Optional[str] = Query(None, description="Campos separados por vírgula")
+    ):
+        self.cursor = cursor
+        self.limit = min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX)
+        self.fields = fields
+
+
+class Projection:
+    """
+    Campos que um endpoint aceita em `fields=`: colunas da tabela e relações
+    embutidas (nome -> expressão do select, já restrita às colunas úteis)
+    """
+
+    def __init__(self, columns: List[str], embeds: Optional[Dict[str, str]] = None, default: Optional[List[str]] = None):
+        self.columns = columns
+        self.embeds = embeds or {}
+        self.default = default or columns + list(self.embeds)
+
+    def select(self, fields: Optional[str], required: List[str]) -> str:
+        names = [f.strip() for f in fields.split(",") if f.strip()] if fields else self.default
+
+        unknown = [n for n in names if n not in self.columns and n not in self.embeds]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+        # Colunas do cursor sempre presentes
+        selected = list(dict.fromkeys(required + names))
+        return ",".join(self.embeds.get(name, name) for name in selected)
+
+
+def encode_cursor(value: Any, row_id: str) -> str:
+    payload = json.dumps({"v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursor = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(cursor, dict) or "id" not in cursor:
+            raise ValueError
+        return cursor
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def paginate(
+    query: QueryBuilder,
+    page: PageParams,
+    sort: str,
+    desc: bool = False,
+    nullable: bool = False,
+    id_column: str = "id"
+) -> Dict[str, Any]:
+    """
+    Ordena por (sort, id_column), aplica o cursor e busca limit + 1 linhas para
+    saber se há próxima página. Retorna {"items", "next_cursor"}
+    Com nullable=True, linhas com sort NULL vêm por último nas duas direções
+    """
+    op = "lt" if desc else "gt"
+
+    if page.cursor:
+        cursor = decode_cursor(page.cursor)
+        after_id = quote(cursor["id"])
+
+        # Via and=(...) para não colidir com um or= do próprio endpoint
+        if cursor.get("v") is None:
+            query = query.and_(f"{sort}.is.null,{id_column}.{op}.{after_id}")
+        else:
+            value = quote(cursor["v"])
+            conditions = f"{sort}.{op}.{value},and({sort}.eq.{value},{id_column}.{op}.{after_id})"
+            if nullable:
+                conditions += f",{sort}.is.null"
+            query = query.and_(f"or({conditions})")
+
+    result = await query\
+        .order(sort, desc=desc, nullsfirst=False if nullable else None)\
+        .order(id_column, desc=desc)\
+        .limit(page.limit + 1)\
+        .execute()
+
+    items = result.data[:page.limit]
+    next_cursor = None
+    if len(result.data) > page.limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last[sort], last[id_column])
+
+    return {"items": items, "next_cursor": next_cursor}
+
+
+FETCH_PAGE_SIZE = 500  # Abaixo do max-rows do PostgREST (1000)
+
+
+async def fetch_all(make_query: Callable[[], QueryBuilder], sort: str = "id", page_size: int = FETCH_PAGE_SIZE) -> List[dict]:
+    """
+    Todas as linhas de `make_query()` (que deve selecionar `sort` e `id`),
+    em páginas ordenadas por (sort, id). `sort` não pode ser nulo
+    """
+    rows: List[dict] = []
+    last: Optional[dict] = None
+
+    while True:
+        query = make_query()
+        if last is not None:
+            after_id = quote(last["id"])
+            if sort == "id":
+                query = query.and_(f"id.gt.{after_id}")
+            else:
+                value = quote(last[sort])
+                query = query.and_(f"or({sort}.gt.{value},and({sort}.eq.{value},id.gt.{after_id}))")
+
+        if sort != "id":
+            query = query.order(sort)
+        page = await query.order("id").limit(page_size).execute()
+        rows.extend(page.data)
+
+        if len(page.data) < page_size:
+            return rows
+        last = page.data[-1]
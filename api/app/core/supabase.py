@@ -5,8 +5,7 @@ import os
 # para evitar problemas de inicialização na Vercel
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
-# Criar clientes (vai dar erro se variáveis não existirem)
+# Cliente usado apenas para Supabase Auth.
+# Consultas às tabelas passam por app.core.database (assíncrono)
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-supabase_admin: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
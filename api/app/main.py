@@ -4,6 +4,16 @@ from fastapi.staticfiles import StaticFiles
 import os
 from dotenv import load_dotenv
 
+from app.core.database import db
+from app.services.notification_service import notification_outbox
+from app.services.whatsapp_service import whatsapp_service
+from app.services.message_log_service import message_log
+from app.services.webhook_queue_service import webhook_queue
+from app.services.ai_service import AIService
+from app.services.transcription_service import transcription_queue
+from app.services.stock_forecast_service import stock_forecaster
+from app.core.config import settings
+
 from app.routers import (
     auth,
     patients,
@@ -57,6 +67,31 @@ app.include_router(dashboard.router, prefix="/api/dashboard", tags=["Dashboard"]
 os.makedirs("uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.on_event("startup")
+async def startup():
+    # Fuso usado pelos triggers e funções SQL (clinic_date): o mesmo da API
+    try:
+        await db.rpc("set_clinic_timezone", {"tz": settings.CLINIC_TIMEZONE}).execute()
+    except Exception as e:
+        print(f"Error setting clinic timezone: {e}")
+    whatsapp_service.start()
+    message_log.start()
+    notification_outbox.start()
+    await webhook_queue.start(whatsapp.process_webhook_event, settings.WEBHOOK_WORKERS)
+    transcription_queue.start(settings.TRANSCRIPTION_WORKERS)
+    stock_forecaster.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stock_forecaster.stop()
+    await transcription_queue.stop()
+    await webhook_queue.stop()
+    await notification_outbox.stop()
+    await whatsapp_service.close()
+    await message_log.stop()
+    await AIService.close()
+    await db.close()
+
 @app.get("/")
 async def root():
     return {
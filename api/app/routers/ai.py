@@ -2,72 +2,96 @@
 Router para serviços de IA
 Transcrição de áudio e resumo de prontuários
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import Optional
+from datetime import date
+import anyio
+import json
 import os
 import uuid
 from app.services.ai_service import AIService
-from app.core.supabase import supabase_admin
+from app.services.transcription_service import transcription_queue
+from app.services.storage_service import StorageService
+from app.core.database import db
+from app.core.pagination import PageParams, Projection, paginate
 
 router = APIRouter()
 
-@router.post("/transcribe")
+AUDIO_RECORD_FIELDS = Projection(
+    columns=[
+        "id", "paciente_id", "professional_id", "agendamento_id", "audio_url", "duration_seconds",
+        "file_size_bytes", "transcription", "ai_summary", "transcription_status", "summary_status",
+        "source", "metadata", "created_at", "updated_at"
+    ],
+    embeds={"profiles": "profiles(id, full_name)"}
+)
+
+@router.post("/transcribe", status_code=202)
 async def transcribe_audio(
+    background_tasks: BackgroundTasks,
     audio: UploadFile = File(...),
     paciente_id: str = Form(...),
     professional_id: str = Form(...),
     agendamento_id: Optional[str] = Form(None)
 ):
     """
-    Transcreve áudio de prontuário usando Whisper
+    Recebe áudio de prontuário e enfileira a transcrição (Whisper)
+    Retorna o record_id imediatamente; acompanhe em /records/{record_id}/status
     """
     # Salvar arquivo temporário
     file_id = str(uuid.uuid4())
     file_ext = os.path.splitext(audio.filename)[1]
     file_path = f"uploads/audio_{file_id}{file_ext}"
 
-    with open(file_path, "wb") as f:
-        content = await audio.read()
-        f.write(content)
-
-    # Obter informações do arquivo
-    file_size = os.path.getsize(file_path)
+    # Gravar em blocos (tamanho e checksum calculados durante a escrita)
+    stored = await StorageService.save_upload(audio, file_path)
 
-    # Criar registro no banco
-    record = supabase_admin.table("medical_audio_records").insert({
+    # Criar registro no banco (entra na fila como pendente)
+    record = await db.table("medical_audio_records").insert({
         "paciente_id": paciente_id,
         "professional_id": professional_id,
         "agendamento_id": agendamento_id,
         "audio_url": file_path,
-        "file_size_bytes": file_size,
-        "transcription_status": "processing"
+        "file_size_bytes": stored["size"],
+        "transcription_status": "pending",
+        "metadata": {"sha256": stored["sha256"]}
     }).execute()
 
-    record_id = record.data[0]["id"]
+    # Sem workers em execução (serverless), processa após a resposta
+    if transcription_queue.running:
+        transcription_queue.notify()
+    else:
+        background_tasks.add_task(transcription_queue.process_pending)
 
-    # Transcrever
-    result = await AIService.transcribe_audio(file_path)
+    return {
+        "success": True,
+        "record_id": record.data[0]["id"],
+        "transcription_status": "pending"
+    }
 
-    if result["success"]:
-        # Atualizar registro
-        supabase_admin.table("medical_audio_records").update({
-            "transcription": result["transcription"],
-            "transcription_status": "completed"
-        }).eq("id", record_id).execute()
+@router.get("/records/{record_id}/status")
+async def get_transcription_status(record_id: str):
+    """
+    Status da transcrição e do resumo (para polling do dashboard)
+    """
+    record = await db.table("medical_audio_records")\
+        .select("id, transcription_status, summary_status, transcription, metadata")\
+        .eq("id", record_id)\
+        .maybe_single()\
+        .execute()
 
-        return {
-            "success": True,
-            "record_id": record_id,
-            "transcription": result["transcription"]
-        }
-    else:
-        # Marcar como falhou
-        supabase_admin.table("medical_audio_records").update({
-            "transcription_status": "failed",
-            "metadata": {"error": result["error"]}
-        }).eq("id", record_id).execute()
+    if not record.data:
+        raise HTTPException(status_code=404, detail="Record not found")
 
-        raise HTTPException(status_code=500, detail=result["error"])
+    return {
+        "success": True,
+        "record_id": record_id,
+        "transcription_status": record.data["transcription_status"],
+        "summary_status": record.data["summary_status"],
+        "transcription": record.data["transcription"],
+        "error": (record.data.get("metadata") or {}).get("error")
+    }
 
 @router.post("/summarize/{record_id}")
 async def summarize_medical_record(record_id: str):
@@ -75,10 +99,10 @@ async def summarize_medical_record(record_id: str):
     Cria resumo estruturado do prontuário a partir da transcrição
     """
     # Buscar registro
-    record = supabase_admin.table("medical_audio_records")\
-        .select("*, pacientes(*)")\
+    record = await db.table("medical_audio_records")\
+        .select("transcription, pacientes(full_name, birth_date, medical_history)")\
         .eq("id", record_id)\
-        .single()\
+        .maybe_single()\
         .execute()
 
     if not record.data:
@@ -88,15 +112,15 @@ async def summarize_medical_record(record_id: str):
         raise HTTPException(status_code=400, detail="No transcription available")
 
     # Atualizar status
-    supabase_admin.table("medical_audio_records").update({
+    await db.table("medical_audio_records").update({
         "summary_status": "processing"
     }).eq("id", record_id).execute()
 
-    # Preparar contexto do paciente
-    patient = record.data["pacientes"]
+    # Preparar contexto do paciente (o mesmo de /stream: mesma entrada no ai_cache)
+    patient = record.data.get("pacientes") or {}
     patient_context = {
-        "name": patient["full_name"],
-        "age": None,  # Calcular se tiver birth_date
+        "name": patient.get("full_name"),
+        "age": patient_age(patient.get("birth_date")),
         "history": patient.get("medical_history", "")
     }
 
@@ -108,7 +132,7 @@ async def summarize_medical_record(record_id: str):
 
     if result["success"]:
         # Salvar resumo
-        supabase_admin.table("medical_audio_records").update({
+        await db.table("medical_audio_records").update({
             "ai_summary": result["summary"],
             "summary_status": "completed"
         }).eq("id", record_id).execute()
@@ -118,31 +142,95 @@ async def summarize_medical_record(record_id: str):
             "summary": result["summary"]
         }
     else:
-        supabase_admin.table("medical_audio_records").update({
+        await db.table("medical_audio_records").update({
             "summary_status": "failed"
         }).eq("id", record_id).execute()
 
         raise HTTPException(status_code=500, detail=result["error"])
 
-@router.get("/records/patient/{paciente_id}")
-async def get_patient_audio_records(paciente_id: str):
+def sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/summarize/{record_id}/stream")
+async def stream_medical_summary(record_id: str):
     """
-    Lista todos os registros de áudio de um paciente
+    Versão em server-sent events de /summarize: envia os trechos do resumo
+    conforme são gerados ("data: {"delta": ...}") e, ao final, grava o texto
+    completo e emite "event: done"
     """
-    records = supabase_admin.table("medical_audio_records")\
-        .select("*, profiles(*)")\
-        .eq("paciente_id", paciente_id)\
-        .order("created_at", desc=True)\
+    record = await db.table("medical_audio_records")\
+        .select("transcription, pacientes(full_name, birth_date, medical_history)")\
+        .eq("id", record_id)\
+        .maybe_single()\
         .execute()
 
-    return {"success": True, "records": records.data}
+    if not record.data:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    if not record.data.get("transcription"):
+        raise HTTPException(status_code=400, detail="No transcription available")
+
+    patient = record.data.get("pacientes") or {}
+    patient_context = {
+        "name": patient.get("full_name"),
+        "age": patient_age(patient.get("birth_date")),
+        "history": patient.get("medical_history", "")
+    }
+
+    async def events():
+        # Comentário SSE: o navegador recebe os cabeçalhos antes do primeiro token
+        yield ": stream-open\n\n"
+
+        await db.table("medical_audio_records").update({
+            "summary_status": "processing"
+        }).eq("id", record_id).execute()
+
+        parts = []
+        update = {"summary_status": "failed"}
+        try:
+            async for delta in AIService.stream_medical_summary(record.data["transcription"], patient_context):
+                parts.append(delta)
+                yield sse({"delta": delta})
+            # Resposta vazia do modelo conta como falha (status "failed", nada em cache)
+            if not "".join(parts).strip():
+                raise ValueError("Empty summary returned by model")
+            update = {"ai_summary": "".join(parts), "summary_status": "completed"}
+        except Exception as e:
+            yield sse({"error": str(e)}, event="error")
+            return
+        finally:
+            # Também quando o cliente desconecta no meio (CancelledError/GeneratorExit):
+            # o status não fica preso em "processing"
+            with anyio.CancelScope(shield=True):
+                await db.table("medical_audio_records").update(update).eq("id", record_id).execute()
+
+        yield sse({"summary": update["ai_summary"]}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/records/patient/{paciente_id}")
+async def get_patient_audio_records(paciente_id: str, page: PageParams = Depends()):
+    """
+    Lista os registros de áudio de um paciente (mais recentes primeiro, paginado)
+    """
+    query = db.table("medical_audio_records")\
+        .select(AUDIO_RECORD_FIELDS.select(page.fields, ["id", "created_at"]))\
+        .eq("paciente_id", paciente_id)
+    records = await paginate(query, page, "created_at", desc=True)
+
+    return {"success": True, "records": records["items"], "next_cursor": records["next_cursor"]}
 
 @router.get("/records/{record_id}")
 async def get_audio_record(record_id: str):
     """
     Obtém detalhes de um registro de áudio específico
     """
-    record = supabase_admin.table("medical_audio_records")\
+    record = await db.table("medical_audio_records")\
         .select("*, pacientes(*), profiles(*)")\
         .eq("id", record_id)\
         .single()\
@@ -158,7 +246,7 @@ async def extract_key_information(record_id: str):
     """
     Extrai informações estruturadas da transcrição
     """
-    record = supabase_admin.table("medical_audio_records")\
+    record = await db.table("medical_audio_records")\
         .select("*")\
         .eq("id", record_id)\
         .single()\
@@ -174,7 +262,7 @@ async def extract_key_information(record_id: str):
         current_metadata = record.data.get("metadata", {})
         current_metadata["extracted_info"] = result["data"]
 
-        supabase_admin.table("medical_audio_records").update({
+        await db.table("medical_audio_records").update({
             "metadata": current_metadata
         }).eq("id", record_id).execute()
 
@@ -184,3 +272,63 @@ async def extract_key_information(record_id: str):
         }
     else:
         raise HTTPException(status_code=500, detail=result["error"])
+
+def patient_age(birth_date: Optional[str]) -> Optional[int]:
+    if not birth_date:
+        return None
+    born = date.fromisoformat(birth_date[:10])
+    today = date.today()
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+@router.post("/analyze/{record_id}")
+async def analyze_medical_record(record_id: str):
+    """
+    Resumo estruturado + extração de informações em uma única chamada ao modelo
+    Lê o registro uma vez e grava resumo e metadata na mesma atualização
+    """
+    record = await db.table("medical_audio_records")\
+        .select("transcription, metadata, pacientes(full_name, birth_date, medical_history)")\
+        .eq("id", record_id)\
+        .maybe_single()\
+        .execute()
+
+    if not record.data:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    if not record.data.get("transcription"):
+        raise HTTPException(status_code=400, detail="No transcription available")
+
+    patient = record.data.get("pacientes") or {}
+    patient_context = {
+        "name": patient.get("full_name"),
+        "age": patient_age(patient.get("birth_date")),
+        "history": patient.get("medical_history", "")
+    }
+
+    result = await AIService.analyze_medical_record(record.data["transcription"], patient_context)
+
+    if not result["success"]:
+        await db.table("medical_audio_records").update({
+            "summary_status": "failed"
+        }).eq("id", record_id).execute()
+
+        raise HTTPException(status_code=500, detail=result["error"])
+
+    metadata = {
+        **(record.data.get("metadata") or {}),
+        "summary_sections": result["sections"],
+        "extracted_info": result["data"]
+    }
+
+    await db.table("medical_audio_records").update({
+        "ai_summary": result["summary"],
+        "summary_status": "completed",
+        "metadata": metadata
+    }).eq("id", record_id).execute()
+
+    return {
+        "success": True,
+        "summary": result["summary"],
+        "sections": result["sections"],
+        "extracted_info": result["data"]
+    }
@@ -1,15 +1,30 @@
 """
 Router para Agendamentos
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel
-from app.core.supabase import supabase_admin
-from app.services.whatsapp_service import whatsapp_service
+from app.core.database import db, APIError
+from app.core.pagination import PageParams, Projection, paginate
+from app.services.notification_service import notification_outbox
+from app.services.availability_service import AvailabilityService, MAX_RANGE_DAYS
 
 router = APIRouter()
 
+APPOINTMENT_FIELDS = Projection(
+    columns=[
+        "id", "paciente_id", "procedimento_id", "professional_id", "start_time", "end_time",
+        "status", "notes", "reminder_sent", "confirmation_sent", "source", "whatsapp_message_id",
+        "created_at", "updated_at"
+    ],
+    embeds={
+        "pacientes": "pacientes(id, full_name, phone, whatsapp_number)",
+        "procedimentos": "procedimentos(id, name, duration, price)",
+        "profiles": "profiles(id, full_name)"
+    }
+)
+
 class AppointmentCreate(BaseModel):
     paciente_id: str
     procedimento_id: str
@@ -25,55 +40,40 @@ class AppointmentUpdate(BaseModel):
     status: Optional[str] = None
     notes: Optional[str] = None
 
+def raise_for_schedule_error(error: APIError):
+    """
+    Converte violações das constraints da agenda em erros HTTP
+    """
+    if error.code == "23P01":  # exclusion_violation (agendamentos_no_overlap)
+        raise HTTPException(status_code=409, detail="Horário indisponível")
+    if error.code == "23514":  # check_violation (agendamentos_valid_range)
+        raise HTTPException(status_code=400, detail="Horário de término deve ser após o início")
+    raise error
+
 @router.post("/")
-async def create_appointment(appointment: AppointmentCreate):
+async def create_appointment(appointment: AppointmentCreate, background_tasks: BackgroundTasks):
     """
     Cria novo agendamento
     """
-    # Verificar conflitos de horário
-    conflicts = supabase_admin.table("agendamentos")\
-        .select("*")\
-        .eq("professional_id", appointment.professional_id)\
-        .gte("start_time", appointment.start_time)\
-        .lte("start_time", appointment.end_time)\
-        .neq("status", "cancelled")\
-        .execute()
-
-    if conflicts.data:
-        raise HTTPException(status_code=400, detail="Horário indisponível")
-
-    # Criar agendamento
-    result = supabase_admin.table("agendamentos").insert({
-        "paciente_id": appointment.paciente_id,
-        "procedimento_id": appointment.procedimento_id,
-        "professional_id": appointment.professional_id,
-        "start_time": appointment.start_time,
-        "end_time": appointment.end_time,
-        "notes": appointment.notes,
-        "source": appointment.source,
-        "status": "pending"
-    }).execute()
-
-    appointment_id = result.data[0]["id"]
-
-    # Enviar confirmação por WhatsApp
-    paciente = supabase_admin.table("pacientes").select("*").eq("id", appointment.paciente_id).single().execute()
-    procedimento = supabase_admin.table("procedimentos").select("*").eq("id", appointment.procedimento_id).single().execute()
-    professional = supabase_admin.table("profiles").select("*").eq("id", appointment.professional_id).single().execute()
-
-    if paciente.data and paciente.data.get("whatsapp_number"):
-        start_dt = datetime.fromisoformat(appointment.start_time.replace("Z", "+00:00"))
-
-        await whatsapp_service.send_appointment_confirmation(
-            paciente.data["whatsapp_number"],
-            {
-                "patient_name": paciente.data["full_name"],
-                "procedure": procedimento.data["name"],
-                "date": start_dt.strftime("%d/%m/%Y"),
-                "time": start_dt.strftime("%H:%M"),
-                "professional": professional.data["full_name"]
-            }
-        )
+    # Criar agendamento: conflitos são barrados pela constraint
+    # agendamentos_no_overlap no próprio INSERT (uma única ida ao banco)
+    try:
+        result = await db.table("agendamentos").insert({
+            "paciente_id": appointment.paciente_id,
+            "procedimento_id": appointment.procedimento_id,
+            "professional_id": appointment.professional_id,
+            "start_time": appointment.start_time,
+            "end_time": appointment.end_time,
+            "notes": appointment.notes,
+            "source": appointment.source,
+            "status": "pending"
+        }).execute()
+    except APIError as e:
+        raise_for_schedule_error(e)
+
+    # Confirmação por WhatsApp: o trigger já enfileirou no outbox,
+    # a entrega acontece depois da resposta
+    background_tasks.add_task(notification_outbox.process_pending)
 
     return {"success": True, "appointment": result.data[0]}
 
@@ -83,12 +83,13 @@ async def list_appointments(
     paciente_id: Optional[str] = None,
     status: Optional[str] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    page: PageParams = Depends()
 ):
     """
-    Lista agendamentos com filtros
+    Lista agendamentos com filtros (paginado por start_time)
     """
-    query = supabase_admin.table("agendamentos").select("*, pacientes(*), procedimentos(*), profiles(*)")
+    query = db.table("agendamentos").select(APPOINTMENT_FIELDS.select(page.fields, ["id", "start_time"]))
 
     if professional_id:
         query = query.eq("professional_id", professional_id)
@@ -101,16 +102,42 @@ async def list_appointments(
     if end_date:
         query = query.lte("start_time", end_date)
 
-    result = query.order("start_time").execute()
+    result = await paginate(query, page, "start_time")
+
+    return {"success": True, "appointments": result["items"], "next_cursor": result["next_cursor"]}
 
-    return {"success": True, "appointments": result.data}
+@router.get("/available-slots")
+async def get_available_slots_range(
+    procedimento_id: str,
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to"),
+    professional_id: Optional[str] = None
+):
+    """
+    Horários disponíveis de vários dias e profissionais em uma única chamada
+    (usado pelo PWA e pelo bot do WhatsApp)
+    """
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d").date()
+        end = datetime.strptime(to_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas devem estar no formato YYYY-MM-DD")
+
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' deve ser posterior a 'from'")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Período máximo de {MAX_RANGE_DAYS} dias")
+
+    slots = await AvailabilityService.get_available_slots(start, end, procedimento_id, professional_id)
+
+    return {"success": True, "slots": slots}
 
 @router.get("/{appointment_id}")
 async def get_appointment(appointment_id: str):
     """
     Obtém detalhes de um agendamento
     """
-    result = supabase_admin.table("agendamentos")\
+    result = await db.table("agendamentos")\
         .select("*, pacientes(*), procedimentos(*), profiles(*)")\
         .eq("id", appointment_id)\
         .single()\
@@ -128,10 +155,13 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate):
     """
     update_data = {k: v for k, v in update.dict().items() if v is not None}
 
-    result = supabase_admin.table("agendamentos")\
-        .update(update_data)\
-        .eq("id", appointment_id)\
-        .execute()
+    try:
+        result = await db.table("agendamentos")\
+            .update(update_data)\
+            .eq("id", appointment_id)\
+            .execute()
+    except APIError as e:
+        raise_for_schedule_error(e)
 
     if not result.data:
         raise HTTPException(status_code=404, detail="Appointment not found")
@@ -139,11 +169,11 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate):
     return {"success": True, "appointment": result.data[0]}
 
 @router.delete("/{appointment_id}")
-async def cancel_appointment(appointment_id: str):
+async def cancel_appointment(appointment_id: str, background_tasks: BackgroundTasks):
     """
     Cancela agendamento
     """
-    result = supabase_admin.table("agendamentos")\
+    result = await db.table("agendamentos")\
         .update({"status": "cancelled"})\
         .eq("id", appointment_id)\
         .execute()
@@ -151,21 +181,8 @@ async def cancel_appointment(appointment_id: str):
     if not result.data:
         raise HTTPException(status_code=404, detail="Appointment not found")
 
-    # Notificar paciente
-    appointment = result.data[0]
-    paciente = supabase_admin.table("pacientes").select("*").eq("id", appointment["paciente_id"]).single().execute()
-
-    if paciente.data and paciente.data.get("whatsapp_number"):
-        msg = f"""
-❌ *Agendamento Cancelado*
-
-Olá {paciente.data['full_name']},
-
-Seu agendamento foi cancelado.
-
-Para reagendar, entre em contato conosco.
-        """
-        await whatsapp_service.send_text_message(paciente.data["whatsapp_number"], msg)
+    # Notificar paciente (enfileirado pelo trigger de cancelamento)
+    background_tasks.add_task(notification_outbox.process_pending)
 
     return {"success": True, "message": "Appointment cancelled"}
 
@@ -178,68 +195,19 @@ async def get_available_slots(
     """
     Retorna horários disponíveis para agendamento
     """
-    # Buscar configuração de disponibilidade
-    target_date = datetime.strptime(date, "%Y-%m-%d")
-    day_of_week = target_date.weekday()
-
-    availability = supabase_admin.table("availability_settings")\
-        .select("*")\
-        .eq("professional_id", professional_id)\
-        .eq("day_of_week", day_of_week)\
-        .eq("is_available", True)\
-        .execute()
-
-    if not availability.data:
-        return {"success": True, "slots": []}
-
-    # Buscar duração do procedimento
-    procedimento = supabase_admin.table("procedimentos")\
-        .select("duration")\
-        .eq("id", procedimento_id)\
-        .single()\
-        .execute()
-
-    duration = procedimento.data.get("duration", 60)
-
-    # Buscar agendamentos existentes
-    existing = supabase_admin.table("agendamentos")\
-        .select("start_time, end_time")\
-        .eq("professional_id", professional_id)\
-        .gte("start_time", f"{date}T00:00:00")\
-        .lte("start_time", f"{date}T23:59:59")\
-        .neq("status", "cancelled")\
-        .execute()
-
-    # Gerar slots disponíveis
-    slots = []
-    for av in availability.data:
-        start_hour, start_min = map(int, av["start_time"].split(":"))
-        end_hour, end_min = map(int, av["end_time"].split(":"))
-
-        current = target_date.replace(hour=start_hour, minute=start_min)
-        end = target_date.replace(hour=end_hour, minute=end_min)
-
-        while current + timedelta(minutes=duration) <= end:
-            slot_start = current.isoformat()
-            slot_end = (current + timedelta(minutes=duration)).isoformat()
-
-            # Verificar se está livre
-            is_free = True
-            for appt in existing.data:
-                appt_start = datetime.fromisoformat(appt["start_time"].replace("Z", "+00:00"))
-                appt_end = datetime.fromisoformat(appt["end_time"].replace("Z", "+00:00"))
-
-                if not (current >= appt_end or current + timedelta(minutes=duration) <= appt_start):
-                    is_free = False
-                    break
-
-            if is_free:
-                slots.append({
-                    "start_time": slot_start,
-                    "end_time": slot_end,
-                    "display": current.strftime("%H:%M")
-                })
-
-            current += timedelta(minutes=30)  # Intervalo de 30 min entre slots
-
-    return {"success": True, "slots": slots}
+    try:
+        target_date = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data deve estar no formato YYYY-MM-DD")
+
+    slots = await AvailabilityService.get_available_slots(
+        target_date, target_date, procedimento_id, professional_id
+    )
+
+    return {
+        "success": True,
+        "slots": [
+            {"start_time": s["start_time"], "end_time": s["end_time"], "display": s["display"]}
+            for s in slots
+        ]
+    }
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from app.core.supabase import supabase, supabase_admin
+from app.core.supabase import supabase
+from app.core.database import db
+from app.services.identity_service import identity_resolver
 
 router = APIRouter()
 
@@ -41,12 +43,15 @@ async def signup(request: SignUpRequest):
 
         # Criar profile
         if result.user:
-            supabase_admin.table("profiles").insert({
+            profile = await db.table("profiles").insert({
                 "id": result.user.id,
                 "full_name": request.full_name,
                 "phone": request.phone,
                 "role": "client"
             }).execute()
+            # O resolver indexa por whatsapp_number (não por phone): limpa o
+            # número efetivamente gravado, inclusive uma entrada "unknown"
+            identity_resolver.invalidate(profile.data[0].get("whatsapp_number"))
 
         return {"success": True, "user": result.user.__dict__}
     except Exception as e:
@@ -63,5 +68,5 @@ async def get_current_user():
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    profile = supabase_admin.table("profiles").select("*").eq("id", user.user.id).single().execute()
+    profile = await db.table("profiles").select("*").eq("id", user.user.id).single().execute()
     return {"success": True, "user": profile.data}
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import Optional, Dict
-from app.core.supabase import supabase_admin
+from app.core.database import db
 
 router = APIRouter()
 
@@ -19,7 +19,7 @@ async def create_automation_rule(rule: AutomationRuleCreate):
     """
     Cria regra de automação
     """
-    result = supabase_admin.table("automation_rules").insert(rule.dict()).execute()
+    result = await db.table("automation_rules").insert(rule.dict()).execute()
     return {"success": True, "rule": result.data[0]}
 
 @router.get("/rules")
@@ -27,25 +27,25 @@ async def list_automation_rules(active_only: bool = True):
     """
     Lista regras de automação
     """
-    query = supabase_admin.table("automation_rules").select("*")
+    query = db.table("automation_rules").select("*")
     if active_only:
         query = query.eq("is_active", True)
-    result = query.order("name").execute()
+    result = await query.order("name").execute()
     return {"success": True, "rules": result.data}
 
 @router.get("/rules/{rule_id}")
 async def get_automation_rule(rule_id: str):
-    result = supabase_admin.table("automation_rules").select("*").eq("id", rule_id).single().execute()
+    result = await db.table("automation_rules").select("*").eq("id", rule_id).single().execute()
     return {"success": True, "rule": result.data}
 
 @router.patch("/rules/{rule_id}")
 async def update_automation_rule(rule_id: str, updates: dict):
-    result = supabase_admin.table("automation_rules").update(updates).eq("id", rule_id).execute()
+    result = await db.table("automation_rules").update(updates).eq("id", rule_id).execute()
     return {"success": True, "rule": result.data[0]}
 
 @router.delete("/rules/{rule_id}")
 async def delete_automation_rule(rule_id: str):
-    supabase_admin.table("automation_rules").delete().eq("id", rule_id).execute()
+    await db.table("automation_rules").delete().eq("id", rule_id).execute()
     return {"success": True}
 
 @router.get("/logs")
@@ -53,10 +53,10 @@ async def get_automation_logs(rule_id: Optional[str] = None, limit: int = 100):
     """
     Lista logs de automação
     """
-    query = supabase_admin.table("automation_logs").select("*, automation_rules(name)")
+    query = db.table("automation_logs").select("*, automation_rules(name)")
     if rule_id:
         query = query.eq("rule_id", rule_id)
-    result = query.order("created_at", desc=True).limit(limit).execute()
+    result = await query.order("created_at", desc=True).limit(limit).execute()
     return {"success": True, "logs": result.data}
 
 @router.post("/test/{rule_id}")
@@ -66,7 +66,7 @@ async def test_automation_rule(rule_id: str, test_data: Dict):
     """
     from app.services.whatsapp_service import whatsapp_service
 
-    rule = supabase_admin.table("automation_rules").select("*").eq("id", rule_id).single().execute()
+    rule = await db.table("automation_rules").select("*").eq("id", rule_id).single().execute()
 
     if not rule.data:
         return {"success": False, "error": "Rule not found"}
@@ -1,11 +1,25 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from datetime import date
-from app.core.supabase import supabase_admin
+import re
+from app.core.database import db
+from app.core.pagination import PageParams, Projection, paginate
 
 router = APIRouter()
 
+FINANCIAL_FIELDS = Projection(
+    columns=[
+        "id", "type", "category", "amount", "date", "due_date", "paid_date", "status",
+        "payment_method", "description", "agendamento_id", "paciente_id", "order_id",
+        "payment_link", "payment_id", "attachments", "created_at", "updated_at"
+    ],
+    embeds={
+        "pacientes": "pacientes(id, full_name)",
+        "agendamentos": "agendamentos(id, start_time, status, procedimento_id)"
+    }
+)
+
 class FinancialCreate(BaseModel):
     type: str
     category: Optional[str] = None
@@ -16,7 +30,7 @@ class FinancialCreate(BaseModel):
 
 @router.post("/")
 async def create_financial_record(record: FinancialCreate):
-    result = supabase_admin.table("financeiro").insert(record.dict()).execute()
+    result = await db.table("financeiro").insert(record.dict()).execute()
     return {"success": True, "record": result.data[0]}
 
 @router.get("/")
@@ -24,9 +38,10 @@ async def list_financial_records(
     type: Optional[str] = None,
     status: Optional[str] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    page: PageParams = Depends()
 ):
-    query = supabase_admin.table("financeiro").select("*, pacientes(*), agendamentos(*)")
+    query = db.table("financeiro").select(FINANCIAL_FIELDS.select(page.fields, ["id", "date"]))
     if type:
         query = query.eq("type", type)
     if status:
@@ -35,19 +50,21 @@ async def list_financial_records(
         query = query.gte("date", start_date)
     if end_date:
         query = query.lte("date", end_date)
-    result = query.order("date", desc=True).execute()
-    return {"success": True, "records": result.data}
+    result = await paginate(query, page, "date", desc=True, nullable=True)
+    return {"success": True, "records": result["items"], "next_cursor": result["next_cursor"]}
 
 @router.get("/summary")
 async def get_financial_summary(month: Optional[str] = None):
-    query = supabase_admin.table("financeiro").select("type, amount, status")
-    if month:
-        query = query.ilike("date", f"{month}%")
-    result = query.execute()
-
-    income = sum([r["amount"] for r in result.data if r["type"] == "income" and r["status"] == "paid"])
-    expense = sum([r["amount"] for r in result.data if r["type"] == "expense" and r["status"] == "paid"])
-    pending = sum([r["amount"] for r in result.data if r["status"] == "pending"])
+    # Validado aqui: um mês inválido faria o to_date da função falhar (500)
+    if month is not None and not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", month):
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+
+    result = await db.rpc("financial_summary", {"month": month}).execute()
+    totals = result.data[0]
+
+    income = float(totals["income"])
+    expense = float(totals["expense"])
+    pending = float(totals["pending"])
 
     return {
         "success": True,
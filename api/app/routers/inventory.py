@@ -1,10 +1,21 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Query
 from pydantic import BaseModel
+from datetime import datetime, timedelta
 from typing import Optional
-from app.core.supabase import supabase_admin
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+from app.core.pagination import PageParams, Projection, paginate
+from app.services.stock_forecast_service import stock_forecaster
 
 router = APIRouter()
 
+PRODUCT_FIELDS = Projection(columns=[
+    "id", "name", "description", "sku", "category", "quantity", "unit", "min_quantity",
+    "cost_price", "sale_price", "supplier", "image_url", "images", "is_for_sale", "active",
+    "created_at", "updated_at"
+])
+
 class ProductCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -14,22 +25,46 @@ class ProductCreate(BaseModel):
     is_for_sale: bool = False
 
 @router.get("/")
-async def list_products(for_sale_only: bool = False):
-    query = supabase_admin.table("estoque").select("*")
+async def list_products(for_sale_only: bool = False, page: PageParams = Depends()):
+    query = db.table("estoque").select(PRODUCT_FIELDS.select(page.fields, ["id", "name"]))
     if for_sale_only:
         query = query.eq("is_for_sale", True).eq("active", True)
-    result = query.order("name").execute()
-    return {"success": True, "products": result.data}
+    result = await paginate(query, page, "name")
+    return {"success": True, "products": result["items"], "next_cursor": result["next_cursor"]}
 
 @router.post("/")
 async def create_product(product: ProductCreate):
-    result = supabase_admin.table("estoque").insert(product.dict()).execute()
+    result = await db.table("estoque").insert(product.dict()).execute()
     return {"success": True, "product": result.data[0]}
 
 @router.get("/low-stock")
 async def get_low_stock():
-    result = supabase_admin.table("estoque")\
-        .select("*")\
-        .filter("quantity", "lte", "min_quantity")\
-        .execute()
+    """
+    Produtos ativos com quantidade <= min_quantity e a previsão de ruptura
+    """
+    result = await db.rpc("low_stock_products").execute()
     return {"success": True, "products": result.data}
+
+@router.get("/forecast")
+async def get_stock_forecast(
+    days: int = Query(30, ge=1, le=365, description="Ruptura prevista em até N dias"),
+    page: PageParams = Depends()
+):
+    """
+    Produtos com ruptura projetada no horizonte, dos mais urgentes para os
+    menos; lê a previsão pré-calculada (stock_forecasts)
+    """
+    today = datetime.now(ZoneInfo(settings.CLINIC_TIMEZONE)).date()
+    query = db.table("stock_forecasts")\
+        .select("estoque_id, quantity, daily_rate_7d, daily_rate_30d, daily_rate, days_of_cover, stockout_date, computed_at, estoque(name, sku, unit, min_quantity)")\
+        .lte("stockout_date", str(today + timedelta(days=days)))
+    result = await paginate(query, page, "stockout_date", id_column="estoque_id")
+    return {"success": True, "forecasts": result["items"], "next_cursor": result["next_cursor"]}
+
+@router.post("/forecast/refresh")
+async def refresh_stock_forecast():
+    """
+    Recalcula a previsão fora do ciclo do job
+    """
+    refreshed = await stock_forecaster.refresh()
+    return {"success": True, "refreshed": refreshed}
@@ -1,54 +1,77 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
-from typing import List, Optional
-from app.core.supabase import supabase_admin
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from app.core.database import db, APIError
+from app.core.pagination import PageParams, Projection, paginate
 
 router = APIRouter()
 
+ORDER_FIELDS = Projection(
+    columns=[
+        "id", "paciente_id", "total_amount", "status", "payment_method", "payment_id",
+        "payment_link", "shipping_address", "tracking_code", "notes", "source",
+        "created_at", "updated_at"
+    ],
+    embeds={
+        "order_items": "order_items(id, estoque_id, quantity, unit_price, subtotal, estoque(id, name, image_url))"
+    }
+)
+
 class OrderItem(BaseModel):
     estoque_id: str
-    quantity: int
-    unit_price: float
+    quantity: int = Field(..., gt=0)
+    unit_price: Optional[float] = None  # Ignorado: o preço vem de estoque.sale_price
 
 class OrderCreate(BaseModel):
     paciente_id: str
-    items: List[OrderItem]
+    items: List[OrderItem] = Field(..., min_length=1)
     shipping_address: Optional[str] = None
-    source: str = "pwa"
+    source: Literal["pwa", "whatsapp", "admin"] = "pwa"
 
-@router.post("/")
-async def create_order(order: OrderCreate):
-    # Criar order
-    order_result = supabase_admin.table("orders").insert({
-        "paciente_id": order.paciente_id,
-        "total_amount": 0,
-        "shipping_address": order.shipping_address,
-        "source": order.source,
-        "status": "pending"
-    }).execute()
+ORDER_ERRORS = {
+    "insufficient_stock": (409, "Estoque insuficiente"),
+    "product_unavailable": (409, "Produto indisponível"),
+    "invalid_order_item": (400, "Item do pedido inválido")
+}
 
-    order_id = order_result.data[0]["id"]
+def raise_for_order_error(error: APIError):
+    """
+    Converte os erros de negócio de place_order (P0001 + HINT) em erros HTTP
+    """
+    if error.code == "P0001" and error.hint in ORDER_ERRORS:
+        status_code, message = ORDER_ERRORS[error.hint]
+        raise HTTPException(status_code=status_code, detail={
+            "message": message,
+            "estoque_ids": [i.strip() for i in (error.details or "").split(",") if i.strip()]
+        })
+    raise error
 
-    # Criar itens
-    for item in order.items:
-        supabase_admin.table("order_items").insert({
-            "order_id": order_id,
-            "estoque_id": item.estoque_id,
-            "quantity": item.quantity,
-            "unit_price": item.unit_price,
-            "subtotal": item.quantity * item.unit_price
+@router.post("/")
+async def create_order(order: OrderCreate):
+    """
+    Cria o pedido em uma única transação (place_order): itens com o preço
+    do estoque, baixa de estoque, movimentações e total; sem saldo suficiente
+    nada é gravado
+    """
+    try:
+        result = await db.rpc("place_order", {
+            "p_paciente_id": order.paciente_id,
+            "p_items": [{"estoque_id": item.estoque_id, "quantity": item.quantity} for item in order.items],
+            "p_shipping_address": order.shipping_address,
+            "p_source": order.source
         }).execute()
+    except APIError as e:
+        raise_for_order_error(e)
 
-        # Atualizar estoque
-        product = supabase_admin.table("estoque").select("quantity").eq("id", item.estoque_id).single().execute()
-        new_qty = product.data["quantity"] - item.quantity
-        supabase_admin.table("estoque").update({"quantity": new_qty}).eq("id", item.estoque_id).execute()
-
-    return {"success": True, "order_id": order_id}
+    return {
+        "success": True,
+        "order_id": result.data["id"],
+        "total_amount": result.data["total_amount"]
+    }
 
 @router.get("/{order_id}")
 async def get_order(order_id: str):
-    order = supabase_admin.table("orders")\
+    order = await db.table("orders")\
         .select("*, pacientes(*), order_items(*, estoque(*))")\
         .eq("id", order_id)\
         .single()\
@@ -56,10 +79,9 @@ async def get_order(order_id: str):
     return {"success": True, "order": order.data}
 
 @router.get("/patient/{paciente_id}")
-async def get_patient_orders(paciente_id: str):
-    orders = supabase_admin.table("orders")\
-        .select("*, order_items(*, estoque(*))")\
-        .eq("paciente_id", paciente_id)\
-        .order("created_at", desc=True)\
-        .execute()
-    return {"success": True, "orders": orders.data}
+async def get_patient_orders(paciente_id: str, page: PageParams = Depends()):
+    query = db.table("orders")\
+        .select(ORDER_FIELDS.select(page.fields, ["id", "created_at"]))\
+        .eq("paciente_id", paciente_id)
+    orders = await paginate(query, page, "created_at", desc=True)
+    return {"success": True, "orders": orders["items"], "next_cursor": orders["next_cursor"]}
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from typing import Optional
-from app.core.supabase import supabase_admin
+from app.core.database import db, escape_like, quote
+from app.core.pagination import PageParams, Projection, paginate, encode_cursor, decode_cursor
+from app.services.identity_service import identity_resolver
 
 router = APIRouter()
 
+PATIENT_FIELDS = Projection(columns=[
+    "id", "full_name", "email", "phone", "whatsapp_number", "cpf", "rg", "birth_date",
+    "gender", "address", "city", "state", "zip_code", "emergency_contact", "emergency_phone",
+    "observations", "medical_history", "allergies", "medications", "tags", "profile_id",
+    "whatsapp_chat_id", "preferred_contact", "created_at", "updated_at"
+])
+
 class PatientCreate(BaseModel):
     full_name: str
     email: Optional[str] = None
@@ -18,30 +27,58 @@ class PatientCreate(BaseModel):
 
 @router.post("/")
 async def create_patient(patient: PatientCreate):
-    result = supabase_admin.table("pacientes").insert(patient.dict()).execute()
+    result = await db.table("pacientes").insert(patient.dict()).execute()
+    identity_resolver.invalidate(patient.whatsapp_number)
     return {"success": True, "patient": result.data[0]}
 
 @router.get("/")
-async def list_patients(search: Optional[str] = None):
-    query = supabase_admin.table("pacientes").select("*")
+async def list_patients(search: Optional[str] = None, page: PageParams = Depends()):
+    query = db.table("pacientes").select(PATIENT_FIELDS.select(page.fields, ["id", "full_name"]))
     if search:
-        query = query.or_(f"full_name.ilike.%{search}%,cpf.ilike.%{search}%,phone.ilike.%{search}%")
-    result = query.order("full_name").execute()
-    return {"success": True, "patients": result.data}
+        pattern = quote(f"%{escape_like(search)}%")
+        query = query.or_(f"full_name.ilike.{pattern},cpf.ilike.{pattern},phone.ilike.{pattern}")
+    result = await paginate(query, page, "full_name")
+    return {"success": True, "patients": result["items"], "next_cursor": result["next_cursor"]}
+
+@router.get("/search")
+async def search_patients(q: str = Query(..., min_length=2), page: PageParams = Depends()):
+    """
+    Busca por nome (sem acento, tolerante a erros de digitação), CPF,
+    telefone ou e-mail, ordenada por relevância
+    """
+    params = {"q": q, "max_results": page.limit + 1}
+    if page.cursor:
+        cursor = decode_cursor(page.cursor)
+        score = cursor.get("v")
+        if not isinstance(score, (int, float)) or isinstance(score, bool):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        params.update({"after_score": score, "after_id": cursor["id"]})
+
+    result = await db.rpc("search_patients", params).execute()
+
+    patients = result.data[:page.limit]
+    next_cursor = None
+    if len(result.data) > page.limit:
+        next_cursor = encode_cursor(patients[-1]["score"], patients[-1]["id"])
+
+    return {"success": True, "patients": patients, "next_cursor": next_cursor}
 
 @router.get("/{patient_id}")
 async def get_patient(patient_id: str):
-    result = supabase_admin.table("pacientes").select("*").eq("id", patient_id).single().execute()
+    result = await db.table("pacientes").select("*").eq("id", patient_id).single().execute()
     if not result.data:
         raise HTTPException(status_code=404, detail="Patient not found")
     return {"success": True, "patient": result.data}
 
 @router.patch("/{patient_id}")
 async def update_patient(patient_id: str, patient: dict):
-    result = supabase_admin.table("pacientes").update(patient).eq("id", patient_id).execute()
+    result = await db.table("pacientes").update(patient).eq("id", patient_id).execute()
+    identity_resolver.invalidate_record(patient_id)
+    identity_resolver.invalidate(patient.get("whatsapp_number"))
     return {"success": True, "patient": result.data[0]}
 
 @router.delete("/{patient_id}")
 async def delete_patient(patient_id: str):
-    supabase_admin.table("pacientes").delete().eq("id", patient_id).execute()
+    await db.table("pacientes").delete().eq("id", patient_id).execute()
+    identity_resolver.invalidate_record(patient_id)
     return {"success": True, "message": "Patient deleted"}
@@ -1,10 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from typing import Optional
-from app.core.supabase import supabase_admin
+from app.core.database import db
+from app.core.pagination import PageParams, Projection, paginate
+from app.services.faq_service import faq_service
 
 router = APIRouter()
 
+PROCEDURE_FIELDS = Projection(columns=[
+    "id", "name", "description", "category", "duration", "price", "cost", "requires_anamnese",
+    "active", "image_url", "instructions", "contraindications", "available_for_online_booking",
+    "created_at", "updated_at"
+])
+
 class ProcedureCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -14,20 +22,21 @@ class ProcedureCreate(BaseModel):
     available_for_online_booking: bool = True
 
 @router.get("/")
-async def list_procedures(active_only: bool = True):
-    query = supabase_admin.table("procedimentos").select("*")
+async def list_procedures(active_only: bool = True, page: PageParams = Depends()):
+    query = db.table("procedimentos").select(PROCEDURE_FIELDS.select(page.fields, ["id", "name"]))
     if active_only:
         query = query.eq("active", True)
-    result = query.order("name").execute()
-    return {"success": True, "procedures": result.data}
+    result = await paginate(query, page, "name")
+    return {"success": True, "procedures": result["items"], "next_cursor": result["next_cursor"]}
 
 @router.post("/")
 async def create_procedure(procedure: ProcedureCreate):
-    result = supabase_admin.table("procedimentos").insert(procedure.dict()).execute()
+    result = await db.table("procedimentos").insert(procedure.dict()).execute()
+    faq_service.invalidate()
     return {"success": True, "procedure": result.data[0]}
 
 @router.get("/categories")
 async def get_categories():
-    result = supabase_admin.table("procedimentos").select("category").execute()
+    result = await db.table("procedimentos").select("category").execute()
     categories = list(set([p["category"] for p in result.data if p.get("category")]))
     return {"success": True, "categories": categories}
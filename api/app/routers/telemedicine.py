@@ -3,7 +3,7 @@ from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timedelta
 import uuid
-from app.core.supabase import supabase_admin
+from app.core.database import db
 from app.services.google_meet_service import google_meet_service
 
 router = APIRouter()
@@ -28,11 +28,11 @@ async def create_telemedicine_session(session: TelemedicineSessionCreate):
     """
     # Buscar emails se não fornecidos
     if not session.patient_email:
-        patient = supabase_admin.table("pacientes").select("email").eq("id", session.paciente_id).single().execute()
+        patient = await db.table("pacientes").select("email").eq("id", session.paciente_id).single().execute()
         session.patient_email = patient.data.get("email") if patient.data else None
 
     if not session.professional_email:
-        professional = supabase_admin.table("profiles").select("email").eq("id", session.professional_id).single().execute()
+        professional = await db.table("profiles").select("email").eq("id", session.professional_id).single().execute()
         session.professional_email = professional.data.get("email") if professional.data else None
 
     # Criar reunião no Google Meet
@@ -51,7 +51,7 @@ async def create_telemedicine_session(session: TelemedicineSessionCreate):
     )
 
     # Salvar no banco
-    result = supabase_admin.table("telemedicine_sessions").insert({
+    result = await db.table("telemedicine_sessions").insert({
         "agendamento_id": session.agendamento_id,
         "paciente_id": session.paciente_id,
         "professional_id": session.professional_id,
@@ -73,7 +73,7 @@ async def create_telemedicine_session(session: TelemedicineSessionCreate):
 
 @router.get("/sessions/{session_id}")
 async def get_telemedicine_session(session_id: str):
-    result = supabase_admin.table("telemedicine_sessions")\
+    result = await db.table("telemedicine_sessions")\
         .select("*, pacientes(*), profiles(*)")\
         .eq("id", session_id)\
         .single()\
@@ -84,7 +84,7 @@ async def get_telemedicine_session(session_id: str):
 async def start_telemedicine_session(session_id: str):
     from datetime import datetime
 
-    result = supabase_admin.table("telemedicine_sessions").update({
+    result = await db.table("telemedicine_sessions").update({
         "status": "in_progress",
         "started_at": datetime.now().isoformat()
     }).eq("id", session_id).execute()
@@ -96,7 +96,7 @@ async def end_telemedicine_session(session_id: str, notes: Optional[str] = None)
     from datetime import datetime
 
     # Calcular duração
-    session = supabase_admin.table("telemedicine_sessions").select("started_at").eq("id", session_id).single().execute()
+    session = await db.table("telemedicine_sessions").select("started_at").eq("id", session_id).single().execute()
 
     if session.data and session.data.get("started_at"):
         started = datetime.fromisoformat(session.data["started_at"])
@@ -105,7 +105,7 @@ async def end_telemedicine_session(session_id: str, notes: Optional[str] = None)
     else:
         duration_minutes = 0
 
-    result = supabase_admin.table("telemedicine_sessions").update({
+    result = await db.table("telemedicine_sessions").update({
         "status": "completed",
         "ended_at": datetime.now().isoformat(),
         "duration_minutes": duration_minutes,
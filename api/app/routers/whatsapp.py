@@ -2,96 +2,325 @@
 Router para WhatsApp - Webhooks e envio de mensagens
 """
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+import re
+from pydantic import BaseModel
 from app.services.whatsapp_service import whatsapp_service
+from app.services.bulk_dispatch_service import bulk_dispatcher, DEFAULT_REMINDER_TEMPLATE
+from app.services.webhook_queue_service import webhook_queue
+from app.services.identity_service import identity_resolver
+from app.services.conversation_service import conversation_store, IDLE
+from app.services.availability_service import AvailabilityService
+from app.services.notification_service import notification_outbox
+from app.services.faq_service import faq_service
+from app.services.chat_context_service import chat_context
+from app.services.message_log_service import message_log
 from app.services.ai_service import AIService
-from app.core.supabase import supabase_admin
+from app.core.config import settings
+from app.core.database import db, APIError, escape_like
 
 router = APIRouter()
 
+MAX_SLOT_OPTIONS = 8
+WEEKDAYS = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+
+class BulkRecipient(BaseModel):
+    to: str
+    variables: Dict[str, Any] = {}
+
+class BulkDispatchRequest(BaseModel):
+    template: Optional[str] = None
+    recipients: Optional[List[BulkRecipient]] = None
+    query: Optional[str] = None  # "appointments_tomorrow" | "patients"
+    tag: Optional[str] = None
+    campaign_id: Optional[str] = None
+
 @router.post("/webhook")
 async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Recebe webhooks do Evolution API
-    Processa mensagens recebidas (paciente e profissional)
+    Valida, grava na fila local e confirma; o processamento é feito pelos workers
     """
     try:
         payload = await request.json()
-        event_type = payload.get("event")
-        data = payload.get("data", {})
-
-        # Mensagem recebida
-        if event_type == "messages.upsert":
-            message = data.get("message", {})
-            from_number = message.get("key", {}).get("remoteJid", "").replace("@s.whatsapp.net", "")
-            message_type = message.get("messageType")
-
-            # Identificar se é paciente ou profissional
-            paciente = supabase_admin.table("pacientes")\
-                .select("*")\
-                .eq("whatsapp_number", from_number)\
-                .single()\
-                .execute()
-
-            professional = supabase_admin.table("profiles")\
-                .select("*")\
-                .eq("whatsapp_number", from_number)\
-                .single()\
-                .execute()
-
-            # FLUXO PACIENTE
-            if paciente.data:
-                background_tasks.add_task(process_patient_message, message, paciente.data)
-
-            # FLUXO PROFISSIONAL (Áudio de prontuário)
-            elif professional.data:
-                if message_type == "audioMessage":
-                    background_tasks.add_task(process_professional_audio, message, professional.data)
-
-            # Novo contato - criar lead
-            else:
-                background_tasks.add_task(create_lead_from_whatsapp, from_number, message)
-
-        return {"status": "received"}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if payload.get("event") != "messages.upsert":
+        return {"status": "ignored"}
+
+    key = payload.get("data", {}).get("message", {}).get("key", {})
+    if key.get("fromMe"):
+        return {"status": "ignored"}
+
+    message_id = key.get("id")
+    if not message_id or not key.get("remoteJid"):
+        raise HTTPException(status_code=400, detail="Missing message key")
+
+    created = await webhook_queue.enqueue(message_id, payload, key["remoteJid"])
+    if not created:
+        return {"status": "duplicate"}
+
+    # Sem workers em execução (serverless), processa após a resposta
+    if not webhook_queue.running:
+        background_tasks.add_task(webhook_queue.process_pending, process_webhook_event)
+
+    return {"status": "received"}
+
+async def process_webhook_event(payload: dict):
+    """
+    Classifica a mensagem recebida (paciente, profissional ou lead) e processa
+    """
+    message = payload.get("data", {}).get("message", {})
+    from_number = message.get("key", {}).get("remoteJid", "").replace("@s.whatsapp.net", "")
+    message_type = message.get("messageType")
+
+    # Identificar se é paciente ou profissional (cache por número)
+    identity = await identity_resolver.resolve(from_number)
+
+    # FLUXO PACIENTE
+    if identity["kind"] == "patient":
+        await process_patient_message(message, identity["record"])
+
+    # FLUXO PROFISSIONAL (Áudio de prontuário)
+    elif identity["kind"] == "professional":
+        if message_type == "audioMessage":
+            await process_professional_audio(message, identity["record"])
+        else:
+            await process_professional_message(message, identity["record"])
+
+    # Novo contato - criar lead
+    else:
+        await create_lead_from_whatsapp(from_number, message, payload.get("data", {}).get("pushName"))
 
 async def process_patient_message(message: dict, paciente: dict):
     """
     Processa mensagem do paciente (bot de agendamento)
+    Fluxo: procedimento -> horário -> confirmação, com estado em conversation_store
     """
     from_number = paciente["whatsapp_number"]
-    text = message.get("message", {}).get("conversation", "")
+    text = message.get("message", {}).get("conversation", "").strip()
+    session = await conversation_store.get(from_number)
+    step = session["step"]
+
+    # Histórico da conversa (contexto da IA)
+    if text:
+        message_log.log({
+            "message_id": message.get("key", {}).get("id"),
+            "chat_id": from_number,
+            "from_number": from_number,
+            "content": text,
+            "message_type": "text",
+            "direction": "inbound",
+            "paciente_id": paciente["id"]
+        })
+        chat_context.record(from_number, "user", text)
+
+    if text.lower() in ("cancelar", "sair") and step != IDLE:
+        await conversation_store.reset(from_number)
+        await whatsapp_service.send_text_message(from_number, "Tudo bem, agendamento interrompido. Como posso ajudar?")
+
+    elif step == "choose_procedure":
+        await choose_procedure(from_number, text, session["context"])
+
+    elif step == "choose_slot":
+        await choose_slot(from_number, text, session["context"])
+
+    elif step == "confirm_booking":
+        await confirm_booking(from_number, paciente, text, session["context"])
+
+    # Opções do menu de boas-vindas (1 Agendar / 2 Procedimentos / 3 Atendente)
+    elif text == "1":
+        await show_procedures(from_number)
+
+    elif text == "2":
+        await show_procedure_catalog(from_number)
+
+    elif text == "3":
+        await request_attendant(from_number, paciente)
 
     # Comandos do bot
-    if "agendar" in text.lower():
-        # Mostrar procedimentos disponíveis
-        procedures = supabase_admin.table("procedimentos")\
-            .select("*")\
-            .eq("active", True)\
-            .eq("available_for_online_booking", True)\
-            .execute()
-
-        msg = "🗓️ *Agendar Consulta*\n\nEscolha o procedimento:\n\n"
-        for idx, proc in enumerate(procedures.data, 1):
-            msg += f"{idx}. {proc['name']} - R$ {proc['price']}\n"
-
-        await whatsapp_service.send_text_message(from_number, msg)
-
-    elif "horários" in text.lower() or text.isdigit():
-        # Mostrar horários disponíveis
-        await show_available_times(from_number, paciente["id"])
+    elif "agendar" in text.lower() or "horários" in text.lower():
+        await show_procedures(from_number)
 
     elif "confirmar" in text.lower() or text.upper() == "SIM":
         # Confirmar agendamento pendente
         await confirm_pending_appointment(paciente["id"], from_number)
 
     else:
-        # Resposta automática com IA
-        context = "Você ajuda pacientes a agendar consultas, confirmar agendamentos e tirar dúvidas."
-        response = await AIService.generate_whatsapp_response(context, text)
+        # Perguntas frequentes (templates/cache) antes da IA
+        response = await faq_service.answer(text)
+
+        if response is not None:
+            await whatsapp_service.send_text_message(from_number, response)
+            return
+
+        # Resposta da IA com o contexto do paciente (não vai para o cache
+        # compartilhado, pois contém dados pessoais)
+        context = await chat_context.build(from_number, paciente, text)
+        response = await AIService.generate_whatsapp_response(context["system"], text, context["history"])
         await whatsapp_service.send_text_message(from_number, response)
+        await chat_context.compact(from_number)
+
+def pick_option(text: str, options: list) -> Optional[dict]:
+    """
+    Converte a resposta numérica ("2") no item correspondente da lista
+    """
+    if text.isdigit() and 1 <= int(text) <= len(options):
+        return options[int(text) - 1]
+    return None
+
+async def show_procedures(to: str):
+    """
+    Passo 1: lista os procedimentos e guarda a lista na sessão
+    """
+    procedures = await db.table("procedimentos")\
+        .select("id, name, price")\
+        .eq("active", True)\
+        .eq("available_for_online_booking", True)\
+        .order("name")\
+        .execute()
+
+    if not procedures.data:
+        await whatsapp_service.send_text_message(to, "No momento não há procedimentos disponíveis para agendamento online.")
+        return
+
+    msg = "🗓️ *Agendar Consulta*\n\nEscolha o procedimento:\n\n"
+    for idx, proc in enumerate(procedures.data, 1):
+        msg += f"{idx}. {proc['name']} - R$ {proc['price']}\n"
+    msg += "\nDigite o número do procedimento (ou CANCELAR)."
+
+    await conversation_store.set(to, "choose_procedure", {"procedures": procedures.data})
+    await whatsapp_service.send_text_message(to, msg)
+
+async def show_procedure_catalog(to: str):
+    """
+    Opção 2 do menu: procedimentos com descrição e valor
+    """
+    procedures = await db.table("procedimentos")\
+        .select("name, description, price")\
+        .eq("active", True)\
+        .order("name")\
+        .execute()
+
+    if not procedures.data:
+        await whatsapp_service.send_text_message(to, "No momento não há procedimentos cadastrados.")
+        return
+
+    msg = "✨ *Nossos Procedimentos*\n\n"
+    for proc in procedures.data:
+        msg += f"• *{proc['name']}* - R$ {proc['price']}\n"
+        if proc.get("description"):
+            msg += f"  {proc['description']}\n"
+    msg += "\nPara agendar, responda *agendar*."
+
+    await whatsapp_service.send_text_message(to, msg)
+
+async def request_attendant(to: str, paciente: dict):
+    """
+    Opção 3 do menu: avisa a equipe e o paciente
+    """
+    await db.table("notifications").insert({
+        "paciente_id": paciente["id"],
+        "title": "Atendimento solicitado",
+        "message": f"{paciente.get('full_name', to)} pediu para falar com um atendente no WhatsApp.",
+        "type": "system",
+        "metadata": {"whatsapp_number": to}
+    }, returning="minimal").execute()
+
+    await whatsapp_service.send_text_message(to, "👩‍💼 Certo! Uma atendente vai responder por aqui em breve.")
+
+async def choose_procedure(to: str, text: str, context: dict):
+    """
+    Passo 2: com o procedimento escolhido, mostra os horários reais dos próximos 7 dias
+    """
+    procedure = pick_option(text, context.get("procedures", []))
+    if not procedure:
+        await whatsapp_service.send_text_message(to, "Opção inválida. Digite o número do procedimento (ou CANCELAR).")
+        return
+
+    await show_available_times(to, {**context, "procedure": procedure})
+
+async def show_available_times(to: str, context: dict):
+    """
+    Mostra horários disponíveis para agendamento
+    """
+    tz = ZoneInfo(settings.CLINIC_TIMEZONE)
+    today = datetime.now(tz).date()
+    now = datetime.now(tz).isoformat()
+
+    slots = await AvailabilityService.get_available_slots(
+        today, today + timedelta(days=7), context["procedure"]["id"]
+    )
+    slots = [s for s in slots if s["start_time"] > now][:MAX_SLOT_OPTIONS]
+
+    if not slots:
+        await conversation_store.reset(to)
+        await whatsapp_service.send_text_message(to, "Não há horários disponíveis nos próximos 7 dias. Nossa equipe entrará em contato.")
+        return
+
+    msg = f"📅 *Horários Disponíveis* - {context['procedure']['name']}\n\n"
+    msg += "Escolha um horário:\n\n"
+    for idx, slot in enumerate(slots, 1):
+        slot_date = date.fromisoformat(slot["date"])
+        msg += f"{idx}. {WEEKDAYS[slot_date.weekday()]} {slot_date.strftime('%d/%m')} {slot['display']}\n"
+    msg += "\nDigite o número do horário desejado."
+
+    await conversation_store.set(to, "choose_slot", {**context, "slots": slots})
+    await whatsapp_service.send_text_message(to, msg)
+
+async def choose_slot(to: str, text: str, context: dict):
+    """
+    Passo 3: pede a confirmação do horário escolhido
+    """
+    slot = pick_option(text, context.get("slots", []))
+    if not slot:
+        await whatsapp_service.send_text_message(to, "Opção inválida. Digite o número do horário (ou CANCELAR).")
+        return
+
+    slot_date = date.fromisoformat(slot["date"])
+    msg = f"""
+📋 {context['procedure']['name']}
+📅 {WEEKDAYS[slot_date.weekday()]} {slot_date.strftime('%d/%m/%Y')} às {slot['display']}
+
+Responda SIM para confirmar.
+    """
+
+    await conversation_store.set(to, "confirm_booking", {"procedure": context["procedure"], "slot": slot})
+    await whatsapp_service.send_text_message(to, msg)
+
+async def confirm_booking(to: str, paciente: dict, text: str, context: dict):
+    """
+    Passo 4: cria o agendamento (a constraint de sobreposição garante o horário)
+    """
+    if text.upper() != "SIM":
+        await whatsapp_service.send_text_message(to, "Responda SIM para confirmar ou CANCELAR para desistir.")
+        return
+
+    slot = context["slot"]
+    try:
+        await db.table("agendamentos").insert({
+            "paciente_id": paciente["id"],
+            "procedimento_id": context["procedure"]["id"],
+            "professional_id": slot["professional_id"],
+            "start_time": slot["start_time"],
+            "end_time": slot["end_time"],
+            "source": "whatsapp",
+            "status": "pending"
+        }).execute()
+    except APIError as e:
+        if e.code != "23P01":
+            raise
+        await whatsapp_service.send_text_message(to, "Esse horário acabou de ser reservado. Veja as opções atualizadas:")
+        await show_available_times(to, {"procedure": context["procedure"]})
+        return
+
+    # A mensagem de confirmação é enviada pelo outbox de notificações
+    await conversation_store.reset(to)
+    chat_context.forget_appointments(to)
+    await notification_outbox.process_pending()
 
 async def process_professional_audio(message: dict, professional: dict):
     """
@@ -111,46 +340,84 @@ Para qual paciente é este prontuário?
 Digite o nome ou CPF do paciente:
         """
 
+        await conversation_store.set(from_number, "audio_patient", {"audio_url": audio_url})
         await whatsapp_service.send_text_message(from_number, msg)
 
-        # Salvar contexto temporário
-        # (implementar sistema de state machine para conversas)
-
-async def show_available_times(to: str, paciente_id: str):
+async def process_professional_message(message: dict, professional: dict):
     """
-    Mostra horários disponíveis para agendamento
+    Resposta da profissional indicando o paciente do áudio pendente
     """
-    # Buscar horários disponíveis (próximos 7 dias)
-    import datetime
-    today = datetime.date.today()
-
-    msg = "📅 *Horários Disponíveis*\n\n"
-    msg += "Escolha um horário:\n\n"
-    msg += "1. Amanhã 10:00\n"
-    msg += "2. Amanhã 14:00\n"
-    msg += "3. Sexta 09:00\n"
-    msg += "4. Sexta 15:30\n\n"
-    msg += "Digite o número do horário desejado."
+    from_number = professional["whatsapp_number"]
+    session = await conversation_store.get(from_number)
+
+    if session["step"] != "audio_patient":
+        return
+
+    text = message.get("message", {}).get("conversation", "").strip()
+    context = session["context"]
+
+    # Escolha numérica entre os pacientes sugeridos anteriormente
+    paciente = pick_option(text, context.get("candidates", []))
+
+    if not paciente:
+        cpf = re.sub(r"\D", "", text)
+        query = db.table("pacientes").select("id, full_name, cpf")
+        if len(cpf) == 11:
+            query = query.in_("cpf", [cpf, f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"])
+        else:
+            query = query.ilike("full_name", f"%{escape_like(text)}%")
+        candidates = (await query.limit(5).execute()).data
+
+        if len(candidates) == 1:
+            paciente = candidates[0]
+        elif candidates:
+            msg = "Encontrei mais de um paciente:\n\n"
+            for idx, c in enumerate(candidates, 1):
+                msg += f"{idx}. {c['full_name']}\n"
+            msg += "\nDigite o número do paciente."
+            await conversation_store.set(from_number, "audio_patient", {**context, "candidates": candidates})
+            await whatsapp_service.send_text_message(from_number, msg)
+            return
+        else:
+            await whatsapp_service.send_text_message(from_number, "Paciente não encontrado. Digite o nome ou CPF novamente.")
+            return
+
+    await whatsapp_service.send_text_message(from_number, f"⏳ Transcrevendo prontuário de {paciente['full_name']}...")
+
+    # A sessão só é encerrada com o prontuário salvo: em caso de falha a
+    # profissional pode responder de novo com o paciente para tentar outra vez
+    try:
+        result = await whatsapp_service.process_incoming_audio(context["audio_url"], from_number, paciente["id"])
+    except Exception as e:
+        print(f"Error processing professional audio for patient {paciente['id']}: {e}")
+        result = {"success": False}
 
-    await whatsapp_service.send_text_message(to, msg)
+    if result["success"]:
+        await conversation_store.reset(from_number)
+        await whatsapp_service.send_text_message(from_number, "✅ Prontuário transcrito e salvo.")
+    else:
+        await whatsapp_service.send_text_message(
+            from_number,
+            "❌ Não foi possível transcrever o áudio. Envie o nome ou CPF do paciente para tentar novamente."
+        )
 
 async def confirm_pending_appointment(paciente_id: str, phone: str):
     """
     Confirma agendamento pendente
     """
     # Buscar agendamento pendente
-    appointment = supabase_admin.table("agendamentos")\
+    appointment = await db.table("agendamentos")\
         .select("*, procedimentos(*), profiles(*)")\
         .eq("paciente_id", paciente_id)\
         .eq("status", "pending")\
         .order("created_at", desc=True)\
         .limit(1)\
-        .single()\
+        .maybe_single()\
         .execute()
 
     if appointment.data:
         # Atualizar status
-        supabase_admin.table("agendamentos")\
+        await db.table("agendamentos")\
             .update({"status": "confirmed", "confirmation_sent": True})\
             .eq("id", appointment.data["id"])\
             .execute()
@@ -168,19 +435,23 @@ Até breve! ✨
 
         await whatsapp_service.send_text_message(phone, msg)
 
-async def create_lead_from_whatsapp(phone: str, message: dict):
+async def create_lead_from_whatsapp(phone: str, message: dict, push_name: Optional[str] = None):
     """
     Cria lead quando recebe mensagem de número desconhecido
     """
     text = message.get("message", {}).get("conversation", "Novo contato via WhatsApp")
 
     # Criar paciente como lead
-    supabase_admin.table("pacientes").insert({
+    lead = await db.table("pacientes").insert({
+        "full_name": push_name or f"Lead WhatsApp {phone}",
         "whatsapp_number": phone,
         "observations": f"Lead criado via WhatsApp: {text}",
         "tags": ["lead", "whatsapp"]
     }).execute()
 
+    # Substitui o cache negativo: as próximas mensagens já caem no fluxo de paciente
+    identity_resolver.remember(phone, "patient", lead.data[0])
+
     # Mensagem de boas-vindas
     welcome = """
 👋 *Bem-vindo à Clínica Estética!*
@@ -211,7 +482,7 @@ async def send_appointment_reminder(appointment_id: str):
     """
     Envia lembrete de agendamento
     """
-    appointment = supabase_admin.table("agendamentos")\
+    appointment = await db.table("agendamentos")\
         .select("*, pacientes(*), procedimentos(*), profiles(*)")\
         .eq("id", appointment_id)\
         .single()\
@@ -234,3 +505,63 @@ async def send_appointment_reminder(appointment_id: str):
     )
 
     return result
+
+@router.post("/send/bulk")
+async def send_bulk_messages(request: BulkDispatchRequest, background_tasks: BackgroundTasks):
+    """
+    Disparo em massa (lembretes e campanhas)
+    Aceita lista de destinatários ou uma consulta pronta; retorna o job para acompanhamento
+    """
+    if request.recipients:
+        recipients = [r.dict() for r in request.recipients]
+        source = "list"
+    elif request.query == "appointments_tomorrow":
+        recipients = await bulk_dispatcher.recipients_for_tomorrow_appointments()
+        source = request.query
+    elif request.query == "patients":
+        recipients = await bulk_dispatcher.recipients_for_patients(request.tag)
+        source = request.query
+    else:
+        raise HTTPException(status_code=400, detail="Informe recipients ou query")
+
+    template = request.template
+    if not template and source == "appointments_tomorrow":
+        template = DEFAULT_REMINDER_TEMPLATE
+    if not template:
+        raise HTTPException(status_code=400, detail="Template obrigatório")
+
+    # Campanha: variáveis da campanha disponíveis no template
+    if request.campaign_id:
+        campaign = await db.table("campaigns")\
+            .select("name, description, discount_percentage, discount_amount, end_date")\
+            .eq("id", request.campaign_id)\
+            .maybe_single()\
+            .execute()
+
+        if not campaign.data:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+
+        campaign_variables = {f"campaign_{k}": v or "" for k, v in campaign.data.items()}
+        for r in recipients:
+            r["variables"] = {**campaign_variables, **r.get("variables", {})}
+
+    job = bulk_dispatcher.create_job(recipients, template, source, request.campaign_id)
+    background_tasks.add_task(bulk_dispatcher.run, job)
+
+    return {"success": True, "job_id": job["id"], "total": job["total"]}
+
+@router.get("/send/bulk/{job_id}")
+async def get_bulk_dispatch_status(job_id: str):
+    """
+    Progresso e resultado por destinatário de um disparo em massa
+    (após um reinício, só os contadores gravados na campanha)
+    """
+    job = bulk_dispatcher.get_job(job_id) or await bulk_dispatcher.get_campaign_job(job_id)
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "success": True,
+        "job": {k: v for k, v in job.items() if k not in ("recipients", "template")}
+    }
@@ -0,0 +1,86 @@
+"""
+Cache endereçado por conteúdo para as chamadas de IA
+A chave é o SHA-256 da entrada (bytes do áudio ou texto + prompt + modelo);
+entradas ficam em memória (LRU) e na tabela ai_cache, que sobrevive a
+reinícios e é compartilhada entre processos
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Optional
+from app.core.database import db
+
+MEMORY_MAX_ENTRIES = 1000
+MAX_ENTRIES = 50000
+MAX_AGE_DAYS = 90
+EVICT_EVERY_WRITES = 200
+
+def cache_key(kind: str, model: str, *parts: Any) -> str:
+    """
+    Hash estável de (tipo, modelo, partes da entrada); dicts e listas
+    são serializados com chaves ordenadas
+    """
+    payload = json.dumps([kind, model, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AICache:
+
+    def __init__(self):
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._writes = 0
+
+    def _remember(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_MAX_ENTRIES:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        # Falha no cache nunca impede a chamada ao modelo
+        try:
+            row = await db.table("ai_cache")\
+                .select("response")\
+                .eq("cache_key", key)\
+                .maybe_single()\
+                .execute()
+            if not row.data:
+                return None
+
+            await db.rpc("touch_ai_cache", {"key": key}).execute()
+        except Exception as e:
+            print(f"AI cache read error: {e}")
+            return None
+
+        value = row.data["response"]["value"]
+        self._remember(key, value)
+        return value
+
+    async def set(self, key: str, kind: str, model: str, value: Any):
+        self._remember(key, value)
+
+        try:
+            await db.table("ai_cache").upsert({
+                "cache_key": key,
+                "kind": kind,
+                "model": model,
+                "response": {"value": value}
+            }, on_conflict="cache_key", returning="minimal").execute()
+
+            self._writes += 1
+            if self._writes % EVICT_EVERY_WRITES == 0:
+                await self.evict()
+        except Exception as e:
+            print(f"AI cache write error: {e}")
+
+    async def evict(self) -> int:
+        result = await db.rpc("evict_ai_cache", {
+            "max_entries": MAX_ENTRIES,
+            "max_age_days": MAX_AGE_DAYS
+        }).execute()
+        return result.data or 0
+
+ai_cache = AICache()
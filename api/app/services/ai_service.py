@@ -2,32 +2,190 @@
 Serviço de IA para transcrição de áudio e resumo de prontuários
 Usa OpenAI Whisper para transcrição e GPT-4 para resumo
 """
+import asyncio
+import json
+import random
+import httpx
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 import os
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel
 from app.core.config import settings
+from app.services.ai_cache_service import ai_cache, cache_key
+from app.services.audio_segmentation_service import audio_segments, stitch_transcripts
+from app.services.storage_service import StorageService
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+CHAT_MODEL = "gpt-4-turbo-preview"
+TRANSCRIPTION_MODEL = "whisper-1"
+
+MAX_RETRIES = 3
+RETRY_BASE_DELAY_SECONDS = 1.0
+TRANSCRIPTION_TIMEOUT_SECONDS = 300
+
+WHATSAPP_FALLBACK_REPLY = "Desculpe, não consegui processar sua mensagem. Por favor, entre em contato com nossa equipe."
+
+# Limite global de chamadas simultâneas por modelo
+MODEL_CONCURRENCY = {
+    TRANSCRIPTION_MODEL: 8,
+    CHAT_MODEL: 8
+}
+DEFAULT_MODEL_CONCURRENCY = 8
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+
+# Cliente assíncrono com pool de conexões compartilhado;
+# as tentativas são controladas por _call (com jitter)
+client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+    )
+)
+
+# Formato da análise combinada (resumo + extração) de um prontuário
+class MedicalRecordSummary(BaseModel):
+    queixa_principal: str = ""
+    historico: str = ""
+    avaliacao_fisica: str = ""
+    procedimento: str = ""
+    orientacoes: str = ""
+    proximos_passos: str = ""
+
+class MedicalRecordExtraction(BaseModel):
+    procedimentos_mencionados: List[str] = []
+    medicamentos: List[str] = []
+    alergias: List[str] = []
+    proxima_consulta: Optional[str] = None
+    recomendacoes: List[str] = []
+
+class MedicalRecordAnalysis(BaseModel):
+    resumo: MedicalRecordSummary
+    extracao: MedicalRecordExtraction
+
+SUMMARY_SECTIONS = [
+    ("queixa_principal", "QUEIXA PRINCIPAL"),
+    ("historico", "HISTÓRICO"),
+    ("avaliacao_fisica", "AVALIAÇÃO FÍSICA"),
+    ("procedimento", "PROCEDIMENTO REALIZADO/RECOMENDADO"),
+    ("orientacoes", "ORIENTAÇÕES PÓS-TRATAMENTO"),
+    ("proximos_passos", "PRÓXIMOS PASSOS")
+]
+
+def format_summary(summary: MedicalRecordSummary) -> str:
+    """
+    Texto do resumo no mesmo formato numerado usado em ai_summary
+    """
+    return "\n\n".join(
+        f"{index}. {title}\n{getattr(summary, field) or 'Não informado'}"
+        for index, (field, title) in enumerate(SUMMARY_SECTIONS, start=1)
+    )
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+async def _call(model: str, request: Callable[[], Awaitable]):
+    """
+    Executa a chamada respeitando o limite do modelo, com retry
+    e backoff exponencial com jitter para erros transitórios
+    """
+    async with _semaphore(model):
+        return await _retry(request)
+
+def _semaphore(model: str) -> asyncio.Semaphore:
+    if model not in _semaphores:
+        _semaphores[model] = asyncio.Semaphore(MODEL_CONCURRENCY.get(model, DEFAULT_MODEL_CONCURRENCY))
+    return _semaphores[model]
+
+async def _retry(request: Callable[[], Awaitable]):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await request()
+        except RETRYABLE_ERRORS:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(random.uniform(0, RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+def _summary_messages(transcription: str, patient_context: Optional[dict] = None) -> List[dict]:
+    context = ""
+    if patient_context:
+        context = f"""
+        Dados do paciente:
+        Nome: {patient_context.get('name', 'N/A')}
+        Idade: {patient_context.get('age', 'N/A')}
+        Histórico: {patient_context.get('history', 'N/A')}
+        """
+
+    prompt = f"""
+    Você é um assistente médico especializado em clínica estética.
+    Analise a transcrição do atendimento abaixo e crie um resumo estruturado do prontuário.
+
+    {context}
+
+    TRANSCRIÇÃO DO ATENDIMENTO:
+    {transcription}
+
+    Crie um resumo estruturado contendo:
+    1. QUEIXA PRINCIPAL
+    2. HISTÓRICO
+    3. AVALIAÇÃO FÍSICA
+    4. PROCEDIMENTO REALIZADO/RECOMENDADO
+    5. ORIENTAÇÕES PÓS-TRATAMENTO
+    6. PRÓXIMOS PASSOS
+
+    Mantenha o formato profissional e objetivo.
+    """
+
+    return [
+        {"role": "system", "content": "Você é um assistente médico especializado em estética."},
+        {"role": "user", "content": prompt}
+    ]
 
 class AIService:
 
     @staticmethod
-    async def transcribe_audio(audio_file_path: str) -> dict:
+    async def close():
+        await client.close()
+
+    @staticmethod
+    async def transcribe_audio(audio_file_path: str, audio_sha256: Optional[str] = None) -> dict:
         """
         Transcreve áudio para texto usando Whisper
+        Gravações longas são divididas em trechos transcritos em paralelo;
+        o mesmo áudio (pelo SHA-256) não é transcrito duas vezes
         """
+        async def transcribe(path: str) -> str:
+            async def request():
+                with open(path, "rb") as audio_file:
+                    return await client.audio.transcriptions.create(
+                        model=TRANSCRIPTION_MODEL,
+                        file=audio_file,
+                        language="pt",
+                        timeout=TRANSCRIPTION_TIMEOUT_SECONDS
+                    )
+
+            transcript = await _call(TRANSCRIPTION_MODEL, request)
+            return transcript.text
+
         try:
-            with open(audio_file_path, "rb") as audio_file:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="pt"
-                )
+            key = cache_key("transcription", TRANSCRIPTION_MODEL, audio_sha256 or await StorageService.checksum(audio_file_path), "pt")
+            transcription = await ai_cache.get(key)
+
+            if transcription is None:
+                async with audio_segments(audio_file_path) as segments:
+                    texts = await asyncio.gather(*[transcribe(segment) for segment in segments])
+                transcription = stitch_transcripts(texts)
+                await ai_cache.set(key, "transcription", TRANSCRIPTION_MODEL, transcription)
 
             return {
                 "success": True,
-                "transcription": transcript.text,
+                "transcription": transcription,
                 "error": None
             }
         except Exception as e:
@@ -43,46 +201,22 @@ class AIService:
         Cria resumo estruturado do prontuário usando GPT-4
         """
         try:
-            context = ""
-            if patient_context:
-                context = f"""
-                Dados do paciente:
-                Nome: {patient_context.get('name', 'N/A')}
-                Idade: {patient_context.get('age', 'N/A')}
-                Histórico: {patient_context.get('history', 'N/A')}
-                """
-
-            prompt = f"""
-            Você é um assistente médico especializado em clínica estética.
-            Analise a transcrição do atendimento abaixo e crie um resumo estruturado do prontuário.
-
-            {context}
-
-            TRANSCRIÇÃO DO ATENDIMENTO:
-            {transcription}
-
-            Crie um resumo estruturado contendo:
-            1. QUEIXA PRINCIPAL
-            2. HISTÓRICO
-            3. AVALIAÇÃO FÍSICA
-            4. PROCEDIMENTO REALIZADO/RECOMENDADO
-            5. ORIENTAÇÕES PÓS-TRATAMENTO
-            6. PRÓXIMOS PASSOS
-
-            Mantenha o formato profissional e objetivo.
-            """
-
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "Você é um assistente médico especializado em estética."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1000
-            )
+            messages = _summary_messages(transcription, patient_context)
+            key = cache_key("summary", CHAT_MODEL, messages, 0.3, 1000)
+            summary = await ai_cache.get(key)
 
-            summary = response.choices[0].message.content
+            # Resumo vazio é falha: não vai para o cache nem é devolvido como sucesso
+            if not (summary or "").strip():
+                response = await _call(CHAT_MODEL, lambda: client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=1000
+                ))
+                summary = response.choices[0].message.content
+                if not (summary or "").strip():
+                    raise ValueError("Empty summary returned by model")
+                await ai_cache.set(key, "summary", CHAT_MODEL, summary)
 
             return {
                 "success": True,
@@ -96,6 +230,40 @@ class AIService:
                 "error": str(e)
             }
 
+    @staticmethod
+    async def stream_medical_summary(transcription: str, patient_context: Optional[dict] = None) -> AsyncIterator[str]:
+        """
+        Mesmo resumo de summarize_medical_record, entregue em pedaços
+        conforme o modelo gera; o texto completo vai para o cache no fim
+        (só se não for vazio)
+        """
+        messages = _summary_messages(transcription, patient_context)
+        key = cache_key("summary", CHAT_MODEL, messages, 0.3, 1000)
+        cached = await ai_cache.get(key)
+        if (cached or "").strip():
+            yield cached
+            return
+
+        parts = []
+        async with _semaphore(CHAT_MODEL):
+            stream = await _retry(lambda: client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=1000,
+                stream=True
+            ))
+
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+        summary = "".join(parts)
+        if summary.strip():
+            await ai_cache.set(key, "summary", CHAT_MODEL, summary)
+
     @staticmethod
     async def extract_key_info(transcription: str) -> dict:
         """
@@ -116,18 +284,23 @@ class AIService:
             Retorne apenas o JSON, sem texto adicional.
             """
 
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "Você extrai informações estruturadas de transcrições médicas."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
+            messages = [
+                {"role": "system", "content": "Você extrai informações estruturadas de transcrições médicas."},
+                {"role": "user", "content": prompt}
+            ]
+            key = cache_key("extraction", CHAT_MODEL, messages, 0.1, 500)
+            extracted_info = await ai_cache.get(key)
 
-            import json
-            extracted_info = json.loads(response.choices[0].message.content)
+            if extracted_info is None:
+                response = await _call(CHAT_MODEL, lambda: client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=500
+                ))
+
+                extracted_info = json.loads(response.choices[0].message.content)
+                await ai_cache.set(key, "extraction", CHAT_MODEL, extracted_info)
 
             return {
                 "success": True,
@@ -142,21 +315,142 @@ class AIService:
             }
 
     @staticmethod
-    async def generate_whatsapp_response(context: str, user_message: str) -> str:
+    async def analyze_medical_record(transcription: str, patient_context: Optional[dict] = None) -> dict:
+        """
+        Resumo estruturado e extração de informações em uma única chamada,
+        com a resposta validada contra MedicalRecordAnalysis
+        """
+        try:
+            context = ""
+            if patient_context:
+                context = f"""
+                Dados do paciente:
+                Nome: {patient_context.get('name', 'N/A')}
+                Idade: {patient_context.get('age', 'N/A')}
+                Histórico: {patient_context.get('history', 'N/A')}
+                """
+
+            prompt = f"""
+            Você é um assistente médico especializado em clínica estética.
+            Analise a transcrição do atendimento abaixo.
+
+            {context}
+
+            TRANSCRIÇÃO DO ATENDIMENTO:
+            {transcription}
+
+            Responda apenas com um JSON neste formato:
+            {{
+              "resumo": {{
+                "queixa_principal": "...",
+                "historico": "...",
+                "avaliacao_fisica": "...",
+                "procedimento": "procedimento realizado/recomendado",
+                "orientacoes": "orientações pós-tratamento",
+                "proximos_passos": "..."
+              }},
+              "extracao": {{
+                "procedimentos_mencionados": [],
+                "medicamentos": [],
+                "alergias": [],
+                "proxima_consulta": "data mencionada para retorno ou null",
+                "recomendacoes": []
+              }}
+            }}
+
+            Mantenha o resumo profissional e objetivo; use listas vazias quando nada for mencionado.
+            """
+
+            messages = [
+                {"role": "system", "content": "Você é um assistente médico especializado em estética e responde em JSON."},
+                {"role": "user", "content": prompt}
+            ]
+            key = cache_key("analysis", CHAT_MODEL, messages, 0.2, 1500)
+            data = await ai_cache.get(key)
+
+            if data is None:
+                response = await _call(CHAT_MODEL, lambda: client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=1500,
+                    response_format={"type": "json_object"}
+                ))
+                data = MedicalRecordAnalysis.model_validate_json(response.choices[0].message.content).model_dump()
+                await ai_cache.set(key, "analysis", CHAT_MODEL, data)
+
+            analysis = MedicalRecordAnalysis.model_validate(data)
+
+            return {
+                "success": True,
+                "summary": format_summary(analysis.resumo),
+                "sections": analysis.resumo.model_dump(),
+                "data": analysis.extracao.model_dump(),
+                "error": None
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "summary": None,
+                "sections": None,
+                "data": None,
+                "error": str(e)
+            }
+
+    @staticmethod
+    async def generate_whatsapp_response(context: str, user_message: str, history: Optional[List[dict]] = None) -> str:
         """
         Gera resposta automática para mensagens do WhatsApp
+        `history`: turnos anteriores ({"role", "content"}), do mais antigo ao mais recente
         """
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+            response = await _call(CHAT_MODEL, lambda: client.chat.completions.create(
+                model=CHAT_MODEL,
                 messages=[
                     {"role": "system", "content": f"Você é a assistente virtual de uma clínica estética. {context}"},
+                    *(history or []),
                     {"role": "user", "content": user_message}
                 ],
                 temperature=0.7,
                 max_tokens=300
+            ))
+
+            return response.choices[0].message.content
+        except Exception as e:
+            return WHATSAPP_FALLBACK_REPLY
+
+    @staticmethod
+    async def summarize_conversation(previous_summary: str, turns: List[dict]) -> Optional[str]:
+        """
+        Atualiza o resumo de uma conversa de WhatsApp com novos turnos
+        """
+        try:
+            dialogue = "\n".join(
+                f"{'Paciente' if turn['role'] == 'user' else 'Clínica'}: {turn['content']}"
+                for turn in turns
             )
+            prompt = f"""
+            Resumo atual da conversa:
+            {previous_summary or '(vazio)'}
+
+            Novas mensagens:
+            {dialogue}
+
+            Atualize o resumo em até 5 frases, mantendo apenas o que for útil para
+            continuar o atendimento (interesses, dúvidas em aberto, preferências, combinados).
+            """
+
+            response = await _call(CHAT_MODEL, lambda: client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": "Você resume conversas de atendimento de uma clínica estética."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=250
+            ))
 
             return response.choices[0].message.content
         except Exception as e:
-            return "Desculpe, não consegui processar sua mensagem. Por favor, entre em contato com nossa equipe."
+            print(f"Error summarizing conversation: {e}")
+            return None
@@ -0,0 +1,158 @@
+"""
+Segmentação de áudios longos para transcrição em paralelo
+Corta o áudio (ffmpeg) em trechos de até SEGMENT_SECONDS, preferindo pontos
+de silêncio, com uma pequena sobreposição entre trechos; depois junta os
+textos na ordem removendo as palavras repetidas na sobreposição
+"""
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import unicodedata
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+SEGMENT_SECONDS = 600          # Duração alvo de cada trecho
+SILENCE_SEARCH_SECONDS = 60    # Janela (antes do alvo) para procurar silêncio
+OVERLAP_SECONDS = 2
+MAX_SINGLE_FILE_BYTES = 24 * 1024 * 1024  # Limite da API do Whisper é 25 MB
+MAX_PARALLEL_EXTRACTIONS = 4
+SILENCE_FILTER = "silencedetect=noise=-35dB:d=0.4"
+MAX_OVERLAP_WORDS = 40
+MIN_OVERLAP_WORDS = 2  # Uma palavra só ("e", "de") coincide por acaso
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+async def _run(*args: str) -> Tuple[int, str, str]:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode(errors="ignore"), stderr.decode(errors="ignore")
+
+def ffmpeg_available() -> bool:
+    return bool(shutil.which("ffmpeg") and shutil.which("ffprobe"))
+
+async def probe_duration(path: str) -> Optional[float]:
+    code, stdout, _ = await _run(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path
+    )
+    try:
+        return float(stdout.strip()) if code == 0 else None
+    except ValueError:
+        return None
+
+async def detect_silences(path: str) -> List[float]:
+    """
+    Retorna o ponto médio de cada intervalo de silêncio, em segundos
+    """
+    _, _, stderr = await _run("ffmpeg", "-hide_banner", "-nostats", "-i", path, "-af", SILENCE_FILTER, "-f", "null", "-")
+
+    midpoints = []
+    start = None
+    for line in stderr.splitlines():
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(float(match.group(1)), 0.0)
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            midpoints.append((start + float(match.group(1))) / 2)
+            start = None
+    return midpoints
+
+def plan_cuts(duration: float, silences: List[float]) -> List[float]:
+    """
+    Pontos de corte: para cada alvo (múltiplos de SEGMENT_SECONDS) usa o último
+    silêncio da janela que o antecede; sem silêncio, corta no próprio alvo
+    """
+    cuts = []
+    position = 0.0
+    while duration - position > SEGMENT_SECONDS:
+        target = position + SEGMENT_SECONDS
+        candidates = [s for s in silences if target - SILENCE_SEARCH_SECONDS <= s <= target]
+        position = candidates[-1] if candidates else target
+        cuts.append(position)
+    return cuts
+
+def plan_segments(duration: float, silences: List[float]) -> List[Tuple[float, float]]:
+    """
+    Lista de (início, duração), com OVERLAP_SECONDS de sobreposição entre vizinhos
+    """
+    bounds = [0.0] + plan_cuts(duration, silences) + [duration]
+    segments = []
+    for start, end in zip(bounds, bounds[1:]):
+        start = max(start - OVERLAP_SECONDS, 0.0)
+        end = min(end + OVERLAP_SECONDS, duration)
+        segments.append((start, end - start))
+    return segments
+
+async def _extract(path: str, start: float, length: float, output: str):
+    # Mono 16 kHz em 32 kbps: 10 min ficam bem abaixo do limite de upload
+    code, _, stderr = await _run(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", path,
+        "-vn", "-ac", "1", "-ar", "16000", "-b:a", "32k", output
+    )
+    if code != 0:
+        raise RuntimeError(f"ffmpeg failed on segment at {start:.1f}s: {stderr.strip()}")
+
+@asynccontextmanager
+async def audio_segments(path: str) -> AsyncIterator[List[str]]:
+    """
+    Produz os caminhos dos trechos, na ordem. Arquivos curtos (ou sem ffmpeg
+    instalado) passam inteiros; os trechos temporários são apagados na saída
+    """
+    if not ffmpeg_available():
+        yield [path]
+        return
+
+    duration = await probe_duration(path)
+    if duration is None or (duration <= SEGMENT_SECONDS and os.path.getsize(path) <= MAX_SINGLE_FILE_BYTES):
+        yield [path]
+        return
+
+    silences = await detect_silences(path)
+    segments = plan_segments(duration, silences)
+
+    with tempfile.TemporaryDirectory(prefix="segments_") as directory:
+        outputs = [os.path.join(directory, f"{index:03d}.mp3") for index in range(len(segments))]
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_EXTRACTIONS)
+
+        async def extract(segment: Tuple[float, float], output: str):
+            async with semaphore:
+                await _extract(path, segment[0], segment[1], output)
+
+        await asyncio.gather(*[extract(segment, output) for segment, output in zip(segments, outputs)])
+        yield outputs
+
+def _normalize(word: str) -> str:
+    word = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in word if c.isalnum())
+
+def stitch_transcripts(texts: List[str]) -> str:
+    """
+    Junta os textos dos trechos; a maior sequência de palavras que termina um
+    trecho e inicia o seguinte (a sobreposição) é mantida uma única vez
+    """
+    words: List[str] = []
+    for text in texts:
+        incoming = (text or "").split()
+        if not incoming:
+            continue
+
+        tail = [_normalize(w) for w in words[-MAX_OVERLAP_WORDS:]]
+        head = [_normalize(w) for w in incoming[:MAX_OVERLAP_WORDS]]
+        overlap = 0
+        for size in range(min(len(tail), len(head)), MIN_OVERLAP_WORDS - 1, -1):
+            if tail[-size:] == head[:size]:
+                overlap = size
+                break
+
+        words.extend(incoming[overlap:])
+    return " ".join(words)
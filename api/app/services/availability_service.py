@@ -0,0 +1,169 @@
+"""
+Motor de disponibilidade da agenda
+Indexa agendamentos e bloqueios de cada profissional uma única vez
+e varre as janelas livres para gerar os horários disponíveis
+"""
+import asyncio
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+from app.core.pagination import fetch_all
+
+SLOT_INTERVAL_MINUTES = 30  # Intervalo entre o início de dois slots
+MAX_RANGE_DAYS = 31
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+class IntervalIndex:
+    """
+    Intervalos ocupados de um profissional, ordenados e mesclados.
+    Como os intervalos mesclados são disjuntos, início e fim ficam
+    ordenados e podem ser consultados com busca binária.
+    """
+
+    def __init__(self, intervals: List[Tuple[datetime, datetime]]):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def free_windows(self, start: datetime, end: datetime):
+        """
+        Gera as janelas livres dentro de [start, end)
+        """
+        cursor = start
+        i = bisect_right(self.ends, start)
+
+        while i < len(self.starts) and self.starts[i] < end:
+            if self.starts[i] > cursor:
+                yield cursor, self.starts[i]
+            cursor = max(cursor, self.ends[i])
+            i += 1
+
+        if cursor < end:
+            yield cursor, end
+
+class AvailabilityService:
+
+    @staticmethod
+    def compute_slots(
+        availability: List[dict],
+        index: IntervalIndex,
+        start_date: date,
+        end_date: date,
+        duration: int,
+        tz: ZoneInfo
+    ) -> List[dict]:
+        """
+        Gera os slots livres de um profissional entre start_date e end_date (inclusive)
+        """
+        by_weekday: Dict[int, List[dict]] = {}
+        for av in availability:
+            by_weekday.setdefault(av["day_of_week"], []).append(av)
+
+        step = timedelta(minutes=SLOT_INTERVAL_MINUTES)
+        length = timedelta(minutes=duration)
+        slots = []
+
+        day = start_date
+        while day <= end_date:
+            for av in by_weekday.get(day.weekday(), []):
+                window_start = datetime.combine(day, time.fromisoformat(av["start_time"]), tzinfo=tz)
+                window_end = datetime.combine(day, time.fromisoformat(av["end_time"]), tzinfo=tz)
+
+                for free_start, free_end in index.free_windows(window_start, window_end):
+                    # Alinhar à grade de 30 min a partir do início da janela
+                    offset = -(-(free_start - window_start) // step)
+                    current = window_start + offset * step
+
+                    while current + length <= free_end:
+                        slots.append({
+                            "date": day.isoformat(),
+                            "start_time": current.isoformat(),
+                            "end_time": (current + length).isoformat(),
+                            "display": current.strftime("%H:%M")
+                        })
+                        current += step
+            day += timedelta(days=1)
+
+        return slots
+
+    @staticmethod
+    async def get_available_slots(
+        start_date: date,
+        end_date: date,
+        procedimento_id: str,
+        professional_id: Optional[str] = None
+    ) -> List[dict]:
+        """
+        Horários disponíveis de um ou de todos os profissionais no período
+        """
+        tz = ZoneInfo(settings.CLINIC_TIMEZONE)
+        range_start = datetime.combine(start_date, time.min, tzinfo=tz).isoformat()
+        range_end = datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tz).isoformat()
+
+        def availability_query():
+            query = db.table("availability_settings")\
+                .select("id, professional_id, day_of_week, start_time, end_time")\
+                .eq("is_available", True)
+            return query.eq("professional_id", professional_id) if professional_id else query
+
+        # Tudo que intercepta o período: começa antes do fim e termina depois do início
+        def appointments_query():
+            query = db.table("agendamentos")\
+                .select("id, professional_id, start_time, end_time")\
+                .lt("start_time", range_end)\
+                .gt("end_time", range_start)\
+                .neq("status", "cancelled")
+            return query.eq("professional_id", professional_id) if professional_id else query
+
+        def blocked_query():
+            query = db.table("blocked_times")\
+                .select("id, professional_id, start_time, end_time")\
+                .lt("start_time", range_end)\
+                .gt("end_time", range_start)
+            return query.eq("professional_id", professional_id) if professional_id else query
+
+        # Em páginas: uma linha cortada pelo max-rows viraria um horário livre falso
+        availability, procedimento, appointments, blocked = await asyncio.gather(
+            fetch_all(availability_query),
+            db.table("procedimentos").select("duration").eq("id", procedimento_id).single().execute(),
+            fetch_all(appointments_query, sort="start_time"),
+            fetch_all(blocked_query, sort="start_time")
+        )
+
+        duration = procedimento.data.get("duration") or 60
+
+        # Parse único de cada intervalo, agrupado por profissional
+        busy: Dict[str, List[Tuple[datetime, datetime]]] = {}
+        for row in appointments + blocked:
+            busy.setdefault(row["professional_id"], []).append(
+                (parse_timestamp(row["start_time"]), parse_timestamp(row["end_time"]))
+            )
+
+        windows: Dict[str, List[dict]] = {}
+        for av in availability:
+            windows.setdefault(av["professional_id"], []).append(av)
+
+        slots = []
+        for pid, professional_windows in windows.items():
+            index = IntervalIndex(busy.get(pid, []))
+            for slot in AvailabilityService.compute_slots(professional_windows, index, start_date, end_date, duration, tz):
+                slot["professional_id"] = pid
+                slots.append(slot)
+
+        slots.sort(key=lambda s: (s["start_time"], s["professional_id"]))
+        return slots
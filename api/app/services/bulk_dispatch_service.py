@@ -0,0 +1,262 @@
+"""
+Disparo em massa de mensagens WhatsApp (lembretes e campanhas)
+Envia com concorrência limitada e respeitando o rate limit da instância
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+from app.core.pagination import fetch_all
+from app.services.availability_service import parse_timestamp
+from app.services.whatsapp_service import whatsapp_service
+
+MAX_CONCURRENCY = 10
+MAX_TRACKED_JOBS = 50
+UPDATE_CHUNK_SIZE = 200    # ids por PATCH (mantém a URL do in.(...) curta)
+PROGRESS_EVERY = 50        # Envios entre gravações do progresso da campanha
+
+DEFAULT_REMINDER_TEMPLATE = """
+⏰ *Lembrete de Consulta*
+
+Olá {patient_name},
+
+Lembramos que você tem consulta agendada:
+
+📋 {procedure}
+📅 {date} às {time}
+👩‍⚕️ Com {professional}
+
+Confirme sua presença respondendo SIM.
+
+Te esperamos! 💙
+"""
+
+def render_template(template: str, variables: Dict) -> str:
+    """
+    Substitui {variavel} pelos valores (mesmo formato das automation_rules)
+    """
+    message = template
+    for key, value in variables.items():
+        message = message.replace(f"{{{key}}}", str(value))
+    return message
+
+class RateLimiter:
+    """
+    Token bucket: no máximo `rate` envios por segundo, com rajada de `rate`
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class BulkDispatcher:
+
+    def __init__(self):
+        self.jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.rate_limiter = RateLimiter(settings.WHATSAPP_RATE_LIMIT_PER_SECOND)
+
+    def create_job(self, recipients: List[dict], template: str, source: str, campaign_id: Optional[str] = None) -> dict:
+        job = {
+            "id": str(uuid.uuid4()),
+            "source": source,
+            "campaign_id": campaign_id,
+            "template": template,
+            "status": "queued",
+            "total": len(recipients),
+            "sent": 0,
+            "failed": 0,
+            "recipients": recipients,
+            "results": [],
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None
+        }
+
+        self.jobs[job["id"]] = job
+        while len(self.jobs) > MAX_TRACKED_JOBS:
+            self.jobs.popitem(last=False)
+
+        return job
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        return self.jobs.get(job_id)
+
+    @staticmethod
+    async def get_campaign_job(job_id: str) -> Optional[dict]:
+        """
+        Progresso gravado na campanha (jobs que não estão mais em memória, p. ex. após reinício)
+        """
+        campaign = await db.table("campaigns")\
+            .select("id, dispatch_status, dispatch_total, dispatch_sent, dispatch_failed, dispatch_updated_at")\
+            .eq("dispatch_job_id", job_id)\
+            .maybe_single()\
+            .execute()
+        if not campaign.data:
+            return None
+
+        row = campaign.data
+        return {
+            "id": job_id,
+            "campaign_id": row["id"],
+            "status": row["dispatch_status"],
+            "total": row["dispatch_total"],
+            "sent": row["dispatch_sent"],
+            "failed": row["dispatch_failed"],
+            "updated_at": row["dispatch_updated_at"]
+        }
+
+    @staticmethod
+    async def _save_progress(job: dict):
+        """
+        Grava status e contadores na campanha do job (se houver); falha aqui não interrompe o envio
+        """
+        if not job.get("campaign_id"):
+            return
+        try:
+            await db.table("campaigns").update({
+                "dispatch_job_id": job["id"],
+                "dispatch_status": job["status"],
+                "dispatch_total": job["total"],
+                "dispatch_sent": job["sent"],
+                "dispatch_failed": job["failed"],
+                "dispatch_updated_at": datetime.now(timezone.utc).isoformat()
+            }).eq("id", job["campaign_id"]).execute()
+        except Exception as e:
+            print(f"Error saving campaign progress: {e}")
+
+    async def run(self, job: dict):
+        """
+        Envia para todos os destinatários do job e registra o resultado de cada um
+        """
+        try:
+            await self._run(job)
+        except Exception:
+            job["status"] = "failed"
+            job["finished_at"] = datetime.now().isoformat()
+            await self._save_progress(job)
+            raise
+
+    async def _run(self, job: dict):
+        job["status"] = "running"
+        await self._save_progress(job)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+        async def send(recipient: dict):
+            async with semaphore:
+                await self.rate_limiter.acquire()
+                message = render_template(job["template"], recipient.get("variables", {}))
+                result = await whatsapp_service.send_text_message(recipient["to"], message)
+
+            if result.get("success"):
+                job["sent"] += 1
+            else:
+                job["failed"] += 1
+
+            job["results"].append({
+                "to": recipient["to"],
+                "reference_id": recipient.get("reference_id"),
+                "success": bool(result.get("success")),
+                "error": result.get("error")
+            })
+
+            if len(job["results"]) % PROGRESS_EVERY == 0:
+                await self._save_progress(job)
+
+        await asyncio.gather(*[send(r) for r in job["recipients"]])
+
+        # Lembretes: marca os agendamentos notificados, em blocos de ids
+        if job["source"] == "appointments_tomorrow":
+            sent_ids = [r["reference_id"] for r in job["results"] if r["success"] and r["reference_id"]]
+            for i in range(0, len(sent_ids), UPDATE_CHUNK_SIZE):
+                await db.table("agendamentos")\
+                    .update({"reminder_sent": True})\
+                    .in_("id", sent_ids[i:i + UPDATE_CHUNK_SIZE])\
+                    .execute()
+
+        job["status"] = "completed"
+        job["finished_at"] = datetime.now().isoformat()
+        await self._save_progress(job)
+
+    @staticmethod
+    async def recipients_for_tomorrow_appointments() -> List[dict]:
+        """
+        Destinatários de lembrete: agendamentos ativos de amanhã ainda não lembrados,
+        lidos em páginas por (start_time, id) para não esbarrar no max-rows do PostgREST
+        """
+        tz = ZoneInfo(settings.CLINIC_TIMEZONE)
+        tomorrow = datetime.now(tz).date() + timedelta(days=1)
+        start = datetime.combine(tomorrow, datetime.min.time(), tzinfo=tz)
+
+        appointments = await fetch_all(
+            lambda: db.table("agendamentos")
+                .select("id, start_time, pacientes(full_name, whatsapp_number), procedimentos(name), profiles(full_name)")
+                .gte("start_time", start.isoformat())
+                .lt("start_time", (start + timedelta(days=1)).isoformat())
+                .in_("status", ["pending", "confirmed"])
+                .eq("reminder_sent", False),
+            sort="start_time"
+        )
+
+        recipients = []
+        for a in appointments:
+            paciente = a.get("pacientes") or {}
+            if not paciente.get("whatsapp_number"):
+                continue
+
+            start_dt = parse_timestamp(a["start_time"]).astimezone(tz)
+            recipients.append({
+                "to": paciente["whatsapp_number"],
+                "reference_id": a["id"],
+                "variables": {
+                    "patient_name": paciente.get("full_name", ""),
+                    "procedure": (a.get("procedimentos") or {}).get("name", ""),
+                    "professional": (a.get("profiles") or {}).get("full_name", ""),
+                    "date": start_dt.strftime("%d/%m/%Y"),
+                    "time": start_dt.strftime("%H:%M")
+                }
+            })
+
+        return recipients
+
+    @staticmethod
+    async def recipients_for_patients(tag: Optional[str] = None) -> List[dict]:
+        """
+        Destinatários de campanha: pacientes com WhatsApp (opcionalmente por tag),
+        lidos em páginas por id para não esbarrar no limite de linhas do PostgREST
+        """
+        def patients_query():
+            query = db.table("pacientes")\
+                .select("id, full_name, whatsapp_number")\
+                .filter("whatsapp_number", "not.is", "null")\
+                .neq("whatsapp_number", "")
+            return query.filter("tags", "cs", f"{{{tag}}}") if tag else query
+
+        patients = await fetch_all(patients_query)
+
+        return [
+            {
+                "to": p["whatsapp_number"],
+                "reference_id": p["id"],
+                "variables": {"patient_name": p.get("full_name") or ""}
+            }
+            for p in patients
+        ]
+
+bulk_dispatcher = BulkDispatcher()
@@ -0,0 +1,190 @@
+"""
+Contexto das conversas com a IA no WhatsApp, por número
+Janela das mensagens recentes (limitada por um orçamento de tokens) carregada
+de whatsapp_messages e mantida em memória, próximos agendamentos do paciente
+e um resumo incremental do histórico mais antigo, que não é reenviado
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+from app.services.ai_service import AIService
+from app.services.availability_service import parse_timestamp
+from app.services.identity_service import normalize_phone, phone_variants
+
+HISTORY_TOKEN_BUDGET = 1200
+MAX_LOADED_MESSAGES = 30
+SUMMARIZE_MIN_TURNS = 8          # Turnos fora da janela antes de resumir
+MAX_CACHED_CONTEXTS = 2000
+CONTEXT_TTL_SECONDS = 3600
+APPOINTMENTS_TTL_SECONDS = 120
+MAX_UPCOMING_APPOINTMENTS = 3
+
+BASE_PROMPT = "Você ajuda pacientes a agendar consultas, confirmar agendamentos e tirar dúvidas."
+
+def estimate_tokens(text: str) -> int:
+    # Aproximação suficiente para o orçamento (~4 caracteres por token em português)
+    return len(text or "") // 4 + 4
+
+class ChatContext:
+
+    def __init__(self):
+        self._contexts: "OrderedDict[str, dict]" = OrderedDict()
+
+    def _cached(self, phone: str) -> Optional[dict]:
+        state = self._contexts.get(phone)
+        if state is None:
+            return None
+        if time.monotonic() - state["touched"] > CONTEXT_TTL_SECONDS:
+            del self._contexts[phone]
+            return None
+
+        state["touched"] = time.monotonic()
+        self._contexts.move_to_end(phone)
+        return state
+
+    async def _load(self, phone: str) -> dict:
+        state = self._cached(phone)
+        if state:
+            return state
+
+        session = await db.table("whatsapp_sessions")\
+            .select("history_summary, history_summarized_until")\
+            .eq("phone_number", phone)\
+            .maybe_single()\
+            .execute()
+        session = session.data or {}
+
+        # Só o que ainda não entrou no resumo
+        query = db.table("whatsapp_messages")\
+            .select("direction, content, created_at")\
+            .in_("chat_id", phone_variants(phone))\
+            .eq("message_type", "text")
+        if session.get("history_summarized_until"):
+            query = query.gt("created_at", session["history_summarized_until"])
+        messages = await query.order("created_at", desc=True).limit(MAX_LOADED_MESSAGES).execute()
+
+        state = {
+            "turns": [
+                {"role": "user" if m["direction"] == "inbound" else "assistant", "content": m["content"], "at": m["created_at"]}
+                for m in reversed(messages.data) if m.get("content")
+            ],
+            "summary": session.get("history_summary") or "",
+            "appointments": None,
+            "appointments_at": 0.0,
+            "touched": time.monotonic()
+        }
+
+        self._contexts[phone] = state
+        while len(self._contexts) > MAX_CACHED_CONTEXTS:
+            self._contexts.popitem(last=False)
+        return state
+
+    async def _appointments(self, state: dict, paciente_id: str) -> List[dict]:
+        if state["appointments"] is None or time.monotonic() - state["appointments_at"] > APPOINTMENTS_TTL_SECONDS:
+            result = await db.table("agendamentos")\
+                .select("start_time, status, procedimentos(name)")\
+                .eq("paciente_id", paciente_id)\
+                .gte("start_time", datetime.now(ZoneInfo(settings.CLINIC_TIMEZONE)).isoformat())\
+                .neq("status", "cancelled")\
+                .order("start_time")\
+                .limit(MAX_UPCOMING_APPOINTMENTS)\
+                .execute()
+            state["appointments"] = result.data
+            state["appointments_at"] = time.monotonic()
+        return state["appointments"]
+
+    @staticmethod
+    def _window(turns: List[dict]) -> int:
+        """
+        Índice do primeiro turno que cabe no orçamento, do mais recente para trás
+        """
+        used = 0
+        for index in range(len(turns) - 1, -1, -1):
+            used += estimate_tokens(turns[index]["content"])
+            if used > HISTORY_TOKEN_BUDGET:
+                return index + 1
+        return 0
+
+    async def build(self, raw_phone: str, paciente: dict, text: str) -> dict:
+        """
+        Retorna {"system", "history"} para AIService.generate_whatsapp_response;
+        `history` são os turnos anteriores à mensagem atual (`text`)
+        """
+        phone = normalize_phone(raw_phone)
+        state = await self._load(phone)
+
+        last = state["turns"][-1] if state["turns"] else None
+        if not last or (last["role"], last["content"]) != ("user", text):
+            state["turns"].append(self._turn("user", text))
+
+        appointments = await self._appointments(state, paciente["id"])
+        tz = ZoneInfo(settings.CLINIC_TIMEZONE)
+
+        system = f"{BASE_PROMPT}\nPaciente: {paciente.get('full_name', '')}."
+        if appointments:
+            lines = [
+                f"- {parse_timestamp(a['start_time']).astimezone(tz).strftime('%d/%m/%Y %H:%M')} "
+                f"{(a.get('procedimentos') or {}).get('name', '')} ({a['status']})"
+                for a in appointments
+            ]
+            system += "\nPróximos agendamentos:\n" + "\n".join(lines)
+        else:
+            system += "\nO paciente não tem agendamentos futuros."
+        if state["summary"]:
+            system += f"\nResumo das conversas anteriores: {state['summary']}"
+
+        turns = state["turns"]
+        history = [{"role": t["role"], "content": t["content"]} for t in turns[self._window(turns):-1]]
+        return {"system": system, "history": history}
+
+    @staticmethod
+    def _turn(role: str, content: str) -> dict:
+        return {"role": role, "content": content, "at": datetime.now(timezone.utc).isoformat()}
+
+    def record(self, raw_phone: str, role: str, content: str):
+        """
+        Acrescenta um turno ao contexto em memória (se carregado); o banco
+        recebe a mensagem pelo message_log
+        """
+        state = self._cached(normalize_phone(raw_phone))
+        if state and content:
+            state["turns"].append(self._turn(role, content))
+
+    def forget_appointments(self, raw_phone: str):
+        state = self._contexts.get(normalize_phone(raw_phone))
+        if state:
+            state["appointments"] = None
+
+    async def compact(self, raw_phone: str):
+        """
+        Incorpora ao resumo os turnos que saíram da janela, em lotes
+        """
+        phone = normalize_phone(raw_phone)
+        state = self._cached(phone)
+        if not state:
+            return
+
+        start = self._window(state["turns"])
+        if start < SUMMARIZE_MIN_TURNS:
+            return
+
+        older = state["turns"][:start]
+        summary = await AIService.summarize_conversation(state["summary"], older)
+        if not summary:
+            return
+
+        state["summary"] = summary
+        state["turns"] = state["turns"][start:]
+
+        await db.table("whatsapp_sessions").upsert({
+            "phone_number": phone,
+            "session_name": "conversation",
+            "history_summary": summary,
+            "history_summarized_until": older[-1]["at"]
+        }, on_conflict="phone_number", returning="minimal").execute()
+
+chat_context = ChatContext()
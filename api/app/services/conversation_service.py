@@ -0,0 +1,81 @@
+"""
+Estado das conversas do bot de WhatsApp
+Mantido em memória por número, com write-through em whatsapp_sessions
+para sobreviver a reinícios e ser compartilhado entre processos
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from app.core.database import db
+from app.services.identity_service import normalize_phone
+
+SESSION_TIMEOUT_SECONDS = 30 * 60  # Conversa parada volta ao início
+MAX_CACHED_SESSIONS = 5000
+
+IDLE = "idle"
+
+def to_epoch(value: Optional[str]) -> float:
+    """
+    updated_at do banco (ISO 8601) -> segundos; sem valor conta como expirado
+    """
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+class ConversationStore:
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, dict]" = OrderedDict()
+
+    def _cache(self, phone: str, state: dict) -> dict:
+        self._sessions[phone] = state
+        self._sessions.move_to_end(phone)
+        while len(self._sessions) > MAX_CACHED_SESSIONS:
+            self._sessions.popitem(last=False)
+        return state
+
+    async def get(self, raw_phone: str) -> dict:
+        """
+        Retorna {"step", "context", "updated_at"}; lê o banco só quando não está em memória.
+        A expiração usa o updated_at gravado, então uma conversa parada não
+        revive após um reinício ou em outro processo
+        """
+        phone = normalize_phone(raw_phone)
+        state = self._sessions.get(phone)
+
+        if state is None:
+            row = await db.table("whatsapp_sessions")\
+                .select("conversation_step, conversation_context, updated_at")\
+                .eq("phone_number", phone)\
+                .maybe_single()\
+                .execute()
+
+            state = {
+                "step": (row.data or {}).get("conversation_step") or IDLE,
+                "context": (row.data or {}).get("conversation_context") or {},
+                "updated_at": to_epoch((row.data or {}).get("updated_at"))
+            }
+            self._cache(phone, state)
+
+        if state["step"] != IDLE and time.time() - state["updated_at"] > SESSION_TIMEOUT_SECONDS:
+            state = self._cache(phone, {"step": IDLE, "context": {}, "updated_at": time.time()})
+
+        return state
+
+    async def set(self, raw_phone: str, step: str, context: Optional[dict] = None):
+        phone = normalize_phone(raw_phone)
+        state = self._cache(phone, {"step": step, "context": context or {}, "updated_at": time.time()})
+
+        await db.table("whatsapp_sessions").upsert({
+            "phone_number": phone,
+            "session_name": "conversation",
+            "conversation_step": state["step"],
+            "conversation_context": state["context"],
+            "updated_at": datetime.fromtimestamp(state["updated_at"], timezone.utc).isoformat()
+        }, on_conflict="phone_number", returning="minimal").execute()
+
+    async def reset(self, raw_phone: str):
+        await self.set(raw_phone, IDLE)
+
+conversation_store = ConversationStore()
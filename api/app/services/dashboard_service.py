@@ -0,0 +1,99 @@
+"""
+Estatísticas do dashboard a partir dos agregados diários (dashboard_daily_rollups)
+Cada consulta lê no máximo algumas linhas por dia do período, independente do
+tamanho do histórico, e o resultado fica em cache em memória por alguns segundos
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+
+CACHE_TTL_SECONDS = 30
+MAX_CACHED_KEYS = 64
+UPCOMING_LIMIT = 5
+
+class DashboardStats:
+
+    def __init__(self):
+        self._cache: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._locks: Dict[Any, asyncio.Lock] = {}
+
+    async def cached(self, key: Any, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Valor em cache por CACHE_TTL_SECONDS; um único carregamento por chave
+        mesmo com várias requisições simultâneas
+        """
+        entry = self._cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            return entry[1]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+
+            value = await loader()
+            self._cache[key] = (time.monotonic() + CACHE_TTL_SECONDS, value)
+            self._cache.move_to_end(key)
+            self._evict()
+            return value
+
+    def _evict(self):
+        """
+        LRU: mantém no máximo MAX_CACHED_KEYS chaves (e os locks delas)
+        """
+        while len(self._cache) > MAX_CACHED_KEYS:
+            key, _ = self._cache.popitem(last=False)
+            lock = self._locks.get(key)
+            if lock and not lock.locked():
+                del self._locks[key]
+
+    async def _load_stats(self) -> dict:
+        now = datetime.now(ZoneInfo(settings.CLINIC_TIMEZONE))
+        today = now.date()
+        month_start = today.replace(day=1)
+
+        rollups, upcoming = await asyncio.gather(
+            db.table("dashboard_daily_rollups")
+                .select("day, metric, dimension, value")
+                .gte("day", str(month_start))
+                .lte("day", str(today))
+                .execute(),
+            db.table("agendamentos")
+                .select("id, start_time, end_time, status, pacientes(id, full_name, whatsapp_number), procedimentos(id, name, duration)")
+                .gte("start_time", now.isoformat())
+                .order("start_time")
+                .limit(UPCOMING_LIMIT)
+                .execute()
+        )
+
+        appointments_today = 0
+        revenue_month = 0.0
+        new_patients_month = 0
+        for row in rollups.data:
+            value = float(row["value"])
+            if row["metric"] == "appointments":
+                if row["day"] == str(today) and row["dimension"] != "cancelled":
+                    appointments_today += int(value)
+            elif row["metric"] == "revenue":
+                revenue_month += value
+            elif row["metric"] == "new_patients":
+                new_patients_month += int(value)
+
+        return {
+            "appointments_today": appointments_today,
+            "revenue_month": revenue_month,
+            "new_patients_month": new_patients_month,
+            "upcoming_appointments": upcoming.data
+        }
+
+    async def get_stats(self) -> dict:
+        return await self.cached("stats", self._load_stats)
+
+dashboard_stats = DashboardStats()
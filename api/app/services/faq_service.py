@@ -0,0 +1,232 @@
+"""
+Respostas rápidas para perguntas frequentes no WhatsApp
+Classifica a intenção por palavras-chave contra um índice local montado a
+partir de procedimentos, agenda e dados da clínica; responde por template
+quando a intenção é clara e devolve None para a mensagem seguir para a IA.
+As respostas ficam em cache por pergunta normalizada.
+"""
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+from app.core.config import settings
+from app.core.database import db
+
+INDEX_TTL_SECONDS = 600
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_TTL_SECONDS = 600
+MAX_QUESTION_WORDS = 20        # Mensagens longas costumam pedir mais que um FAQ
+MIN_PROCEDURE_MATCH = 0.5      # Fração das palavras do nome do procedimento
+MAX_PRICE_LINES = 10
+
+WEEKDAY_NAMES = ["Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo"]
+
+STOPWORDS = {"a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "com", "para", "por", "um", "uma"}
+
+INTENT_KEYWORDS: Dict[str, Set[str]] = {
+    "hours": {"horario", "horas", "funcionamento", "abre", "abrem", "fecha", "fecham", "aberto", "aberta", "expediente", "sabado", "domingo", "feriado"},
+    "address": {"endereco", "onde", "localizacao", "local", "fica", "ficam", "chegar", "rua", "estacionamento"},
+    "price": {"preco", "precos", "valor", "valores", "custa", "custam", "quanto", "custo", "tabela"},
+    "procedure_info": {"funciona", "dura", "duracao", "tempo", "sessao", "sessoes", "indicado", "indicacao"},
+    "contact": {"telefone", "contato", "ligar", "email", "fone"},
+    "payment": {"pagamento", "pagar", "cartao", "pix", "parcela", "parcelar", "parcelado", "dinheiro", "boleto"}
+}
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+def format_price(value) -> str:
+    return f"R$ {float(value):.2f}".replace(".", ",")
+
+class FAQService:
+
+    def __init__(self):
+        self._procedures: List[dict] = []
+        self._hours: str = ""
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._answers: "OrderedDict[str, tuple]" = OrderedDict()
+
+    # Índice
+
+    async def _ensure_index(self):
+        if time.monotonic() - self._loaded_at < INDEX_TTL_SECONDS:
+            return
+
+        async with self._lock:
+            if time.monotonic() - self._loaded_at < INDEX_TTL_SECONDS:
+                return
+
+            procedures, availability = await asyncio.gather(
+                db.table("procedimentos")
+                    .select("name, description, duration, price")
+                    .eq("active", True)
+                    .order("name")
+                    .execute(),
+                db.table("availability_settings")
+                    .select("day_of_week, start_time, end_time")
+                    .eq("is_available", True)
+                    .execute()
+            )
+
+            self._procedures = [
+                {**proc, "tokens": set(normalize_text(proc["name"]).split()) - STOPWORDS}
+                for proc in procedures.data
+            ]
+            self._hours = self._opening_hours(availability.data) or settings.CLINIC_OPENING_HOURS
+            self._loaded_at = time.monotonic()
+            self._answers.clear()
+
+    @staticmethod
+    def _opening_hours(availability: List[dict]) -> str:
+        """
+        Horário da clínica por dia: do primeiro início ao último fim entre os profissionais
+        """
+        days: Dict[int, list] = {}
+        for av in availability:
+            start, end = av["start_time"][:5], av["end_time"][:5]
+            current = days.setdefault(av["day_of_week"], [start, end])
+            current[0], current[1] = min(current[0], start), max(current[1], end)
+
+        return "\n".join(
+            f"{WEEKDAY_NAMES[day]}: {days[day][0]} às {days[day][1]}"
+            for day in sorted(days)
+        )
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    # Cache de respostas
+
+    def cached(self, text: str) -> Optional[str]:
+        key = normalize_text(text)
+        entry = self._answers.get(key)
+        if not entry:
+            return None
+
+        expires_at, answer = entry
+        if expires_at < time.monotonic():
+            del self._answers[key]
+            return None
+
+        self._answers.move_to_end(key)
+        return answer
+
+    def remember(self, text: str, answer: str):
+        key = normalize_text(text)
+        self._answers[key] = (time.monotonic() + ANSWER_CACHE_TTL_SECONDS, answer)
+        self._answers.move_to_end(key)
+        while len(self._answers) > ANSWER_CACHE_MAX_ENTRIES:
+            self._answers.popitem(last=False)
+
+    # Classificação
+
+    def _match_procedures(self, words: Set[str]) -> List[dict]:
+        best, matches = 0.0, []
+        for proc in self._procedures:
+            if not proc["tokens"]:
+                continue
+            score = len(proc["tokens"] & words) / len(proc["tokens"])
+            if score < MIN_PROCEDURE_MATCH or score < best:
+                continue
+            if score > best:
+                best, matches = score, []
+            matches.append(proc)
+        return matches
+
+    def classify(self, text: str) -> Optional[dict]:
+        """
+        Retorna {"intent", "procedures"} quando há uma intenção dominante, senão None
+        """
+        words = normalize_text(text).split()
+        if not words or len(words) > MAX_QUESTION_WORDS:
+            return None
+
+        word_set = set(words)
+        procedures = self._match_procedures(word_set)
+        scores = {
+            intent: len(keywords & word_set)
+            for intent, keywords in INTENT_KEYWORDS.items()
+        }
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (intent, score), (_, runner_up) = ranked[0], ranked[1]
+
+        if score == 0:
+            # Só o nome de um procedimento ("botox?"): informações dele
+            if len(procedures) == 1 and len(words) <= 5:
+                return {"intent": "procedure_info", "procedures": procedures}
+            return None
+
+        if score == runner_up:
+            return None
+
+        if intent == "procedure_info" and not procedures:
+            return None
+
+        return {"intent": intent, "procedures": procedures}
+
+    # Templates
+
+    def _render(self, intent: str, procedures: List[dict]) -> Optional[str]:
+        if intent == "hours":
+            return f"🕘 *Horário de atendimento*\n\n{self._hours}" if self._hours else None
+
+        if intent == "address":
+            if not settings.CLINIC_ADDRESS:
+                return None
+            return f"📍 *{settings.CLINIC_NAME}*\n{settings.CLINIC_ADDRESS}"
+
+        if intent == "contact":
+            if not settings.CLINIC_PHONE:
+                return None
+            return f"📞 Fale com a gente pelo {settings.CLINIC_PHONE} ou por aqui mesmo."
+
+        if intent == "payment":
+            if not settings.CLINIC_PAYMENT_METHODS:
+                return None
+            return f"💳 Formas de pagamento: {settings.CLINIC_PAYMENT_METHODS}."
+
+        if intent == "price":
+            priced = [proc for proc in (procedures or self._procedures) if proc.get("price") is not None]
+            if not priced:
+                return None
+            lines = [f"• {proc['name']}: {format_price(proc['price'])}" for proc in priced[:MAX_PRICE_LINES]]
+            return "💰 *Valores*\n\n" + "\n".join(lines) + "\n\nPara agendar, responda *agendar*."
+
+        if intent == "procedure_info":
+            proc = procedures[0]
+            msg = f"✨ *{proc['name']}*\n"
+            if proc.get("description"):
+                msg += f"\n{proc['description']}\n"
+            if proc.get("duration"):
+                msg += f"\n⏱️ Duração: {proc['duration']} min"
+            if proc.get("price") is not None:
+                msg += f"\n💰 Valor: {format_price(proc['price'])}"
+            return msg + "\n\nPara agendar, responda *agendar*."
+
+        return None
+
+    async def answer(self, text: str) -> Optional[str]:
+        """
+        Resposta do cache ou do template; None quando a pergunta deve ir para a IA
+        """
+        cached = self.cached(text)
+        if cached:
+            return cached
+
+        await self._ensure_index()
+
+        match = self.classify(text)
+        if not match:
+            return None
+
+        answer = self._render(match["intent"], match["procedures"])
+        if answer:
+            self.remember(text, answer)
+        return answer
+
+faq_service = FAQService()
@@ -0,0 +1,100 @@
+"""
+Resolução de identidade por número de WhatsApp (paciente, profissional ou desconhecido)
+Cache LRU com TTL por número normalizado, incluindo cache negativo para
+números desconhecidos
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from app.core.database import db
+
+CACHE_MAX_ENTRIES = 10000
+CACHE_TTL_SECONDS = 600
+NEGATIVE_TTL_SECONDS = 60
+
+def normalize_phone(raw: str) -> str:
+    """
+    "5511999998888@s.whatsapp.net", "(11) 99999-8888" -> "+5511999998888"
+    Números sem DDI são tratados como brasileiros
+    """
+    digits = re.sub(r"\D", "", (raw or "").split("@")[0])
+    if len(digits) in (10, 11):
+        digits = "55" + digits
+    return f"+{digits}" if digits else ""
+
+def phone_variants(phone: str) -> List[str]:
+    """
+    Formatos possíveis do mesmo número gravados em whatsapp_number
+    """
+    digits = phone.lstrip("+")
+    variants = [phone, digits]
+    if digits.startswith("55"):
+        variants.append(digits[2:])
+    return variants
+
+class IdentityResolver:
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _get(self, phone: str) -> Optional[dict]:
+        entry = self._cache.get(phone)
+        if not entry:
+            return None
+
+        expires_at, identity = entry
+        if expires_at < time.monotonic():
+            del self._cache[phone]
+            return None
+
+        self._cache.move_to_end(phone)
+        return identity
+
+    def remember(self, raw_phone: str, kind: str, record: Optional[dict]) -> dict:
+        phone = normalize_phone(raw_phone)
+        identity = {"phone": phone, "kind": kind, "record": record}
+        ttl = NEGATIVE_TTL_SECONDS if kind == "unknown" else CACHE_TTL_SECONDS
+
+        self._cache[phone] = (time.monotonic() + ttl, identity)
+        self._cache.move_to_end(phone)
+        while len(self._cache) > CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+
+        return identity
+
+    async def resolve(self, raw_phone: str) -> dict:
+        """
+        Retorna {"phone", "kind": "patient" | "professional" | "unknown", "record"}
+        """
+        phone = normalize_phone(raw_phone)
+        cached = self._get(phone)
+        if cached:
+            return cached
+
+        variants = phone_variants(phone)
+        paciente, professional = await asyncio.gather(
+            db.table("pacientes").select("*").in_("whatsapp_number", variants).limit(1).execute(),
+            db.table("profiles").select("*").in_("whatsapp_number", variants).limit(1).execute()
+        )
+
+        if paciente.data:
+            return self.remember(phone, "patient", paciente.data[0])
+        if professional.data:
+            return self.remember(phone, "professional", professional.data[0])
+        return self.remember(phone, "unknown", None)
+
+    def invalidate(self, raw_phone: Optional[str]):
+        if raw_phone:
+            self._cache.pop(normalize_phone(raw_phone), None)
+
+    def invalidate_record(self, record_id: str):
+        """
+        Remove as entradas de um paciente/profissional (o número pode ter mudado)
+        """
+        for phone, (_, identity) in list(self._cache.items()):
+            if identity["record"] and identity["record"].get("id") == record_id:
+                del self._cache[phone]
+
+identity_resolver = IdentityResolver()
@@ -0,0 +1,102 @@
+"""
+Gravação em lote do histórico de mensagens (whatsapp_messages)
+Os registros ficam em memória e são inseridos em um único INSERT
+quando o lote enche, a cada poucos segundos e no shutdown
+"""
+import asyncio
+from collections import deque
+from typing import List, Optional
+import httpx
+from app.core.database import db, APIError
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL_SECONDS = 2
+MAX_BUFFERED = 5000  # Com o banco fora do ar, descarta os registros mais antigos
+
+# Todos os registros do lote com as mesmas chaves (o PostgREST rejeita
+# um array com objetos de chaves diferentes)
+COLUMNS = (
+    "message_id", "chat_id", "from_number", "to_number", "content", "message_type",
+    "status", "direction", "paciente_id", "professional_id", "metadata"
+)
+
+class MessageLogWriter:
+
+    def __init__(self):
+        self._buffer: deque = deque(maxlen=MAX_BUFFERED)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self.dropped = 0
+
+    def log(self, record: dict):
+        """
+        Enfileira um registro sem tocar no banco
+        """
+        if len(self._buffer) == MAX_BUFFERED:
+            self.dropped += 1
+        self._buffer.append({column: record.get(column) for column in COLUMNS})
+
+        self.start()
+        if len(self._buffer) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._buffer:
+            batch: List[dict] = [self._buffer.popleft() for _ in range(min(BATCH_SIZE, len(self._buffer)))]
+            try:
+                await self._insert(batch)
+            except (httpx.HTTPError, APIError) as e:
+                print(f"Error logging messages: {e}")
+                # Banco indisponível: devolve o lote; o deque limitado descarta os mais antigos
+                overflow = len(batch) + len(self._buffer) - MAX_BUFFERED
+                if overflow > 0:
+                    self.dropped += overflow
+                self._buffer = deque(batch + list(self._buffer), maxlen=MAX_BUFFERED)
+                return
+
+    async def _insert(self, batch: List[dict]):
+        """
+        Insere o lote ignorando message_id repetido (reentrega do webhook).
+        Um 4xx não se resolve com nova tentativa: o lote é dividido até
+        isolar e descartar o registro inválido; só 5xx e erros de rede sobem
+        """
+        try:
+            await db.table("whatsapp_messages")\
+                .upsert(batch, on_conflict="message_id", returning="minimal", ignore_duplicates=True)\
+                .execute()
+        except APIError as e:
+            if e.status_code >= 500:
+                raise
+            if len(batch) == 1:
+                print(f"Discarding invalid message log record: {e}")
+                self.dropped += 1
+                return
+            middle = len(batch) // 2
+            await self._insert(batch[:middle])
+            await self._insert(batch[middle:])
+
+message_log = MessageLogWriter()
@@ -0,0 +1,114 @@
+"""
+Outbox de notificações de agendamento
+Os triggers do banco enfileiram um registro em notification_outbox na mesma
+transação do agendamento; este worker entrega as mensagens via WhatsApp
+fora do caminho da requisição
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from app.core.config import settings
+from app.core.database import db
+from app.services.availability_service import parse_timestamp
+from app.services.whatsapp_service import whatsapp_service
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+POLL_INTERVAL_SECONDS = 15
+
+class NotificationOutbox:
+
+    def __init__(self):
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.process_pending()
+            except Exception as e:
+                print(f"Error processing notification outbox: {e}")
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    async def process_pending(self):
+        """
+        Reserva um lote (FOR UPDATE SKIP LOCKED) e entrega as notificações.
+        Pode rodar em vários workers sem enviar a mesma mensagem duas vezes.
+        """
+        async with self._lock:
+            while True:
+                claimed = await db.rpc("claim_notifications", {"batch_size": BATCH_SIZE}).execute()
+                if not claimed.data:
+                    return
+
+                await asyncio.gather(*[self._deliver(n) for n in claimed.data])
+
+                if len(claimed.data) < BATCH_SIZE:
+                    return
+
+    async def _deliver(self, notification: dict):
+        try:
+            result = await self._send(notification)
+            error = None if result.get("success") else str(result.get("error") or result.get("data"))
+        except Exception as e:
+            error = str(e)
+
+        if error is None:
+            update = {"status": "sent", "last_error": None}
+        elif notification["attempts"] >= MAX_ATTEMPTS:
+            update = {"status": "failed", "last_error": error}
+        else:
+            # Backoff exponencial: 1, 2, 4, 8 minutos
+            retry_at = datetime.now(timezone.utc) + timedelta(minutes=2 ** (notification["attempts"] - 1))
+            update = {"status": "pending", "last_error": error, "available_at": retry_at.isoformat()}
+
+        await db.table("notification_outbox").update(update).eq("id", notification["id"]).execute()
+
+    async def _send(self, notification: dict) -> dict:
+        # Uma única consulta com os joins necessários para a mensagem
+        appointment = await db.table("agendamentos")\
+            .select("start_time, pacientes(full_name, whatsapp_number), procedimentos(name), profiles(full_name)")\
+            .eq("id", notification["agendamento_id"])\
+            .maybe_single()\
+            .execute()
+
+        if not appointment.data:
+            return {"success": True, "data": "appointment not found"}
+
+        paciente = appointment.data.get("pacientes") or {}
+        if not paciente.get("whatsapp_number"):
+            return {"success": True, "data": "patient without whatsapp"}
+
+        if notification["event_type"] == "appointment_cancelled":
+            return await whatsapp_service.send_appointment_cancellation(
+                paciente["whatsapp_number"],
+                paciente["full_name"]
+            )
+
+        start_dt = parse_timestamp(appointment.data["start_time"]).astimezone(ZoneInfo(settings.CLINIC_TIMEZONE))
+
+        return await whatsapp_service.send_appointment_confirmation(
+            paciente["whatsapp_number"],
+            {
+                "patient_name": paciente["full_name"],
+                "procedure": (appointment.data.get("procedimentos") or {}).get("name"),
+                "date": start_dt.strftime("%d/%m/%Y"),
+                "time": start_dt.strftime("%H:%M"),
+                "professional": (appointment.data.get("profiles") or {}).get("full_name")
+            }
+        )
+
+notification_outbox = NotificationOutbox()
@@ -0,0 +1,48 @@
+"""
+Previsão de reposição do estoque
+Recalcula periodicamente stock_forecasts (refresh_stock_forecasts): taxa de
+consumo por produto a partir das saídas e dos pedidos e data projetada de
+ruptura. As telas de estoque leem a tabela já calculada.
+"""
+import asyncio
+from app.core.database import db
+
+REFRESH_INTERVAL_SECONDS = 3600
+
+class StockForecaster:
+
+    def __init__(self):
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing stock forecasts: {e}")
+            await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+
+    async def refresh(self) -> int:
+        """
+        Número de produtos recalculados; entre processos, a função no banco
+        garante uma execução por vez (advisory lock)
+        """
+        async with self._lock:
+            result = await db.rpc("refresh_stock_forecasts").execute()
+            return result.data or 0
+
+stock_forecaster = StockForecaster()
@@ -0,0 +1,58 @@
+"""
+Armazenamento de arquivos de áudio em disco, em streaming
+Grava em blocos com I/O assíncrono e calcula tamanho e SHA-256 durante a escrita,
+então o uso de memória não depende da duração da gravação
+"""
+import hashlib
+import aiofiles
+import httpx
+from fastapi import UploadFile
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+class StorageService:
+
+    @staticmethod
+    async def save_upload(upload: UploadFile, path: str) -> dict:
+        """
+        Copia o upload para `path` bloco a bloco
+        """
+        checksum = hashlib.sha256()
+        size = 0
+
+        async with aiofiles.open(path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                checksum.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+
+        return {"path": path, "size": size, "sha256": checksum.hexdigest()}
+
+    @staticmethod
+    async def download(client: httpx.AsyncClient, url: str, path: str) -> dict:
+        """
+        Baixa `url` direto para `path` sem carregar o corpo inteiro em memória
+        """
+        checksum = hashlib.sha256()
+        size = 0
+
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async with aiofiles.open(path, "wb") as f:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    checksum.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+
+        return {"path": path, "size": size, "sha256": checksum.hexdigest()}
+
+    @staticmethod
+    async def checksum(path: str) -> str:
+        """
+        SHA-256 de um arquivo já gravado, lido em blocos
+        """
+        checksum = hashlib.sha256()
+        async with aiofiles.open(path, "rb") as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                checksum.update(chunk)
+        return checksum.hexdigest()
@@ -0,0 +1,80 @@
+"""
+Fila de transcrição de áudios de prontuário
+O upload só grava o arquivo e o registro com transcription_status='pending';
+workers reservam os registros no banco (FOR UPDATE SKIP LOCKED) e transcrevem
+"""
+import asyncio
+from typing import List, Optional
+from app.core.database import db
+from app.services.ai_service import AIService
+
+POLL_INTERVAL_SECONDS = 10
+
+class TranscriptionQueue:
+
+    def __init__(self):
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, workers: int):
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def notify(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def _worker(self):
+        while True:
+            try:
+                await self.process_pending()
+            except Exception as e:
+                print(f"Transcription worker error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_pending(self):
+        """
+        Transcreve registros pendentes, um por vez, até a fila esvaziar
+        """
+        while True:
+            claimed = await db.rpc("claim_transcription_jobs", {"batch_size": 1}).execute()
+            if not claimed.data:
+                return
+
+            await self._transcribe(claimed.data[0])
+
+    async def _transcribe(self, record: dict):
+        result = await AIService.transcribe_audio(
+            record["audio_url"],
+            (record.get("metadata") or {}).get("sha256")
+        )
+
+        if result["success"]:
+            update = {
+                "transcription": result["transcription"],
+                "transcription_status": "completed"
+            }
+        else:
+            update = {
+                "transcription_status": "failed",
+                "metadata": {**(record.get("metadata") or {}), "error": result["error"]}
+            }
+
+        await db.table("medical_audio_records").update(update).eq("id", record["id"]).execute()
+
+transcription_queue = TranscriptionQueue()
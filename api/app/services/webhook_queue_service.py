@@ -0,0 +1,200 @@
+"""
+Fila local e durável para os webhooks do WhatsApp (SQLite)
+O endpoint apenas grava o evento e responde; um pool de workers
+classifica e processa as mensagens. O message_id é a chave primária,
+então reenvios da Evolution API não são processados duas vezes.
+Mensagens do mesmo chat são processadas uma por vez, em ordem de chegada
+(o estado da conversa não é disputado por dois workers).
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+from app.core.config import settings
+
+MAX_ATTEMPTS = 3
+POLL_INTERVAL_SECONDS = 1
+STALE_PROCESSING_SECONDS = 300
+RETRY_BASE_SECONDS = 5           # Backoff: 5s, 10s, ...
+PROCESSED_RETENTION_SECONDS = 7 * 24 * 3600
+
+class WebhookQueue:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._handler: Optional[Callable[[dict], Awaitable[None]]] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_events (
+                    message_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    chat_id TEXT,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+            # Filas criadas antes de chat_id/next_attempt_at
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(webhook_events)")}
+            if "chat_id" not in columns:
+                self._conn.execute("ALTER TABLE webhook_events ADD COLUMN chat_id TEXT")
+            if "next_attempt_at" not in columns:
+                self._conn.execute("ALTER TABLE webhook_events ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON webhook_events(status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_chat ON webhook_events(chat_id, status, created_at)")
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._conn_lock:
+            return self.conn.execute(sql, params)
+
+    # Produtor
+
+    def _enqueue(self, message_id: str, payload: dict, chat_id: Optional[str]) -> bool:
+        now = time.time()
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO webhook_events (message_id, payload, chat_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (message_id, json.dumps(payload), chat_id, now, now)
+        )
+        return cursor.rowcount == 1
+
+    async def enqueue(self, message_id: str, payload: dict, chat_id: Optional[str] = None) -> bool:
+        """
+        Grava o evento; retorna False se o message_id já foi recebido.
+        Eventos com o mesmo chat_id são processados em série
+        """
+        created = await asyncio.to_thread(self._enqueue, message_id, payload, chat_id)
+        if created and self._wakeup:
+            self._wakeup.set()
+        return created
+
+    # Consumidores
+
+    def _claim(self) -> Optional[Tuple[str, dict, int]]:
+        with self._conn_lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # O evento mais antigo pronto para tentar, desde que o chat não
+                # tenha outro em processamento nem um anterior ainda pendente
+                row = conn.execute("""
+                    SELECT e.message_id, e.payload, e.attempts
+                    FROM webhook_events e
+                    WHERE e.status = 'pending'
+                      AND e.next_attempt_at <= ?
+                      AND (e.chat_id IS NULL OR NOT EXISTS (
+                          SELECT 1 FROM webhook_events o
+                          WHERE o.chat_id = e.chat_id
+                            AND o.message_id <> e.message_id
+                            AND (o.status = 'processing' OR (o.status = 'pending' AND o.created_at < e.created_at))
+                      ))
+                    ORDER BY e.created_at
+                    LIMIT 1
+                """, (time.time(),)).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE webhook_events SET status = 'processing', attempts = attempts + 1, updated_at = ? WHERE message_id = ?",
+                        (time.time(), row[0])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def _finish(self, message_id: str, error: Optional[str], attempts: int):
+        now = time.time()
+        next_attempt_at = 0.0
+        if error is None:
+            status = "done"
+        elif attempts >= MAX_ATTEMPTS:
+            status = "failed"
+        else:
+            status = "pending"
+            next_attempt_at = now + RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+        self._execute(
+            "UPDATE webhook_events SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE message_id = ?",
+            (status, error, next_attempt_at, now, message_id)
+        )
+
+    def _recover(self):
+        # Eventos que estavam em processamento quando um processo caiu
+        self._execute(
+            "UPDATE webhook_events SET status = 'pending' WHERE status = 'processing' AND updated_at < ?",
+            (time.time() - STALE_PROCESSING_SECONDS,)
+        )
+        self._execute(
+            "DELETE FROM webhook_events WHERE status = 'done' AND updated_at < ?",
+            (time.time() - PROCESSED_RETENTION_SECONDS,)
+        )
+
+    async def process_pending(self, handler: Optional[Callable[[dict], Awaitable[None]]] = None):
+        """
+        Processa eventos até a fila esvaziar
+        """
+        handler = handler or self._handler
+        while True:
+            claimed = await asyncio.to_thread(self._claim)
+            if not claimed:
+                return
+
+            message_id, payload, attempts = claimed
+            try:
+                await handler(payload)
+                error = None
+            except Exception as e:
+                print(f"Error processing webhook {message_id}: {e}")
+                error = str(e)
+
+            await asyncio.to_thread(self._finish, message_id, error, attempts)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def _worker(self):
+        while True:
+            try:
+                await self.process_pending()
+            except Exception as e:
+                print(f"Webhook worker error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self, handler: Callable[[dict], Awaitable[None]], workers: int):
+        self._handler = handler
+        await asyncio.to_thread(self._recover)
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+webhook_queue = WebhookQueue(settings.WEBHOOK_QUEUE_PATH)
@@ -2,11 +2,17 @@
 Serviço de integração com WhatsApp via Evolution API
 Gerencia envio de mensagens, webhooks e automações
 """
+import asyncio
 import httpx
 import json
 from typing import Optional, Dict, List
 from app.core.config import settings
-from app.core.supabase import supabase_admin
+from app.core.database import db
+from app.services.message_log_service import message_log
+from app.services.chat_context_service import chat_context
+
+MAX_RETRIES = 3
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 class WhatsAppService:
 
@@ -18,6 +24,75 @@ class WhatsAppService:
             "apikey": self.api_key,
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._media_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Cliente HTTP compartilhado (pool de conexões com keep-alive).
+        Criado no startup da aplicação ou sob demanda na Vercel.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=50,
+                    max_keepalive_connections=20,
+                    keepalive_expiry=60
+                ),
+                timeout=httpx.Timeout(15.0, connect=5.0)
+            )
+        return self._client
+
+    @property
+    def media_client(self) -> httpx.AsyncClient:
+        """
+        Cliente para baixar mídias (CDN do WhatsApp): sem os headers da
+        Evolution API, para a apikey não ser enviada a outros hosts
+        """
+        if self._media_client is None or self._media_client.is_closed:
+            self._media_client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+                timeout=httpx.Timeout(60.0, connect=5.0)
+            )
+        return self._media_client
+
+    def start(self) -> httpx.AsyncClient:
+        return self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._media_client is not None:
+            await self._media_client.aclose()
+            self._media_client = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Requisição à Evolution API com retry e backoff exponencial
+        para 429/5xx e falhas de conexão
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+
+            retry_after = response.headers.get("retry-after", "")
+            delay = float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt
+            await asyncio.sleep(delay)
+
+        return response
 
     async def send_text_message(self, to: str, message: str) -> dict:
         """
@@ -31,17 +106,18 @@ class WhatsAppService:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, headers=self.headers)
-                result = response.json()
+            response = await self._request("POST", url, json=payload)
+            result = response.json()
 
-                # Log no banco
-                await self._log_message(to, message, "text", "outbound", result)
+            # Log no banco
+            self._log_message(to, message, "text", "outbound", result, response.status_code == 200)
+            if response.status_code == 200:
+                chat_context.record(to, "assistant", message)
 
-                return {
-                    "success": response.status_code == 200,
-                    "data": result
-                }
+            return {
+                "success": response.status_code == 200,
+                "data": result
+            }
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -58,16 +134,15 @@ class WhatsAppService:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, headers=self.headers)
-                result = response.json()
+            response = await self._request("POST", url, json=payload)
+            result = response.json()
 
-                await self._log_message(to, audio_url, "audio", "outbound", result)
+            self._log_message(to, audio_url, "audio", "outbound", result, response.status_code == 200)
 
-                return {
-                    "success": response.status_code == 200,
-                    "data": result
-                }
+            return {
+                "success": response.status_code == 200,
+                "data": result
+            }
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -84,12 +159,11 @@ class WhatsAppService:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, headers=self.headers)
-                return {
-                    "success": response.status_code == 200,
-                    "data": response.json()
-                }
+            response = await self._request("POST", url, json=payload)
+            return {
+                "success": response.status_code == 200,
+                "data": response.json()
+            }
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -123,6 +197,22 @@ Até breve! ✨
 
         return await self.send_text_message(to, message)
 
+    async def send_appointment_cancellation(self, to: str, patient_name: str) -> dict:
+        """
+        Avisa o paciente sobre o cancelamento do agendamento
+        """
+        message = f"""
+❌ *Agendamento Cancelado*
+
+Olá {patient_name},
+
+Seu agendamento foi cancelado.
+
+Para reagendar, entre em contato conosco.
+        """
+
+        return await self.send_text_message(to, message)
+
     async def send_appointment_reminder(self, to: str, appointment_data: dict) -> dict:
         """
         Envia lembrete de consulta
@@ -181,26 +271,25 @@ Obrigada! 💙
         Processa áudio recebido via WhatsApp (prontuário da profissional)
         """
         from app.services.ai_service import AIService
+        from app.services.storage_service import StorageService
 
-        # Baixar áudio
-        async with httpx.AsyncClient() as client:
-            audio_response = await client.get(audio_url)
-            audio_path = f"uploads/audio_{paciente_id}_{int(time.time())}.ogg"
-
-            with open(audio_path, "wb") as f:
-                f.write(audio_response.content)
+        # Baixar áudio (em streaming, direto para o disco)
+        audio_path = f"uploads/audio_{paciente_id}_{int(time.time())}.ogg"
+        stored = await StorageService.download(self.media_client, audio_url, audio_path)
 
         # Transcrever com Whisper
-        transcription_result = await AIService.transcribe_audio(audio_path)
+        transcription_result = await AIService.transcribe_audio(audio_path, stored["sha256"])
 
         if transcription_result["success"]:
             # Salvar no banco
-            result = supabase_admin.table("medical_audio_records").insert({
+            result = await db.table("medical_audio_records").insert({
                 "paciente_id": paciente_id,
                 "audio_url": audio_path,
+                "file_size_bytes": stored["size"],
                 "transcription": transcription_result["transcription"],
                 "transcription_status": "completed",
-                "source": "whatsapp"
+                "source": "whatsapp",
+                "metadata": {"sha256": stored["sha256"]}
             }).execute()
 
             return {
@@ -211,21 +300,19 @@ Obrigada! 💙
 
         return {"success": False, "error": "Transcription failed"}
 
-    async def _log_message(self, to: str, content: str, msg_type: str, direction: str, response: dict):
+    def _log_message(self, to: str, content: str, msg_type: str, direction: str, response: dict, success: bool):
         """
-        Registra mensagem no banco de dados
+        Registra mensagem no banco de dados (gravação em lote, fora do caminho do envio)
         """
-        try:
-            supabase_admin.table("whatsapp_messages").insert({
-                "to_number": to,
-                "content": content,
-                "message_type": msg_type,
-                "direction": direction,
-                "status": "sent" if response.get("success") else "failed",
-                "metadata": response
-            }).execute()
-        except Exception as e:
-            print(f"Error logging message: {e}")
+        message_log.log({
+            "chat_id": to,
+            "to_number": to,
+            "content": content,
+            "message_type": msg_type,
+            "direction": direction,
+            "status": "sent" if success else "failed",
+            "metadata": response
+        })
 
     async def setup_webhook(self, webhook_url: str) -> dict:
         """
@@ -246,12 +333,11 @@ Obrigada! 💙
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, headers=self.headers)
-                return {
-                    "success": response.status_code == 200,
-                    "data": response.json()
-                }
+            response = await self._request("POST", url, json=payload)
+            return {
+                "success": response.status_code == 200,
+                "data": response.json()
+            }
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -0,0 +1,98 @@
+"""
+Benchmark do cálculo de horários livres: laço antigo (cada slot reprocessa
+todos os agendamentos do dia) x IntervalIndex + AvailabilityService.compute_slots
+
+Só CPU, sem banco: gera uma agenda sintética e compara os dois caminhos
+
+    python benchmarks/bench_availability.py --professionals 10 --days 180 --per-day 16
+"""
+import argparse
+import os
+import random
+import sys
+import time as clock
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.availability_service import AvailabilityService, IntervalIndex, parse_timestamp
+
+TZ = ZoneInfo("America/Sao_Paulo")
+DURATION = 60
+AVAILABILITY = [
+    {"day_of_week": weekday, "start_time": "08:00:00", "end_time": "12:00:00"} for weekday in range(6)
+] + [
+    {"day_of_week": weekday, "start_time": "13:00:00", "end_time": "19:00:00"} for weekday in range(6)
+]
+
+def synthetic_appointments(start: date, days: int, per_day: int) -> list:
+    rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        for _ in range(per_day):
+            begin = datetime.combine(day, time(8), tzinfo=TZ) + timedelta(minutes=15 * random.randint(0, 40))
+            rows.append({
+                "start_time": begin.isoformat(),
+                "end_time": (begin + timedelta(minutes=random.choice([30, 45, 60, 90]))).isoformat()
+            })
+    return rows
+
+def old_slots(availability: list, appointments: list, start: date, days: int) -> int:
+    """
+    Mesmo algoritmo do endpoint antigo, chamado uma vez por dia
+    """
+    total = 0
+    for offset in range(days):
+        target = start + timedelta(days=offset)
+        day_rows = [a for a in appointments if a["start_time"][:10] == target.isoformat()]
+
+        for av in (a for a in availability if a["day_of_week"] == target.weekday()):
+            current = datetime.combine(target, time.fromisoformat(av["start_time"]), tzinfo=TZ)
+            end = datetime.combine(target, time.fromisoformat(av["end_time"]), tzinfo=TZ)
+
+            while current + timedelta(minutes=DURATION) <= end:
+                is_free = True
+                for appt in day_rows:
+                    appt_start = parse_timestamp(appt["start_time"])
+                    appt_end = parse_timestamp(appt["end_time"])
+                    if not (current >= appt_end or current + timedelta(minutes=DURATION) <= appt_start):
+                        is_free = False
+                        break
+                if is_free:
+                    total += 1
+                current += timedelta(minutes=30)
+    return total
+
+def new_slots(availability: list, appointments: list, start: date, days: int) -> int:
+    index = IntervalIndex([(parse_timestamp(a["start_time"]), parse_timestamp(a["end_time"])) for a in appointments])
+    end = start + timedelta(days=days - 1)
+    return len(AvailabilityService.compute_slots(availability, index, start, end, DURATION, TZ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--professionals", type=int, default=10)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--per-day", type=int, default=16)
+    args = parser.parse_args()
+
+    random.seed(42)
+    start = date(2030, 1, 7)
+    agendas = [synthetic_appointments(start, args.days, args.per_day) for _ in range(args.professionals)]
+
+    started = clock.perf_counter()
+    old_total = sum(old_slots(AVAILABILITY, agenda, start, args.days) for agenda in agendas)
+    old_time = clock.perf_counter() - started
+
+    started = clock.perf_counter()
+    new_total = sum(new_slots(AVAILABILITY, agenda, start, args.days) for agenda in agendas)
+    new_time = clock.perf_counter() - started
+
+    print(f"{args.professionals} profissionais, {args.days} dias, {args.per_day} agendamentos/dia")
+    print(f"antigo {old_time * 1000:9.1f}ms  {old_total} slots")
+    print(f"novo   {new_time * 1000:9.1f}ms  {new_total} slots  ({old_time / new_time:.1f}x)")
+    if old_total != new_total:
+        print("AVISO: contagens diferentes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark dos agregados do dashboard/financeiro: caminho antigo (traz as
+linhas e soma em Python) x funções SQL (revenue_by_month, top_procedures,
+financial_summary)
+
+O caminho antigo lê todas as linhas em páginas (uma única consulta seria
+cortada pelo max-rows do PostgREST e daria totais errados). Use um banco de
+teste com volume; por exemplo, 500 mil lançamentos no SQL Editor:
+
+    INSERT INTO public.financeiro (type, category, amount, date, status, description)
+    SELECT (ARRAY['income', 'expense'])[1 + (random() < 0.3)::int],
+           'bench', round((random() * 500)::numeric, 2),
+           CURRENT_DATE - (random() * 365)::int,
+           (ARRAY['paid', 'pending'])[1 + (random() < 0.2)::int],
+           'bench'
+    FROM generate_series(1, 500000);
+    SELECT refresh_dashboard_rollups();
+
+    SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=... python benchmarks/bench_dashboard_sql.py
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.database import db
+
+PAGE_SIZE = 1000
+MONTHS = 6
+
+async def fetch_all(make_query) -> list:
+    rows, offset = [], 0
+    while True:
+        page = await make_query().range(offset, offset + PAGE_SIZE - 1).execute()
+        rows.extend(page.data)
+        if len(page.data) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+async def old_revenue_chart(start_date: date):
+    rows = await fetch_all(lambda: db.table("financeiro")
+        .select("date, amount")
+        .eq("type", "income")
+        .eq("status", "paid")
+        .gte("date", str(start_date))
+        .order("date")
+        .order("id"))
+    monthly = {}
+    for r in rows:
+        monthly[r["date"][:7]] = monthly.get(r["date"][:7], 0) + float(r["amount"])
+    return monthly
+
+async def old_top_procedures():
+    rows = await fetch_all(lambda: db.table("agendamentos")
+        .select("procedimento_id, procedimentos(name)")
+        .neq("status", "cancelled")
+        .order("id"))
+    counts = {}
+    for r in rows:
+        name = (r.get("procedimentos") or {}).get("name")
+        counts[name] = counts.get(name, 0) + 1
+    return sorted(counts.items(), key=lambda x: x[1], reverse=True)[:5]
+
+async def old_financial_summary(month: str):
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1)
+    rows = await fetch_all(lambda: db.table("financeiro")
+        .select("type, amount, status")
+        .gte("date", str(start))
+        .lt("date", str(end))
+        .order("id"))
+    income = sum(float(r["amount"]) for r in rows if r["type"] == "income" and r["status"] == "paid")
+    expense = sum(float(r["amount"]) for r in rows if r["type"] == "expense" and r["status"] == "paid")
+    pending = sum(float(r["amount"]) for r in rows if r["status"] == "pending")
+    return income, expense, pending
+
+async def timed(name: str, coroutine):
+    started = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<8} {elapsed * 1000:10.1f}ms")
+    return elapsed
+
+async def main():
+    start_date = date.today() - timedelta(days=MONTHS * 30)
+    month = date.today().strftime("%Y-%m")
+
+    cases = [
+        ("revenue-chart", old_revenue_chart(start_date),
+         db.rpc("revenue_by_month", {"start_date": str(start_date)}).execute()),
+        ("top-procedures", old_top_procedures(),
+         db.rpc("top_procedures", {"max_results": 5}).execute()),
+        ("financial-summary", old_financial_summary(month),
+         db.rpc("financial_summary", {"month": month}).execute()),
+    ]
+
+    for name, old, new in cases:
+        print(name)
+        old_time = await timed("antigo", old)
+        new_time = await timed("SQL", new)
+        print(f"  {old_time / new_time:.1f}x")
+
+    await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
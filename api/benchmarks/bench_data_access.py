@@ -0,0 +1,73 @@
+"""
+Benchmark da camada de dados: cliente supabase-py síncrono (caminho antigo,
+bloqueia o event loop a cada consulta) x app.core.database (httpx assíncrono
+com pool HTTP/2 compartilhado)
+
+Simula N requisições simultâneas, cada uma fazendo a mesma consulta curta.
+Use um banco de teste:
+
+    SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=... python benchmarks/bench_data_access.py --requests 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from supabase import create_client
+from app.core.database import db, SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY
+
+TABLE = "pacientes"
+COLUMNS = "id, full_name"
+
+async def old_path(client, requests: int) -> list:
+    """
+    Como os routers faziam: chamada síncrona dentro do handler async
+    """
+    async def handler():
+        started = time.perf_counter()
+        client.table(TABLE).select(COLUMNS).limit(20).execute()
+        return time.perf_counter() - started
+
+    return await asyncio.gather(*[handler() for _ in range(requests)])
+
+async def new_path(requests: int) -> list:
+    async def handler():
+        started = time.perf_counter()
+        await db.table(TABLE).select(COLUMNS).limit(20).execute()
+        return time.perf_counter() - started
+
+    return await asyncio.gather(*[handler() for _ in range(requests)])
+
+def report(name: str, wall: float, latencies: list):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<8} total {wall:7.2f}s  {len(latencies) / wall:8.1f} req/s  "
+          f"mediana {statistics.median(latencies) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+    # Aquecimento (DNS, TLS, pool)
+    client.table(TABLE).select("id").limit(1).execute()
+    await db.table(TABLE).select("id").limit(1).execute()
+
+    started = time.perf_counter()
+    latencies = await old_path(client, args.requests)
+    report("antigo", time.perf_counter() - started, latencies)
+
+    started = time.perf_counter()
+    latencies = await new_path(args.requests)
+    report("novo", time.perf_counter() - started, latencies)
+
+    await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
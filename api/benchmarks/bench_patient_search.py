@@ -0,0 +1,82 @@
+"""
+Benchmark da busca de pacientes: filtro or=ilike do PostgREST (caminho da
+listagem, varre a tabela) x função search_patients (ramos com índice GIN
+de trigramas)
+
+Use um banco de teste com volume; por exemplo, 200 mil pacientes no SQL Editor:
+
+    INSERT INTO public.pacientes (full_name, cpf, phone, whatsapp_number, email)
+    SELECT (ARRAY['Maria', 'José', 'Ana', 'João', 'Fernanda', 'Luíza'])[1 + (random() * 5)::int]
+           || ' ' || md5(random()::text) || ' '
+           || (ARRAY['Silva', 'Souza', 'Conceição', 'Araújo', 'Pereira'])[1 + (random() * 4)::int],
+           lpad((random() * 99999999999)::bigint::text, 11, '0'),
+           '11' || lpad((random() * 999999999)::bigint::text, 9, '0'),
+           '5511' || lpad((random() * 999999999)::bigint::text, 9, '0'),
+           'bench' || i || '@example.com'
+    FROM generate_series(1, 200000) i;
+    ANALYZE public.pacientes;
+
+Para ver o plano de cada ramo (dentro da função o EXPLAIN não aparece),
+rode com valores literais, como no comentário de search_patients no schema,
+ou habilite auto_explain na sessão:
+
+    LOAD 'auto_explain';
+    SET auto_explain.log_min_duration = 0;
+    SET auto_explain.log_analyze = on;
+    SET auto_explain.log_nested_statements = on;
+    SELECT * FROM search_patients('conceicao');
+
+    SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=... python benchmarks/bench_patient_search.py --runs 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.database import db, escape_like, quote
+
+TERMS = ["conceição", "conceicao", "fernada souza", "12345", "11987", "bench1234@"]
+LIMIT = 20
+
+async def old_search(term: str):
+    pattern = quote(f"%{escape_like(term)}%")
+    return await db.table("pacientes")\
+        .select("id, full_name")\
+        .or_(f"full_name.ilike.{pattern},cpf.ilike.{pattern},phone.ilike.{pattern}")\
+        .order("full_name")\
+        .limit(LIMIT)\
+        .execute()
+
+async def new_search(term: str):
+    return await db.rpc("search_patients", {"q": term, "max_results": LIMIT}).execute()
+
+async def timed(search, term: str, runs: int) -> tuple:
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await search(term)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies), len(result.data)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    # Aquecimento (pool HTTP, cache de planos)
+    await new_search(TERMS[0])
+
+    for term in TERMS:
+        old_time, old_rows = await timed(old_search, term, args.runs)
+        new_time, new_rows = await timed(new_search, term, args.runs)
+        print(f"{term!r:<18} antigo {old_time * 1000:8.1f}ms ({old_rows:>2})  "
+              f"search_patients {new_time * 1000:8.1f}ms ({new_rows:>2})  {old_time / new_time:.1f}x")
+
+    await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Agendamentos simultâneos no mesmo horário: exatamente um é criado e os
+demais recebem 409 (agendamentos_no_overlap -> 23P01)
+
+Roda contra um banco de teste (Supabase com supabase_schema_complete.sql
+aplicado e ao menos um profile), nunca produção:
+
+    RUN_DB_TESTS=1 SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=... python -m pytest tests/test_appointment_concurrency.py
+    RUN_DB_TESTS=1 ... python tests/test_appointment_concurrency.py
+"""
+import asyncio
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from app.core.database import db
+from app.routers.appointments import AppointmentCreate, create_appointment
+
+PARALLEL_BOOKINGS = 20
+DURATION_MINUTES = 60
+
+pytestmark = pytest.mark.skipif(os.getenv("RUN_DB_TESTS") != "1", reason="RUN_DB_TESTS=1 para rodar contra o banco de teste")
+
+async def book(paciente_id: str, procedimento_id: str, professional_id: str, start: datetime):
+    appointment = AppointmentCreate(
+        paciente_id=paciente_id,
+        procedimento_id=procedimento_id,
+        professional_id=professional_id,
+        start_time=start.isoformat(),
+        end_time=(start + timedelta(minutes=DURATION_MINUTES)).isoformat()
+    )
+    try:
+        return await create_appointment(appointment, BackgroundTasks())
+    except HTTPException as e:
+        return e
+
+async def run_parallel_bookings():
+    profile = await db.table("profiles").select("id").limit(1).maybe_single().execute()
+    if not profile.data:
+        pytest.skip("O banco de teste precisa de ao menos um profile")
+
+    tag = uuid.uuid4().hex[:8]
+    paciente = await db.table("pacientes").insert({"full_name": f"Teste concorrência {tag}"}).execute()
+    procedimento = await db.table("procedimentos").insert({
+        "name": f"Procedimento concorrência {tag}",
+        "duration": DURATION_MINUTES,
+        "active": False
+    }).execute()
+    paciente_id, procedimento_id = paciente.data[0]["id"], procedimento.data[0]["id"]
+
+    # Horário distante (sem colidir com a agenda real); inícios deslocados em
+    # até 30 min para que todos os intervalos se sobreponham sem serem iguais
+    base = datetime(2099, 1, 1, 12, tzinfo=timezone.utc) + timedelta(days=random.randint(0, 3000))
+    starts = [base + timedelta(minutes=5 * (i % 7)) for i in range(PARALLEL_BOOKINGS)]
+
+    try:
+        results = await asyncio.gather(*[
+            book(paciente_id, procedimento_id, profile.data["id"], start) for start in starts
+        ])
+
+        created = [r for r in results if isinstance(r, dict) and r.get("success")]
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        assert len(created) == 1, results
+        assert len(rejected) == PARALLEL_BOOKINGS - 1, results
+        assert all(r.status_code == 409 for r in rejected), [r.detail for r in rejected]
+
+        rows = await db.table("agendamentos").select("id").eq("procedimento_id", procedimento_id).execute()
+        assert len(rows.data) == 1
+    finally:
+        await db.table("agendamentos").delete().eq("procedimento_id", procedimento_id).execute()
+        await db.table("procedimentos").delete().eq("id", procedimento_id).execute()
+        await db.table("pacientes").delete().eq("id", paciente_id).execute()
+        await db.close()
+
+def test_parallel_bookings_create_exactly_one():
+    asyncio.run(run_parallel_bookings())
+
+if __name__ == "__main__":
+    asyncio.run(run_parallel_bookings())
+    print(f"OK: {PARALLEL_BOOKINGS} agendamentos simultâneos, 1 criado, {PARALLEL_BOOKINGS - 1} recusados com 409")
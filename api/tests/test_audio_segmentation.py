@@ -0,0 +1,72 @@
+"""
+plan_cuts, plan_segments e stitch_transcripts (funções puras, sem ffmpeg)
+
+    python -m pytest tests/test_audio_segmentation.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.audio_segmentation_service import (
+    OVERLAP_SECONDS,
+    SEGMENT_SECONDS,
+    SILENCE_SEARCH_SECONDS,
+    plan_cuts,
+    plan_segments,
+    stitch_transcripts,
+)
+
+# plan_cuts / plan_segments
+
+def test_short_audio_is_a_single_segment():
+    assert plan_cuts(SEGMENT_SECONDS, []) == []
+    assert plan_segments(SEGMENT_SECONDS - 30, []) == [(0.0, SEGMENT_SECONDS - 30)]
+
+def test_no_silences_cuts_at_each_target():
+    duration = SEGMENT_SECONDS * 2.5
+    assert plan_cuts(duration, []) == [SEGMENT_SECONDS, SEGMENT_SECONDS * 2]
+
+def test_cut_prefers_last_silence_in_window():
+    early = SEGMENT_SECONDS - SILENCE_SEARCH_SECONDS + 5
+    late = SEGMENT_SECONDS - 10
+    assert plan_cuts(SEGMENT_SECONDS + 100, [early, late]) == [late]
+
+def test_silence_outside_window_is_ignored():
+    too_early = SEGMENT_SECONDS - SILENCE_SEARCH_SECONDS - 1
+    too_late = SEGMENT_SECONDS + 1
+    assert plan_cuts(SEGMENT_SECONDS + 100, [too_early, too_late]) == [SEGMENT_SECONDS]
+
+def test_no_segment_exceeds_limit_plus_overlap():
+    duration = SEGMENT_SECONDS * 3 + 17
+    segments = plan_segments(duration, [SEGMENT_SECONDS - 20, SEGMENT_SECONDS * 2 - 45])
+    assert all(length <= SEGMENT_SECONDS + 2 * OVERLAP_SECONDS for _, length in segments)
+
+def test_segments_overlap_and_cover_whole_audio():
+    duration = SEGMENT_SECONDS * 2 + 50
+    segments = plan_segments(duration, [])
+
+    assert segments[0][0] == 0.0
+    assert segments[-1][0] + segments[-1][1] == duration
+    for (start, length), (next_start, _) in zip(segments, segments[1:]):
+        assert start + length - next_start == 2 * OVERLAP_SECONDS
+
+# stitch_transcripts
+
+def test_stitch_removes_repeated_words_at_boundary():
+    texts = ["paciente relata dor de cabeça há três dias", "há três dias sem febre"]
+    assert stitch_transcripts(texts) == "paciente relata dor de cabeça há três dias sem febre"
+
+def test_stitch_ignores_case_accents_and_punctuation():
+    texts = ["Refere cefaleia intensa.", "cefaléia Intensa, sem náuseas"]
+    assert stitch_transcripts(texts) == "Refere cefaleia intensa. sem náuseas"
+
+def test_single_common_word_is_not_an_overlap():
+    # Uma palavra só ("de") coincide por acaso e é mantida
+    assert stitch_transcripts(["aplicação de", "de toxina"]) == "aplicação de de toxina"
+
+def test_stitch_without_overlap_concatenates():
+    assert stitch_transcripts(["primeira parte", "segunda parte"]) == "primeira parte segunda parte"
+
+def test_stitch_skips_empty_segments():
+    assert stitch_transcripts(["retorno em quinze", "", None, "em quinze dias"]) == "retorno em quinze dias"
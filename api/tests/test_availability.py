@@ -0,0 +1,88 @@
+"""
+IntervalIndex e AvailabilityService.compute_slots (funções puras, sem banco)
+
+    python -m pytest tests/test_availability.py
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.availability_service import AvailabilityService, IntervalIndex
+
+TZ = ZoneInfo("America/Sao_Paulo")
+MONDAY = date(2030, 1, 7)
+
+def at(hour: int, minute: int = 0, day: date = MONDAY) -> datetime:
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=TZ)
+
+def window(weekday: int, start: str, end: str) -> dict:
+    return {"day_of_week": weekday, "start_time": start, "end_time": end}
+
+def displays(slots: list) -> list:
+    return [s["display"] for s in slots]
+
+# IntervalIndex
+
+def test_merges_overlapping_and_touching_intervals():
+    index = IntervalIndex([(at(10), at(11)), (at(9), at(10)), (at(10, 30), at(12)), (at(14), at(15))])
+    assert index.starts == [at(9), at(14)]
+    assert index.ends == [at(12), at(15)]
+
+def test_overlaps_is_half_open():
+    index = IntervalIndex([(at(10), at(11))])
+    assert index.overlaps(at(10, 30), at(10, 45))
+    assert index.overlaps(at(9, 30), at(10, 30))
+    assert not index.overlaps(at(9), at(10))
+    assert not index.overlaps(at(11), at(12))
+
+def test_free_windows_without_busy_intervals():
+    assert list(IntervalIndex([]).free_windows(at(8), at(12))) == [(at(8), at(12))]
+
+def test_free_windows_around_busy_intervals():
+    index = IntervalIndex([(at(7), at(9)), (at(10), at(11)), (at(11, 30), at(13))])
+    assert list(index.free_windows(at(8), at(12))) == [(at(9), at(10)), (at(11), at(11, 30))]
+
+def test_free_windows_fully_busy():
+    index = IntervalIndex([(at(7), at(13))])
+    assert list(index.free_windows(at(8), at(12))) == []
+
+# compute_slots
+
+def test_slots_on_30_minute_grid_of_the_window():
+    slots = AvailabilityService.compute_slots(
+        [window(0, "08:00:00", "10:00:00")], IntervalIndex([]), MONDAY, MONDAY, 60, TZ
+    )
+    assert displays(slots) == ["08:00", "08:30", "09:00"]
+    assert slots[0]["end_time"] == at(9).isoformat()
+
+def test_slots_skip_booked_time_and_realign_after_it():
+    index = IntervalIndex([(at(9), at(9, 45))])
+    slots = AvailabilityService.compute_slots(
+        [window(0, "08:00:00", "12:00:00")], index, MONDAY, MONDAY, 60, TZ
+    )
+    # 08:00 termina às 09:00 (cabe); depois do agendamento, próxima marca da grade é 10:00
+    assert displays(slots) == ["08:00", "10:00", "10:30", "11:00"]
+
+def test_procedure_longer_than_free_gap_has_no_slot():
+    index = IntervalIndex([(at(8), at(9)), (at(10), at(12))])
+    slots = AvailabilityService.compute_slots(
+        [window(0, "08:00:00", "12:00:00")], index, MONDAY, MONDAY, 90, TZ
+    )
+    assert slots == []
+
+def test_only_matching_weekdays_across_range():
+    slots = AvailabilityService.compute_slots(
+        [window(0, "08:00:00", "09:00:00"), window(2, "08:00:00", "09:00:00")],
+        IntervalIndex([]), MONDAY, MONDAY + timedelta(days=6), 60, TZ
+    )
+    assert [s["date"] for s in slots] == [MONDAY.isoformat(), (MONDAY + timedelta(days=2)).isoformat()]
+
+def test_multiple_windows_same_day():
+    slots = AvailabilityService.compute_slots(
+        [window(0, "08:00:00", "09:00:00"), window(0, "13:00:00", "14:00:00")],
+        IntervalIndex([]), MONDAY, MONDAY, 60, TZ
+    )
+    assert displays(slots) == ["08:00", "13:00"]
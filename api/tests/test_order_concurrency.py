@@ -0,0 +1,79 @@
+"""
+Pedidos concorrentes contra o mesmo produto nunca vendem além do estoque
+
+Roda contra um banco de teste (Supabase com supabase_schema_complete.sql
+aplicado), nunca produção:
+
+    RUN_DB_TESTS=1 SUPABASE_URL=... SUPABASE_SERVICE_ROLE_KEY=... python -m pytest tests/test_order_concurrency.py
+    RUN_DB_TESTS=1 ... python tests/test_order_concurrency.py
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+from fastapi import HTTPException
+from app.core.database import db
+from app.routers.orders import OrderCreate, OrderItem, create_order
+
+PARALLEL_ORDERS = 20
+STOCK = 5
+PRICE = 10.0
+
+pytestmark = pytest.mark.skipif(os.getenv("RUN_DB_TESTS") != "1", reason="RUN_DB_TESTS=1 para rodar contra o banco de teste")
+
+async def place(paciente_id: str, estoque_id: str):
+    order = OrderCreate(
+        paciente_id=paciente_id,
+        items=[OrderItem(estoque_id=estoque_id, quantity=1)],
+        source="admin"
+    )
+    try:
+        return await create_order(order)
+    except HTTPException as e:
+        return e
+
+async def run_parallel_orders():
+    tag = uuid.uuid4().hex[:8]
+    paciente = await db.table("pacientes").insert({"full_name": f"Teste concorrência {tag}"}).execute()
+    product = await db.table("estoque").insert({
+        "name": f"Produto concorrência {tag}",
+        "quantity": STOCK,
+        "sale_price": PRICE,
+        "active": True
+    }).execute()
+    paciente_id, estoque_id = paciente.data[0]["id"], product.data[0]["id"]
+
+    try:
+        results = await asyncio.gather(*[place(paciente_id, estoque_id) for _ in range(PARALLEL_ORDERS)])
+
+        created = [r for r in results if isinstance(r, dict) and r.get("success")]
+        rejected = [r for r in results if isinstance(r, HTTPException)]
+        assert len(created) == STOCK, results
+        assert len(rejected) == PARALLEL_ORDERS - STOCK, results
+        assert all(r.status_code == 409 and r.detail["estoque_ids"] == [estoque_id] for r in rejected)
+        assert all(float(r["total_amount"]) == PRICE for r in created)
+
+        stock = await db.table("estoque").select("quantity").eq("id", estoque_id).single().execute()
+        assert stock.data["quantity"] == 0
+
+        items = await db.table("order_items").select("quantity").eq("estoque_id", estoque_id).execute()
+        assert sum(i["quantity"] for i in items.data) == STOCK
+
+        movements = await db.table("stock_movements").select("quantity").eq("estoque_id", estoque_id).execute()
+        assert sum(m["quantity"] for m in movements.data) == STOCK
+    finally:
+        await db.table("orders").delete().eq("paciente_id", paciente_id).execute()
+        await db.table("estoque").delete().eq("id", estoque_id).execute()
+        await db.table("pacientes").delete().eq("id", paciente_id).execute()
+        await db.close()
+
+def test_parallel_orders_never_oversell():
+    asyncio.run(run_parallel_orders())
+
+if __name__ == "__main__":
+    asyncio.run(run_parallel_orders())
+    print(f"OK: {PARALLEL_ORDERS} pedidos simultâneos, {STOCK} aceitos, {PARALLEL_ORDERS - STOCK} recusados com 409")
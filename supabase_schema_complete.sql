@@ -6,6 +6,9 @@
 -- Enable extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+CREATE EXTENSION IF NOT EXISTS "btree_gist";
+CREATE EXTENSION IF NOT EXISTS "pg_trgm";
+CREATE EXTENSION IF NOT EXISTS "unaccent";
 
 -- ========================================
 -- USERS & AUTHENTICATION
@@ -103,6 +106,18 @@ CREATE TABLE IF NOT EXISTS public.medical_audio_records (
   updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Cache das respostas de IA, endereçado pelo hash da entrada
+-- (áudio ou texto + prompt + modelo)
+CREATE TABLE IF NOT EXISTS public.ai_cache (
+  cache_key TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  model TEXT NOT NULL,
+  response JSONB NOT NULL,
+  hits INTEGER DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  last_used_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- ========================================
 -- PROCEDURES & CATALOG
 -- ========================================
@@ -254,6 +269,18 @@ CREATE TABLE IF NOT EXISTS public.stock_movements (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Previsão de ruptura por produto, recalculada por refresh_stock_forecasts
+CREATE TABLE IF NOT EXISTS public.stock_forecasts (
+  estoque_id UUID PRIMARY KEY REFERENCES public.estoque(id) ON DELETE CASCADE,
+  quantity INTEGER NOT NULL,
+  daily_rate_7d DECIMAL(10,3) NOT NULL DEFAULT 0,
+  daily_rate_30d DECIMAL(10,3) NOT NULL DEFAULT 0,
+  daily_rate DECIMAL(10,3) NOT NULL DEFAULT 0,
+  days_of_cover DECIMAL(10,1),
+  stockout_date DATE,
+  computed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- ========================================
 -- E-COMMERCE / VIRTUAL STORE (PWA)
 -- ========================================
@@ -299,6 +326,13 @@ CREATE TABLE IF NOT EXISTS public.campaigns (
   start_date DATE,
   end_date DATE,
   is_active BOOLEAN DEFAULT TRUE,
+  -- Último disparo em massa da campanha (progresso gravado pelo BulkDispatcher)
+  dispatch_job_id TEXT,
+  dispatch_status TEXT CHECK (dispatch_status IN ('queued', 'running', 'completed', 'failed')),
+  dispatch_total INTEGER DEFAULT 0,
+  dispatch_sent INTEGER DEFAULT 0,
+  dispatch_failed INTEGER DEFAULT 0,
+  dispatch_updated_at TIMESTAMP WITH TIME ZONE,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -352,6 +386,23 @@ CREATE TABLE IF NOT EXISTS public.whatsapp_sessions (
   instance_id TEXT,
   is_active BOOLEAN DEFAULT TRUE,
   last_connected TIMESTAMP WITH TIME ZONE,
+  conversation_step TEXT DEFAULT 'idle',
+  conversation_context JSONB,
+  history_summary TEXT,
+  history_summarized_until TIMESTAMP WITH TIME ZONE,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Outbox de notificações (preenchido por trigger em agendamentos)
+CREATE TABLE IF NOT EXISTS public.notification_outbox (
+  id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+  event_type TEXT NOT NULL CHECK (event_type IN ('appointment_created', 'appointment_cancelled')),
+  agendamento_id UUID REFERENCES public.agendamentos(id) ON DELETE CASCADE,
+  status TEXT CHECK (status IN ('pending', 'processing', 'sent', 'failed')) DEFAULT 'pending',
+  attempts INTEGER DEFAULT 0,
+  last_error TEXT,
+  available_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -518,6 +569,26 @@ CREATE TABLE IF NOT EXISTS public.reports (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Configuração da clínica (linha única). timezone é gravado pela API na
+-- inicialização a partir de CLINIC_TIMEZONE (set_clinic_timezone)
+CREATE TABLE IF NOT EXISTS public.clinic_settings (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  timezone TEXT NOT NULL DEFAULT 'America/Sao_Paulo',
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+INSERT INTO public.clinic_settings (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+-- Agregados diários do dashboard, mantidos por triggers
+-- metric: 'appointments' (dimension = status), 'revenue', 'new_patients'
+CREATE TABLE IF NOT EXISTS public.dashboard_daily_rollups (
+  day DATE NOT NULL,
+  metric TEXT NOT NULL CHECK (metric IN ('appointments', 'revenue', 'new_patients')),
+  dimension TEXT NOT NULL DEFAULT '',
+  value DECIMAL(14,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, metric, dimension)
+);
+
 -- ========================================
 -- INDEXES FOR PERFORMANCE
 -- ========================================
@@ -526,19 +597,108 @@ CREATE INDEX idx_pacientes_cpf ON public.pacientes(cpf);
 CREATE INDEX idx_pacientes_phone ON public.pacientes(phone);
 CREATE INDEX idx_pacientes_whatsapp ON public.pacientes(whatsapp_number);
 CREATE INDEX idx_pacientes_email ON public.pacientes(email);
-CREATE INDEX idx_agendamentos_start_time ON public.agendamentos(start_time);
+CREATE INDEX idx_pacientes_full_name ON public.pacientes(full_name, id);
+CREATE INDEX idx_agendamentos_start_time ON public.agendamentos(start_time, id);
 CREATE INDEX idx_agendamentos_professional ON public.agendamentos(professional_id);
 CREATE INDEX idx_agendamentos_paciente ON public.agendamentos(paciente_id);
 CREATE INDEX idx_agendamentos_status ON public.agendamentos(status);
-CREATE INDEX idx_financeiro_date ON public.financeiro(date);
+CREATE INDEX idx_agendamentos_procedimento_active ON public.agendamentos(procedimento_id) WHERE status <> 'cancelled';
+CREATE INDEX idx_financeiro_date ON public.financeiro(date) INCLUDE (type, status, amount);
 CREATE INDEX idx_financeiro_status ON public.financeiro(status);
 CREATE INDEX idx_orders_status ON public.orders(status);
+CREATE INDEX idx_orders_paciente_created ON public.orders(paciente_id, created_at DESC, id DESC);
+CREATE INDEX idx_estoque_name ON public.estoque(name, id);
+CREATE INDEX idx_procedimentos_name ON public.procedimentos(name, id);
 CREATE INDEX idx_stock_movements_created_at ON public.stock_movements(created_at);
-CREATE INDEX idx_whatsapp_messages_chat_id ON public.whatsapp_messages(chat_id);
+CREATE INDEX idx_stock_movements_reference ON public.stock_movements(reference_id);
+CREATE INDEX idx_estoque_low_stock ON public.estoque(name, id) WHERE active AND quantity <= min_quantity;
+CREATE INDEX idx_stock_forecasts_stockout ON public.stock_forecasts(stockout_date, estoque_id) WHERE stockout_date IS NOT NULL;
+CREATE INDEX idx_orders_created_at ON public.orders(created_at);
+CREATE INDEX idx_whatsapp_messages_chat_id ON public.whatsapp_messages(chat_id, created_at DESC);
 CREATE INDEX idx_whatsapp_messages_created_at ON public.whatsapp_messages(created_at);
 CREATE INDEX idx_medical_audio_status ON public.medical_audio_records(transcription_status);
+CREATE INDEX idx_medical_audio_paciente_created ON public.medical_audio_records(paciente_id, created_at DESC, id DESC);
 CREATE INDEX idx_notifications_user ON public.notifications(user_id);
 CREATE INDEX idx_notifications_paciente ON public.notifications(paciente_id);
+CREATE INDEX idx_ai_cache_last_used ON public.ai_cache(last_used_at);
+CREATE INDEX idx_notification_outbox_pending ON public.notification_outbox(available_at) WHERE status IN ('pending', 'processing');
+
+-- ========================================
+-- CONSTRAINTS
+-- ========================================
+
+-- Em um banco que já tem dados, estas constraints não interrompem o script:
+-- os CHECKs entram como NOT VALID (já valem para toda escrita nova) e só são
+-- validados quando nenhuma linha existente os viola; a exclusão de
+-- sobreposição só é criada sem conflitos. Cada pendência gera um WARNING.
+--
+-- Linhas conflitantes:
+--   agendamentos_valid_range -> SELECT id, start_time, end_time FROM public.agendamentos WHERE end_time <= start_time;
+--     corrigir end_time (ou excluir o registro) e rodar:
+--     ALTER TABLE public.agendamentos VALIDATE CONSTRAINT agendamentos_valid_range;
+--   agendamentos_no_overlap  -> SELECT a.id, b.id, a.professional_id, a.start_time, b.start_time
+--                                 FROM public.agendamentos a JOIN public.agendamentos b
+--                                   ON a.professional_id = b.professional_id AND a.id < b.id
+--                                  AND a.start_time < b.end_time AND b.start_time < a.end_time
+--                                WHERE a.status <> 'cancelled' AND b.status <> 'cancelled';
+--     remarcar ou cancelar (status = 'cancelled') um dos dois e rodar de novo o bloco DO abaixo
+--   estoque_quantity_non_negative -> SELECT id, name, quantity FROM public.estoque WHERE quantity < 0;
+--     fazer o inventário, registrar o ajuste em stock_movements (type = 'adjustment')
+--     e rodar: ALTER TABLE public.estoque VALIDATE CONSTRAINT estoque_quantity_non_negative;
+
+ALTER TABLE public.agendamentos
+  ADD CONSTRAINT agendamentos_valid_range CHECK (end_time > start_time) NOT VALID;
+
+-- Estoque nunca negativo (a baixa de place_order já verifica; esta é a garantia final)
+ALTER TABLE public.estoque
+  ADD CONSTRAINT estoque_quantity_non_negative CHECK (quantity >= 0) NOT VALID;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM public.agendamentos WHERE end_time <= start_time) THEN
+        RAISE WARNING 'agendamentos_valid_range left NOT VALID: appointments with end_time <= start_time exist';
+    ELSE
+        ALTER TABLE public.agendamentos VALIDATE CONSTRAINT agendamentos_valid_range;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM public.estoque WHERE quantity < 0) THEN
+        RAISE WARNING 'estoque_quantity_non_negative left NOT VALID: products with negative quantity exist';
+    ELSE
+        ALTER TABLE public.estoque VALIDATE CONSTRAINT estoque_quantity_non_negative;
+    END IF;
+END;
+$$;
+
+-- Agenda sem sobreposição: o próprio banco rejeita (23P01) dois
+-- agendamentos ativos do mesmo profissional com intervalos que se cruzam
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'agendamentos_no_overlap') THEN
+        RETURN;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM public.agendamentos
+        WHERE status <> 'cancelled' AND end_time <= start_time
+    ) OR EXISTS (
+        SELECT 1
+        FROM public.agendamentos a
+        JOIN public.agendamentos b
+          ON a.professional_id = b.professional_id AND a.id < b.id
+         AND a.start_time < b.end_time AND b.start_time < a.end_time
+        WHERE a.status <> 'cancelled' AND b.status <> 'cancelled'
+    ) THEN
+        RAISE WARNING 'agendamentos_no_overlap not created: overlapping or inverted active appointments exist';
+        RETURN;
+    END IF;
+
+    ALTER TABLE public.agendamentos
+      ADD CONSTRAINT agendamentos_no_overlap EXCLUDE USING gist (
+        professional_id WITH =,
+        tstzrange(start_time, end_time) WITH &&
+      ) WHERE (status <> 'cancelled');
+END;
+$$;
 
 -- ========================================
 -- ROW LEVEL SECURITY (RLS)
@@ -548,10 +708,14 @@ ALTER TABLE public.profiles ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.pacientes ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.anamnese ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.medical_audio_records ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ai_cache ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.dashboard_daily_rollups ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.clinic_settings ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.procedimentos ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.agendamentos ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.financeiro ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.estoque ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.stock_forecasts ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.orders ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.whatsapp_messages ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.integrations ENABLE ROW LEVEL SECURITY;
@@ -564,10 +728,14 @@ CREATE POLICY "Authenticated users full access" ON public.agendamentos FOR ALL U
 CREATE POLICY "Authenticated users full access" ON public.financeiro FOR ALL USING (auth.role() = 'authenticated');
 CREATE POLICY "Authenticated users full access" ON public.procedimentos FOR ALL USING (auth.role() = 'authenticated');
 CREATE POLICY "Authenticated users full access" ON public.estoque FOR ALL USING (auth.role() = 'authenticated');
+CREATE POLICY "Authenticated users full access" ON public.stock_forecasts FOR ALL USING (auth.role() = 'authenticated');
+CREATE POLICY "Authenticated users full access" ON public.clinic_settings FOR ALL USING (auth.role() = 'authenticated');
 
 -- Public access for PWA
 CREATE POLICY "Public can view active products" ON public.estoque FOR SELECT USING (is_for_sale = TRUE AND active = TRUE);
 CREATE POLICY "Public can view active procedures" ON public.procedimentos FOR SELECT USING (active = TRUE AND available_for_online_booking = TRUE);
+-- Os triggers de agregados leem o fuso também em escritas feitas pelo PWA
+CREATE POLICY "Public can view clinic settings" ON public.clinic_settings FOR SELECT USING (TRUE);
 
 -- ========================================
 -- FUNCTIONS & TRIGGERS
@@ -589,6 +757,7 @@ CREATE TRIGGER update_procedimentos_updated_at BEFORE UPDATE ON public.procedime
 CREATE TRIGGER update_financeiro_updated_at BEFORE UPDATE ON public.financeiro FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_estoque_updated_at BEFORE UPDATE ON public.estoque FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_medical_audio_updated_at BEFORE UPDATE ON public.medical_audio_records FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_notification_outbox_updated_at BEFORE UPDATE ON public.notification_outbox FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
 -- Auto-calculate order totals
 CREATE OR REPLACE FUNCTION calculate_order_total()
@@ -608,3 +777,561 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER update_order_total
 AFTER INSERT OR UPDATE OR DELETE ON public.order_items
 FOR EACH ROW EXECUTE FUNCTION calculate_order_total();
+
+-- Enfileira notificações de agendamento na mesma transação da escrita
+CREATE OR REPLACE FUNCTION enqueue_appointment_notification()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO public.notification_outbox (event_type, agendamento_id)
+        VALUES ('appointment_created', NEW.id);
+    ELSIF NEW.status = 'cancelled' AND OLD.status IS DISTINCT FROM 'cancelled' THEN
+        INSERT INTO public.notification_outbox (event_type, agendamento_id)
+        VALUES ('appointment_cancelled', NEW.id);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER enqueue_appointment_notification
+AFTER INSERT OR UPDATE OF status ON public.agendamentos
+FOR EACH ROW EXECUTE FUNCTION enqueue_appointment_notification();
+
+-- Reserva um lote do outbox para entrega (seguro com vários workers).
+-- Itens presos em 'processing' há mais de 5 minutos voltam a ser elegíveis.
+CREATE OR REPLACE FUNCTION claim_notifications(batch_size INTEGER DEFAULT 20)
+RETURNS SETOF public.notification_outbox AS $$
+    UPDATE public.notification_outbox o
+    SET status = 'processing', attempts = o.attempts + 1
+    WHERE o.id IN (
+        SELECT id FROM public.notification_outbox
+        WHERE (status = 'pending' AND available_at <= NOW())
+           OR (status = 'processing' AND updated_at < NOW() - INTERVAL '5 minutes')
+        ORDER BY available_at
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.*;
+$$ LANGUAGE sql;
+
+-- Reserva áudios pendentes para os workers de transcrição.
+-- Itens presos em 'processing' há mais de 30 minutos voltam para a fila.
+CREATE OR REPLACE FUNCTION claim_transcription_jobs(batch_size INTEGER DEFAULT 1)
+RETURNS SETOF public.medical_audio_records AS $$
+    UPDATE public.medical_audio_records r
+    SET transcription_status = 'processing'
+    WHERE r.id IN (
+        SELECT id FROM public.medical_audio_records
+        WHERE transcription_status = 'pending'
+           OR (transcription_status = 'processing' AND updated_at < NOW() - INTERVAL '30 minutes')
+        ORDER BY created_at
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING r.*;
+$$ LANGUAGE sql;
+
+-- Marca um acerto do cache (uso recente protege a entrada da remoção)
+CREATE OR REPLACE FUNCTION touch_ai_cache(key TEXT)
+RETURNS VOID AS $$
+    UPDATE public.ai_cache
+    SET hits = hits + 1, last_used_at = NOW()
+    WHERE cache_key = key;
+$$ LANGUAGE sql;
+
+-- Remove entradas expiradas e, acima do limite, as usadas há mais tempo
+CREATE OR REPLACE FUNCTION evict_ai_cache(max_entries INTEGER DEFAULT 50000, max_age_days INTEGER DEFAULT 90)
+RETURNS INTEGER AS $$
+DECLARE
+    removed INTEGER;
+    overflow INTEGER;
+BEGIN
+    DELETE FROM public.ai_cache
+    WHERE last_used_at < NOW() - make_interval(days => max_age_days);
+    GET DIAGNOSTICS removed = ROW_COUNT;
+
+    DELETE FROM public.ai_cache
+    WHERE cache_key IN (
+        SELECT cache_key FROM public.ai_cache
+        ORDER BY last_used_at DESC
+        OFFSET max_entries
+    );
+    GET DIAGNOSTICS overflow = ROW_COUNT;
+
+    RETURN removed + overflow;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fuso da clínica: fonte única para triggers e funções SQL
+CREATE OR REPLACE FUNCTION clinic_timezone()
+RETURNS TEXT AS $$
+    SELECT COALESCE((SELECT timezone FROM public.clinic_settings WHERE id), 'UTC');
+$$ LANGUAGE sql STABLE;
+
+-- Data local da clínica (os agregados diários seguem o fuso da agenda)
+CREATE OR REPLACE FUNCTION clinic_date(ts TIMESTAMP WITH TIME ZONE)
+RETURNS DATE AS $$
+    SELECT (ts AT TIME ZONE clinic_timezone())::date;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION bump_dashboard_rollup(p_day DATE, p_metric TEXT, p_dimension TEXT, p_delta DECIMAL)
+RETURNS VOID AS $$
+    INSERT INTO public.dashboard_daily_rollups (day, metric, dimension, value)
+    VALUES (p_day, p_metric, COALESCE(p_dimension, ''), p_delta)
+    ON CONFLICT (day, metric, dimension)
+    DO UPDATE SET value = public.dashboard_daily_rollups.value + EXCLUDED.value;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION rollup_agendamentos()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_dashboard_rollup(clinic_date(OLD.start_time), 'appointments', OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_dashboard_rollup(clinic_date(NEW.start_time), 'appointments', NEW.status, 1);
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER rollup_agendamentos
+AFTER INSERT OR DELETE OR UPDATE OF status, start_time ON public.agendamentos
+FOR EACH ROW EXECUTE FUNCTION rollup_agendamentos();
+
+CREATE OR REPLACE FUNCTION rollup_financeiro()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.type = 'income' AND OLD.status = 'paid' AND OLD.date IS NOT NULL THEN
+        PERFORM bump_dashboard_rollup(OLD.date, 'revenue', '', -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.type = 'income' AND NEW.status = 'paid' AND NEW.date IS NOT NULL THEN
+        PERFORM bump_dashboard_rollup(NEW.date, 'revenue', '', NEW.amount);
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER rollup_financeiro
+AFTER INSERT OR DELETE OR UPDATE OF type, status, amount, date ON public.financeiro
+FOR EACH ROW EXECUTE FUNCTION rollup_financeiro();
+
+CREATE OR REPLACE FUNCTION rollup_pacientes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_dashboard_rollup(clinic_date(NEW.created_at), 'new_patients', '', 1);
+    ELSE
+        PERFORM bump_dashboard_rollup(clinic_date(OLD.created_at), 'new_patients', '', -1);
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER rollup_pacientes
+AFTER INSERT OR DELETE ON public.pacientes
+FOR EACH ROW EXECUTE FUNCTION rollup_pacientes();
+
+-- Recalcula os agregados a partir das tabelas de origem (carga inicial ou correção).
+-- Opcional, com pg_cron:
+--   SELECT cron.schedule('refresh-dashboard-rollups', '0 4 * * *', 'SELECT refresh_dashboard_rollups()');
+CREATE OR REPLACE FUNCTION refresh_dashboard_rollups()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE public.dashboard_daily_rollups IN EXCLUSIVE MODE;
+    DELETE FROM public.dashboard_daily_rollups;
+
+    INSERT INTO public.dashboard_daily_rollups (day, metric, dimension, value)
+    SELECT clinic_date(start_time), 'appointments', COALESCE(status, ''), COUNT(*)
+    FROM public.agendamentos
+    GROUP BY 1, 3;
+
+    INSERT INTO public.dashboard_daily_rollups (day, metric, dimension, value)
+    SELECT date, 'revenue', '', SUM(amount)
+    FROM public.financeiro
+    WHERE type = 'income' AND status = 'paid' AND date IS NOT NULL
+    GROUP BY date;
+
+    INSERT INTO public.dashboard_daily_rollups (day, metric, dimension, value)
+    SELECT clinic_date(created_at), 'new_patients', '', COUNT(*)
+    FROM public.pacientes
+    WHERE created_at IS NOT NULL
+    GROUP BY 1;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_dashboard_rollups();
+
+-- Grava o fuso da clínica (chamada pela API com settings.CLINIC_TIMEZONE).
+-- Se mudou, os dias dos agregados mudam junto: recalcula. Retorna TRUE nesse caso
+CREATE OR REPLACE FUNCTION set_clinic_timezone(tz TEXT)
+RETURNS BOOLEAN AS $$
+BEGIN
+    -- Valida o nome (fuso desconhecido gera erro aqui, não nos triggers)
+    PERFORM NOW() AT TIME ZONE tz;
+
+    IF clinic_timezone() = tz THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO public.clinic_settings (id, timezone, updated_at)
+    VALUES (TRUE, tz, NOW())
+    ON CONFLICT (id) DO UPDATE SET timezone = EXCLUDED.timezone, updated_at = EXCLUDED.updated_at;
+
+    PERFORM refresh_dashboard_rollups();
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Faturamento pago por mês (YYYY-MM), a partir dos agregados diários
+-- (start_date já vem no fuso da clínica, calculado pela API)
+CREATE OR REPLACE FUNCTION revenue_by_month(start_date DATE)
+RETURNS TABLE (month TEXT, value DECIMAL) AS $$
+    SELECT to_char(day, 'YYYY-MM'), SUM(value)
+    FROM public.dashboard_daily_rollups
+    WHERE metric = 'revenue' AND day >= start_date
+    GROUP BY 1
+    ORDER BY 1;
+$$ LANGUAGE sql STABLE;
+
+-- Procedimentos com mais agendamentos (exceto cancelados)
+CREATE OR REPLACE FUNCTION top_procedures(max_results INTEGER DEFAULT 5)
+RETURNS TABLE (name TEXT, count BIGINT) AS $$
+    SELECT p.name, SUM(c.total)::BIGINT
+    FROM (
+        SELECT procedimento_id, COUNT(*) AS total
+        FROM public.agendamentos
+        WHERE status <> 'cancelled'
+        GROUP BY procedimento_id
+    ) c
+    JOIN public.procedimentos p ON p.id = c.procedimento_id
+    GROUP BY p.name
+    ORDER BY 2 DESC
+    LIMIT max_results;
+$$ LANGUAGE sql STABLE;
+
+-- Totais financeiros; month = 'YYYY-MM' ou NULL para todo o histórico
+CREATE OR REPLACE FUNCTION financial_summary(month TEXT DEFAULT NULL)
+RETURNS TABLE (income DECIMAL, expense DECIMAL, pending DECIMAL) AS $$
+    SELECT
+        COALESCE(SUM(amount) FILTER (WHERE type = 'income' AND status = 'paid'), 0),
+        COALESCE(SUM(amount) FILTER (WHERE type = 'expense' AND status = 'paid'), 0),
+        COALESCE(SUM(amount) FILTER (WHERE status = 'pending'), 0)
+    FROM public.financeiro
+    WHERE month IS NULL
+       OR (date >= to_date(month || '-01', 'YYYY-MM-DD')
+           AND date < to_date(month || '-01', 'YYYY-MM-DD') + INTERVAL '1 month');
+$$ LANGUAGE sql STABLE;
+
+-- ========================================
+-- BUSCA DE PACIENTES (trigramas, sem acento)
+-- ========================================
+
+-- unaccent() não é IMMUTABLE; o wrapper com dicionário fixo pode ser indexado
+CREATE OR REPLACE FUNCTION immutable_unaccent(value TEXT)
+RETURNS TEXT AS $$
+    SELECT public.unaccent('public.unaccent', value);
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE OR REPLACE FUNCTION only_digits(value TEXT)
+RETURNS TEXT AS $$
+    SELECT regexp_replace(COALESCE(value, ''), '\D', '', 'g');
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX idx_pacientes_name_trgm ON public.pacientes USING gin (lower(immutable_unaccent(full_name)) gin_trgm_ops);
+CREATE INDEX idx_pacientes_cpf_trgm ON public.pacientes USING gin (only_digits(cpf) gin_trgm_ops);
+CREATE INDEX idx_pacientes_phone_trgm ON public.pacientes USING gin (only_digits(phone) gin_trgm_ops);
+CREATE INDEX idx_pacientes_whatsapp_trgm ON public.pacientes USING gin (only_digits(whatsapp_number) gin_trgm_ops);
+CREATE INDEX idx_pacientes_email_trgm ON public.pacientes USING gin (lower(email) gin_trgm_ops);
+
+-- Busca ordenada por relevância, tolerante a erros de digitação no nome
+-- (word_similarity) e por trechos de CPF, telefone ou e-mail.
+-- Paginação por (score, id) da última linha da página anterior.
+-- O termo é normalizado uma vez (variáveis) e cada critério é um ramo
+-- separado do UNION comparando a expressão indexada com um valor fixo, para
+-- que cada ramo use seu índice GIN de trigramas (um OR sobre colunas
+-- diferentes, com o termo vindo de um JOIN, vira varredura sequencial).
+-- Conferir o plano com valores literais, p. ex.:
+--   SET pg_trgm.word_similarity_threshold = 0.4;
+--   EXPLAIN ANALYZE SELECT id FROM public.pacientes WHERE 'maria' <% lower(immutable_unaccent(full_name));
+--   EXPLAIN ANALYZE SELECT id FROM public.pacientes WHERE only_digits(cpf) LIKE '%12345%';
+-- (esperado: Bitmap Index Scan em idx_pacientes_name_trgm / idx_pacientes_cpf_trgm)
+CREATE OR REPLACE FUNCTION search_patients(
+    q TEXT,
+    max_results INTEGER DEFAULT 20,
+    after_score REAL DEFAULT NULL,
+    after_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    full_name TEXT,
+    cpf TEXT,
+    phone TEXT,
+    whatsapp_number TEXT,
+    email TEXT,
+    birth_date DATE,
+    score REAL
+) AS $$
+DECLARE
+    term TEXT := lower(immutable_unaccent(trim(q)));
+    email_pattern TEXT := '%' || replace(replace(replace(lower(trim(q)), '\', '\\'), '%', '\%'), '_', '\_') || '%';
+    digits_pattern TEXT := '%' || only_digits(q) || '%';
+    search_digits BOOLEAN := length(only_digits(q)) >= 3;
+    search_email BOOLEAN := length(lower(immutable_unaccent(trim(q)))) >= 3;
+BEGIN
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT p.id FROM public.pacientes p
+        WHERE term <% lower(immutable_unaccent(p.full_name))
+        UNION
+        SELECT p.id FROM public.pacientes p
+        WHERE search_digits AND only_digits(p.cpf) LIKE digits_pattern
+        UNION
+        SELECT p.id FROM public.pacientes p
+        WHERE search_digits AND only_digits(p.phone) LIKE digits_pattern
+        UNION
+        SELECT p.id FROM public.pacientes p
+        WHERE search_digits AND only_digits(p.whatsapp_number) LIKE digits_pattern
+        UNION
+        SELECT p.id FROM public.pacientes p
+        WHERE search_email AND lower(p.email) LIKE email_pattern
+    ),
+    matches AS (
+        SELECT
+            p.id, p.full_name, p.cpf, p.phone, p.whatsapp_number, p.email, p.birth_date,
+            GREATEST(
+                word_similarity(term, lower(immutable_unaccent(p.full_name))),
+                CASE WHEN search_digits AND (
+                    only_digits(p.cpf) LIKE digits_pattern
+                    OR only_digits(p.phone) LIKE digits_pattern
+                    OR only_digits(p.whatsapp_number) LIKE digits_pattern
+                ) THEN 1 ELSE 0 END,
+                CASE WHEN lower(p.email) LIKE email_pattern THEN 0.9 ELSE 0 END
+            )::REAL AS match_score
+        FROM candidates c
+        JOIN public.pacientes p ON p.id = c.id
+    )
+    SELECT m.id, m.full_name, m.cpf, m.phone, m.whatsapp_number, m.email, m.birth_date, m.match_score
+    FROM matches m
+    WHERE after_id IS NULL OR (m.match_score, m.id) < (after_score, after_id)
+    ORDER BY m.match_score DESC, m.id DESC
+    LIMIT max_results;
+END;
+$$ LANGUAGE plpgsql STABLE
+SET pg_trgm.word_similarity_threshold = 0.4;
+
+-- ========================================
+-- PEDIDOS
+-- ========================================
+
+-- Cria pedido, itens, baixa de estoque e movimentações em uma transação.
+-- p_items: [{"estoque_id", "quantity"}]; o preço vem de estoque.sale_price,
+-- lido com as linhas já travadas (em ordem de id, sem deadlock entre pedidos
+-- concorrentes). A baixa só acontece se houver saldo; caso contrário nada é
+-- gravado. Erros de negócio: SQLSTATE P0001 com HINT 'invalid_order_item',
+-- 'product_unavailable' ou 'insufficient_stock' (DETAIL = ids dos produtos).
+CREATE OR REPLACE FUNCTION place_order(
+    p_paciente_id UUID,
+    p_items JSONB,
+    p_shipping_address TEXT DEFAULT NULL,
+    p_source TEXT DEFAULT 'pwa'
+)
+RETURNS public.orders AS $$
+DECLARE
+    new_order public.orders;
+    requested_count INTEGER;
+    updated_count INTEGER;
+    problem TEXT;
+BEGIN
+    IF p_items IS NULL OR jsonb_typeof(p_items) <> 'array' OR jsonb_array_length(p_items) = 0 THEN
+        RAISE EXCEPTION 'Order has no items' USING ERRCODE = 'P0001', HINT = 'invalid_order_item';
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+        WHERE i.estoque_id IS NULL OR i.quantity IS NULL OR i.quantity <= 0
+    ) THEN
+        RAISE EXCEPTION 'Invalid order item' USING ERRCODE = 'P0001', HINT = 'invalid_order_item';
+    END IF;
+
+    PERFORM 1
+    FROM public.estoque
+    WHERE id IN (SELECT i.estoque_id FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID))
+    ORDER BY id
+    FOR UPDATE;
+
+    SELECT string_agg(i.estoque_id::TEXT, ', ')
+    INTO problem
+    FROM (SELECT DISTINCT i.estoque_id FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID)) i
+    LEFT JOIN public.estoque e ON e.id = i.estoque_id
+    WHERE e.id IS NULL OR e.active IS NOT TRUE OR e.sale_price IS NULL;
+
+    IF problem IS NOT NULL THEN
+        RAISE EXCEPTION 'Product unavailable'
+            USING ERRCODE = 'P0001', HINT = 'product_unavailable', DETAIL = problem;
+    END IF;
+
+    WITH requested AS (
+        SELECT i.estoque_id, SUM(i.quantity) AS quantity
+        FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+        GROUP BY i.estoque_id
+    ),
+    updated AS (
+        UPDATE public.estoque e
+        SET quantity = e.quantity - r.quantity
+        FROM requested r
+        WHERE e.id = r.estoque_id AND e.quantity >= r.quantity
+        RETURNING e.id
+    )
+    SELECT (SELECT COUNT(*) FROM requested), (SELECT COUNT(*) FROM updated)
+    INTO requested_count, updated_count;
+
+    IF updated_count <> requested_count THEN
+        SELECT string_agg(r.estoque_id::TEXT, ', ')
+        INTO problem
+        FROM (
+            SELECT i.estoque_id, SUM(i.quantity) AS quantity
+            FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+            GROUP BY i.estoque_id
+        ) r
+        JOIN public.estoque e ON e.id = r.estoque_id
+        WHERE COALESCE(e.quantity, 0) < r.quantity;
+
+        RAISE EXCEPTION 'Insufficient stock'
+            USING ERRCODE = 'P0001', HINT = 'insufficient_stock', DETAIL = problem;
+    END IF;
+
+    INSERT INTO public.orders (paciente_id, total_amount, shipping_address, source, status)
+    SELECT p_paciente_id, SUM(i.quantity * e.sale_price), p_shipping_address, p_source, 'pending'
+    FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+    JOIN public.estoque e ON e.id = i.estoque_id
+    RETURNING * INTO new_order;
+
+    INSERT INTO public.order_items (order_id, estoque_id, quantity, unit_price, subtotal)
+    SELECT new_order.id, i.estoque_id, i.quantity, e.sale_price, i.quantity * e.sale_price
+    FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+    JOIN public.estoque e ON e.id = i.estoque_id;
+
+    INSERT INTO public.stock_movements (estoque_id, type, quantity, reason, reference_id)
+    SELECT i.estoque_id, 'out', SUM(i.quantity), 'order', new_order.id
+    FROM jsonb_to_recordset(p_items) AS i(estoque_id UUID, quantity INTEGER)
+    GROUP BY i.estoque_id;
+
+    RETURN new_order;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ========================================
+-- ESTOQUE: REPOSIÇÃO
+-- ========================================
+
+-- Produtos ativos no mínimo ou abaixo dele (comparação entre colunas, que o
+-- PostgREST não expressa), com a previsão de ruptura já calculada.
+-- Usa o índice parcial idx_estoque_low_stock.
+CREATE OR REPLACE FUNCTION low_stock_products()
+RETURNS TABLE (
+    id UUID,
+    name TEXT,
+    sku TEXT,
+    category TEXT,
+    unit TEXT,
+    quantity INTEGER,
+    min_quantity INTEGER,
+    daily_rate DECIMAL,
+    stockout_date DATE
+) AS $$
+    SELECT e.id, e.name, e.sku, e.category, e.unit, e.quantity, e.min_quantity, f.daily_rate, f.stockout_date
+    FROM public.estoque e
+    LEFT JOIN public.stock_forecasts f ON f.estoque_id = e.id
+    WHERE e.active AND e.quantity <= e.min_quantity
+    ORDER BY e.name, e.id;
+$$ LANGUAGE sql STABLE;
+
+-- Recalcula stock_forecasts: série diária de consumo por produto (saídas em
+-- stock_movements e itens de pedidos que não geraram movimentação), médias
+-- móveis de 7 e 30 dias por janela e data projetada de ruptura usando a
+-- maior das duas taxas. Retorna o número de produtos atualizados (0 quando
+-- outra execução já está em andamento).
+-- Opcional, com pg_cron:
+--   SELECT cron.schedule('refresh-stock-forecasts', '0 * * * *', 'SELECT refresh_stock_forecasts()');
+CREATE OR REPLACE FUNCTION refresh_stock_forecasts()
+RETURNS INTEGER AS $$
+DECLARE
+    today DATE := clinic_date(NOW());
+    since TIMESTAMP WITH TIME ZONE := ((clinic_date(NOW()) - 29)::TIMESTAMP AT TIME ZONE clinic_timezone());
+    refreshed INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('refresh_stock_forecasts')) THEN
+        RETURN 0;
+    END IF;
+
+    WITH consumption AS (
+        SELECT sm.estoque_id, clinic_date(sm.created_at) AS day, sm.quantity
+        FROM public.stock_movements sm
+        WHERE sm.type = 'out' AND sm.created_at >= since
+
+        UNION ALL
+
+        -- Pedidos anteriores a place_order não têm movimentação própria
+        SELECT oi.estoque_id, clinic_date(o.created_at), oi.quantity
+        FROM public.order_items oi
+        JOIN public.orders o ON o.id = oi.order_id
+        WHERE o.created_at >= since
+          AND o.status <> 'cancelled'
+          AND NOT EXISTS (
+              SELECT 1 FROM public.stock_movements sm
+              WHERE sm.reference_id = o.id AND sm.estoque_id = oi.estoque_id
+          )
+    ),
+    daily AS (
+        SELECT e.id AS estoque_id, d.day, COALESCE(SUM(c.quantity), 0) AS quantity
+        FROM public.estoque e
+        CROSS JOIN generate_series(today - 29, today, INTERVAL '1 day') AS d(day)
+        LEFT JOIN consumption c ON c.estoque_id = e.id AND c.day = d.day::DATE
+        WHERE e.active
+        GROUP BY e.id, d.day
+    ),
+    rolling AS (
+        SELECT
+            estoque_id,
+            day,
+            AVG(quantity) OVER (PARTITION BY estoque_id ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS rate_7d,
+            AVG(quantity) OVER (PARTITION BY estoque_id ORDER BY day ROWS BETWEEN 29 PRECEDING AND CURRENT ROW) AS rate_30d
+        FROM daily
+    ),
+    rates AS (
+        SELECT e.id AS estoque_id, e.quantity, r.rate_7d, r.rate_30d, GREATEST(r.rate_7d, r.rate_30d) AS rate
+        FROM rolling r
+        JOIN public.estoque e ON e.id = r.estoque_id
+        WHERE r.day::DATE = today
+    )
+    INSERT INTO public.stock_forecasts (
+        estoque_id, quantity, daily_rate_7d, daily_rate_30d, daily_rate, days_of_cover, stockout_date, computed_at
+    )
+    SELECT
+        estoque_id,
+        COALESCE(quantity, 0),
+        rate_7d,
+        rate_30d,
+        rate,
+        CASE WHEN rate > 0 THEN COALESCE(quantity, 0) / rate END,
+        CASE WHEN rate > 0 THEN today + FLOOR(COALESCE(quantity, 0) / rate)::INTEGER END,
+        NOW()
+    FROM rates
+    ON CONFLICT (estoque_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        daily_rate_7d = EXCLUDED.daily_rate_7d,
+        daily_rate_30d = EXCLUDED.daily_rate_30d,
+        daily_rate = EXCLUDED.daily_rate,
+        days_of_cover = EXCLUDED.days_of_cover,
+        stockout_date = EXCLUDED.stockout_date,
+        computed_at = EXCLUDED.computed_at;
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+
+    -- Produtos desativados desde a última execução
+    DELETE FROM public.stock_forecasts WHERE computed_at < NOW();
+
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;